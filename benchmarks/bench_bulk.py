@@ -0,0 +1,58 @@
+"""Throughput of the bulk quest import and the streaming exporters.
+
+    python -m benchmarks.bench_bulk --rows 1000000
+"""
+import argparse
+import os
+import random
+import time
+from benchmarks.common import use_temp_database, quiet_engine, WORDS
+
+
+def synthetic_quests(avatar_id, category_names, count, seed=42):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield {
+            "avatar_id": avatar_id,
+            "quest_name": " ".join(rng.sample(WORDS, 3)),
+            "category_name": rng.choice(category_names),
+            "completed": rng.random() < 0.3,
+            "exp_amount": rng.randint(1, 50),
+            "due_date": f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        }
+
+
+def report(label, rows, seconds):
+    print(f"{label:14} {rows:>9} rows in {seconds:7.2f} s  -> {rows / seconds:>10,.0f} rows/sec")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    database_path = use_temp_database()
+    from models import DataManager, setup_database
+    from models.quest_io import write_csv, write_jsonl
+
+    quiet_engine()
+    setup_database()
+    db = DataManager()
+    avatar = db.get_avatar()
+    category_names = [category.category_name for category in db.get_categories()]
+
+    start = time.perf_counter()
+    inserted = db.bulk_add_quests(synthetic_quests(avatar.id, category_names, args.rows), args.batch_size)
+    report("bulk import", inserted, time.perf_counter() - start)
+
+    for label, writer, extension in (("export csv", write_csv, "csv"), ("export jsonl", write_jsonl, "jsonl")):
+        path = os.path.join(os.path.dirname(database_path), f"export.{extension}")
+        start = time.perf_counter()
+        with open(path, "w", newline="", encoding="utf-8") as file:
+            exported = writer(db.iter_quests(batch_size=args.batch_size), file)
+        report(label, exported, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Latency of the DataManager data paths on synthetic avatars, categories and quests.
+
+Prints a JSON report (p50 / p95 / p99 latency and ops/sec per operation) so runs
+can be compared across commits, optionally against a previous report.
+
+    python -m benchmarks.bench_data_manager --avatars 100 --quests-per-avatar 1000 --output before.json
+    python -m benchmarks.bench_data_manager --avatars 100 --quests-per-avatar 1000 --baseline before.json
+    python -m benchmarks.bench_data_manager --backend memory
+"""
+import argparse
+import json
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+from benchmarks.common import use_temp_database, use_memory_database, quiet_engine, seed_categories, \
+    seed_avatars, seed_quests, measure, summarize, WORDS
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--avatars", type=int, default=10)
+    parser.add_argument("--categories", type=int, default=8)
+    parser.add_argument("--quests-per-avatar", type=int, default=1000)
+    parser.add_argument("--tags", type=int, default=8,
+                        help="Tags seeded on the quests, each one on half as many quests as the previous one")
+    parser.add_argument("--ops", type=int, default=200, help="Timed calls per operation")
+    parser.add_argument("--memory", action="store_true", help="Use :memory: instead of a temp file")
+    parser.add_argument("--backend", choices=["sql", "memory", "write-through"], default="sql",
+                        help="Storage of the DataManager: SQLite, a memory snapshot of it or a memory cache in front of it")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the report to this file instead of stdout")
+    parser.add_argument("--baseline", help="Previous report, adds the p50 / p99 change of each operation")
+    args = parser.parse_args()
+
+    database = ":memory:" if args.memory else use_temp_database()
+    if args.memory:
+        use_memory_database()
+    from models import DataManager, setup_database
+    from models.backends import default_backend
+    from models.memory_backend import MemoryBackend
+    import sqlalchemy
+
+    quiet_engine()
+    setup_database()
+    rng = random.Random(args.seed)
+    category_ids = seed_categories(args.categories)
+    avatar_ids = seed_avatars(args.avatars, seed=args.seed)
+    for avatar_id in avatar_ids:
+        seed_quests(avatar_id, category_ids, args.quests_per_avatar, seed=args.seed + avatar_id)
+    seeder = DataManager()
+    tag_names = [f"tag{index}" for index in range(args.tags)]
+    for avatar in seeder.list_avatars():
+        avatar_quest_ids = [quest["id"] for quest in seeder.get_avatar_quests(avatar)]
+        for index, tag_name in enumerate(tag_names):
+            seeder.add_tags(rng.sample(avatar_quest_ids, len(avatar_quest_ids) >> (index + 1)), [tag_name])
+
+    if args.backend == "memory":
+        backend = MemoryBackend()
+        backend.load(default_backend())
+    elif args.backend == "write-through":
+        backend = MemoryBackend(backing=default_backend())
+    else:
+        backend = default_backend()
+    db = DataManager(backend=backend)
+    avatars = {avatar.id: avatar for avatar in db.list_avatars()}
+    category_names = [category.category_name for category in db.get_categories()]
+    quest_ids = {avatar_id: [quest["id"] for quest in db.get_avatar_quests(avatars[avatar_id])]
+                 for avatar_id in avatar_ids}
+    added_ids = []
+
+    def random_quest_id():
+        return rng.choice(quest_ids[rng.choice(avatar_ids)])
+
+    def add_quest():
+        added_ids.append(db.add_quest(
+            rng.choice(avatar_ids), " ".join(rng.sample(WORDS, 3)), rng.choice(category_names),
+            rng.randint(1, 50), f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        ))
+
+    operations = {
+        "get_avatar_quests": lambda: db.get_avatar_quests(avatars[rng.choice(avatar_ids)]),
+        "get_avatar_experience_by_category": lambda: db.get_avatar_experience_by_category(rng.choice(avatar_ids)),
+        "add_quest": add_quest,
+        "toggle_quest": lambda: db.toggle_quest(random_quest_id()),
+        # First page of the quests carrying one or two tags, common and rare ones
+        "get_avatar_quests_page[tags]": lambda: db.get_avatar_quests_page(
+            rng.choice(avatar_ids), tags=rng.sample(tag_names, rng.randint(1, min(2, len(tag_names))))
+        ),
+        "remove_quest": lambda: db.remove_quest(added_ids.pop()),  # The quests created by add_quest
+    }
+    results = {name: summarize(measure(operation, args.ops)) for name, operation in operations.items()}
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)["results"]
+        for name, summary in results.items():
+            if name in baseline:
+                for key in ("p50_ms", "p99_ms"):
+                    before = baseline[name][key]
+                    summary[f"{key[:3]}_change_pct"] = round((summary[key] - before) / before * 100, 1) if before else None
+
+    report = {
+        "benchmark": "data_manager",
+        "config": {
+            "avatars": args.avatars,
+            "categories": len(category_ids),
+            "quests_per_avatar": args.quests_per_avatar,
+            "tags": args.tags,
+            "ops": args.ops,
+            "database": database,
+            "backend": args.backend,
+            "seed": args.seed,
+        },
+        "environment": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "sqlalchemy": sqlalchemy.__version__,
+            "sqlite": sqlite3.sqlite_version,
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Commit latency and read throughput of each SQLite engine profile.
+
+Every profile gets its own database file with the same synthetic quests.
+
+    python -m benchmarks.bench_engine_profiles --quests 100000
+"""
+import argparse
+import os
+import tempfile
+import time
+from benchmarks.common import measure, summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quests", type=int, default=100000)
+    parser.add_argument("--commits", type=int, default=200)
+    args = parser.parse_args()
+
+    from sqlalchemy import select
+    from sqlalchemy.orm import sessionmaker
+    from models.database import ENGINE_PROFILES, Base, Quest, Avatar, Category, create_app_engine
+
+    for profile in ENGINE_PROFILES:
+        path = os.path.join(tempfile.mkdtemp(prefix="todo-bench-"), f"{profile}.db")
+        engine = create_app_engine(f"sqlite:///{path}", {"profile": profile, "echo": False, "pool_size": 5})
+        Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            connection.execute(Avatar.__table__.insert(), [{"name": "bench"}])
+            connection.execute(Category.__table__.insert(), [{"category_name": "wisdom"}])
+            connection.execute(Quest.__table__.insert(), [
+                {"avatar_id": 1, "category_id": 1, "quest_name": f"quest {i}", "exp_amount": i % 50}
+                for i in range(args.quests)
+            ])
+        Session = sessionmaker(bind=engine)
+
+        def commit_one():
+            with Session() as session:
+                session.execute(Quest.__table__.update().where(Quest.id == 1).values(completed=~Quest.completed))
+                session.commit()
+
+        def read_all():
+            with Session() as session:
+                return len(session.execute(select(Quest.id, Quest.quest_name, Quest.exp_amount)).all())
+
+        commits = summarize(measure(commit_one, args.commits))
+        start = time.perf_counter()
+        rows = sum(read_all() for _ in range(5))
+        read_rate = rows / (time.perf_counter() - start)
+        print(f"{profile:8} | commit p50 {commits['p50_ms']:7.3f} ms, max {commits['max_ms']:7.3f} ms"
+              f" | full scan {read_rate:>12,.0f} rows/sec")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Per-keystroke latency of the quest search.
+
+Simulates a user typing a query one character at a time and times
+``DataManager.search_quest_ids`` for each prefix, with the first screenful
+(``--limit``) and with the full match list.
+
+    python -m benchmarks.bench_search --sizes 10000 100000 1000000
+"""
+import argparse
+from benchmarks.common import use_temp_database, quiet_engine, seed_quests, measure, summarize
+
+QUERIES = ["garden", "wis", "call mom"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    use_temp_database()
+    from models import DataManager, setup_database
+
+    quiet_engine()
+    setup_database()
+    db = DataManager()
+    avatar = db.get_avatar()
+    category_ids = [category.id for category in db.get_categories()]
+
+    seeded = 0
+    for size in sorted(args.sizes):
+        seed_quests(avatar.id, category_ids, size - seeded, seed=size)
+        seeded = size
+        print(f"\n{size} quests")
+        for query in QUERIES:
+            for end in range(1, len(query) + 1):
+                keystroke = query[:end]
+                first_page = summarize(measure(lambda: db.search_quest_ids(avatar.id, keystroke, args.limit), args.repeat))
+                full = summarize(measure(lambda: db.search_quest_ids(avatar.id, keystroke), max(1, args.repeat // 5)))
+                print(f"  {keystroke!r:12} first {args.limit}: p50 {first_page['p50_ms']:8.2f} ms"
+                      f" | all matches: p50 {full['p50_ms']:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""Throughput and latency of the HTTP/JSON API (server.py) under concurrent clients.
+
+Starts a server on a seeded temp database (or targets a running one with --url), then
+keeps --concurrency keep-alive connections busy for --duration seconds with a mix of
+reads and toggles. Prints a JSON report: requests/sec and p50 / p95 / p99 latency,
+overall and per request kind.
+
+    python -m benchmarks.bench_server --concurrency 32 --duration 10
+    python -m benchmarks.bench_server --url http://127.0.0.1:8765 --mix toggle=1
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+from benchmarks.common import use_temp_database, quiet_engine, seed_categories, seed_avatars, seed_quests, \
+    summarize, WORDS
+
+# Default weights of the request kinds
+DEFAULT_MIX = {"page": 4, "agenda": 2, "search": 2, "avatar": 1, "toggle": 2, "toggle_batch": 1}
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        kind, _, weight = item.partition("=")
+        if kind not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown request kind '{kind}', expected one of {sorted(DEFAULT_MIX)}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+class Client:
+    """One keep-alive HTTP/1.1 connection."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        payload = json.dumps(body).encode() if body is not None else b""
+        self.writer.write(
+            f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(payload)}\r\n\r\n".encode()
+            + payload
+        )
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+        return status, json.loads(await self.reader.readexactly(length))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+# Seed a temp database and start server.py on it, returns (process, port)
+def start_server(args):
+    use_temp_database()
+    from models import setup_database
+    from models.database import engine
+
+    quiet_engine()
+    setup_database()
+    category_ids = seed_categories(args.categories)
+    for avatar_id in seed_avatars(args.avatars, seed=args.seed):
+        seed_quests(avatar_id, category_ids, args.quests_per_avatar, seed=args.seed + avatar_id)
+    engine.dispose()
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server.py")
+    command = [sys.executable, server_path, "--port", str(port)]
+    if args.workers:
+        command += ["--workers", str(args.workers)]
+    process = subprocess.Popen(command, env=os.environ.copy())
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return process, port
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("The server did not start")
+
+
+async def run_load(host, port, args, mix):
+    rng = random.Random(args.seed)
+    setup = Client(host, port)
+    _, avatars = await setup.request("GET", "/avatars")
+    avatar_ids = [avatar["id"] for avatar in avatars]
+    quest_ids = {}
+    for avatar_id in avatar_ids:
+        _, page = await setup.request("GET", f"/avatars/{avatar_id}/quests?limit=500")
+        quest_ids[avatar_id] = [quest["id"] for quest in page["quests"]]
+    setup.close()
+    avatar_ids = [avatar_id for avatar_id in avatar_ids if quest_ids[avatar_id]]
+
+    def next_request():
+        kind = rng.choices(list(mix), weights=list(mix.values()))[0]
+        avatar_id = rng.choice(avatar_ids)
+        if kind == "page":
+            sort = rng.choice(["id", "due_date", "exp_amount", "quest_name"])
+            return kind, "GET", f"/avatars/{avatar_id}/quests?sort={sort}", None
+        if kind == "agenda":
+            return kind, "GET", f"/avatars/{avatar_id}/agenda", None
+        if kind == "search":
+            return kind, "GET", f"/avatars/{avatar_id}/search?q={rng.choice(WORDS)[:3]}", None
+        if kind == "avatar":
+            return kind, "GET", f"/avatars/{avatar_id}", None
+        if kind == "toggle":
+            return kind, "POST", f"/quests/{rng.choice(quest_ids[avatar_id])}/toggle", None
+        ids = rng.sample(quest_ids[avatar_id], min(args.batch_size, len(quest_ids[avatar_id])))
+        return kind, "POST", "/quests/toggle", {"ids": ids}
+
+    timings = {kind: [] for kind in mix}
+    errors = {}
+    deadline = time.perf_counter() + args.duration
+
+    async def worker():
+        client = Client(host, port)
+        try:
+            while time.perf_counter() < deadline:
+                kind, method, path, body = next_request()
+                start = time.perf_counter()
+                status, _ = await client.request(method, path, body)
+                timings[kind].append((time.perf_counter() - start) * 1000)
+                if status >= 400:
+                    errors[status] = errors.get(status, 0) + 1
+        finally:
+            client.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+
+    def summarize_load(kind_timings):
+        # ops_per_sec of summarize is the rate of one connection, report the rate of all of them
+        summary = summarize(kind_timings)
+        del summary["ops_per_sec"]
+        summary["requests_per_sec"] = round(len(kind_timings) / elapsed, 1)
+        return summary
+
+    every_timing = [timing for kind_timings in timings.values() for timing in kind_timings]
+    return {
+        "overall": summarize_load(every_timing),
+        "by_kind": {kind: summarize_load(kind_timings) for kind, kind_timings in timings.items() if kind_timings},
+        "errors": errors,
+        "elapsed_sec": round(elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="Running server to load, default: start one on a seeded temp database")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent keep-alive connections")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of load")
+    parser.add_argument("--mix", type=parse_mix, help="Weights of the request kinds, e.g. page=4,toggle=1")
+    parser.add_argument("--batch-size", type=int, default=10, help="Quests per toggle_batch request")
+    parser.add_argument("--avatars", type=int, default=10)
+    parser.add_argument("--categories", type=int, default=8)
+    parser.add_argument("--quests-per-avatar", type=int, default=1000)
+    parser.add_argument("--workers", type=int, help="Reader threads of the started server")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the report to this file instead of stdout")
+    args = parser.parse_args()
+    mix = args.mix or DEFAULT_MIX
+
+    process = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        process, port = start_server(args)
+        host = "127.0.0.1"
+    try:
+        results = asyncio.run(run_load(host, port, args, mix))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    report = {
+        "benchmark": "server",
+        "config": {
+            "url": args.url or f"http://{host}:{port}",
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "mix": mix,
+            "batch_size": args.batch_size,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    if not args.url:
+        report["config"].update(avatars=args.avatars, quests_per_avatar=args.quests_per_avatar)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Startup time of the app: module import times and time to first frame.
+
+Launches ``main.py`` under ``python -X importtime`` with TODO_APP_STARTUP_PROBE
+set, so the app quits on its first frame, and reports the median of several
+runs. Needs a display (or a virtual one such as Xvfb).
+
+    python -m benchmarks.bench_startup --runs 5 --max-first-frame-ms 1500
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+FIRST_FRAME_LINE = re.compile(r"time_to_first_frame_ms=([\d.]+)")
+
+
+def run_once(main_path, database_url):
+    env = dict(os.environ, TODO_APP_STARTUP_PROBE="1", TODO_APP_DATABASE_URL=database_url, KIVY_NO_ARGS="1")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", main_path],
+        env=env, capture_output=True, text=True, timeout=120
+    )
+    match = FIRST_FRAME_LINE.search(result.stdout)
+    if not match:
+        raise RuntimeError(f"No first frame reported, stderr tail:\n{result.stderr[-2000:]}")
+
+    # Cumulative time of the top level imports only (no indentation before the module name)
+    imports = {}
+    for line in result.stderr.splitlines():
+        import_match = IMPORT_LINE.match(line)
+        if import_match and len(import_match.group(3)) == 1:
+            imports[import_match.group(4)] = int(import_match.group(2)) / 1000
+    return float(match.group(1)), imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to list")
+    parser.add_argument("--max-first-frame-ms", type=float, help="Exit with an error above this median")
+    args = parser.parse_args()
+
+    from benchmarks.common import use_temp_database
+    database_url = f"sqlite:///{use_temp_database()}"
+    main_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+
+    first_frames = []
+    import_times = {}
+    for _ in range(args.runs):
+        first_frame, imports = run_once(main_path, database_url)
+        first_frames.append(first_frame)
+        for module, milliseconds in imports.items():
+            import_times.setdefault(module, []).append(milliseconds)
+
+    median_first_frame = statistics.median(first_frames)
+    print(f"time to first frame: median {median_first_frame:.1f} ms over {args.runs} runs")
+    print(f"top level imports: {sum(statistics.median(t) for t in import_times.values()):.1f} ms")
+    slowest = sorted(import_times.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    for module, timings in slowest[:args.top]:
+        print(f"  {statistics.median(timings):8.1f} ms  {module}")
+
+    if args.max_first_frame_ms is not None and median_first_frame > args.max_first_frame_ms:
+        print(f"Regression: first frame above {args.max_first_frame_ms} ms", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Frame time of toggling a quest in the quest list.
+
+Compares the incremental row update used by QuestScreen.toggle_validate_quest
+with the previous behaviour of rebuilding the whole list after every toggle.
+Needs Kivy and KivyMD; no window is opened.
+
+    python -m benchmarks.bench_toggle --sizes 1000 10000
+"""
+import argparse
+import os
+from benchmarks.common import use_temp_database, quiet_engine, seed_quests, measure, summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ.setdefault("KIVY_NO_ARGS", "1")
+    from kivy.config import Config
+    Config.set("graphics", "maxfps", "0")  # Clock.tick must not wait for the next frame
+
+    use_temp_database()
+    from kivy.clock import Clock
+    from kivymd.app import MDApp
+    from models import DataManager, setup_database
+    from screens import AvatarScreen, QuestScreen
+
+    quiet_engine()
+    setup_database()
+    db = DataManager()
+    avatar = db.get_avatar()
+    category_ids = [category.id for category in db.get_categories()]
+
+    MDApp()  # KivyMD widgets need an app instance for their theme
+    seeded = 0
+    for size in sorted(args.sizes):
+        seed_quests(avatar.id, category_ids, size - seeded, seed=size)
+        seeded = size
+
+        screen = QuestScreen(AvatarScreen(db=db, avatar=avatar), db=db, avatar=avatar)
+        screen.build_screen()
+        while screen.has_more_quests:
+            screen.load_next_page()  # Every quest loaded, as after scrolling to the end
+        Clock.tick()
+        quest_id = screen.quests[len(screen.quests) // 2]["id"]
+
+        def toggle_patch():
+            screen.toggle_validate_quest(None, quest_id)
+            Clock.tick()
+
+        def toggle_rebuild():
+            screen.toggle_validate_quest(None, quest_id)
+            loaded = len(screen.quests)
+            screen.load_quests()
+            while len(screen.quests) < loaded and screen.has_more_quests:
+                screen.load_next_page()
+            Clock.tick()
+
+        patch = summarize(measure(toggle_patch, args.repeat))
+        rebuild = summarize(measure(toggle_rebuild, max(1, args.repeat // 4)))
+        print(f"{size:>7} quests | rebuild p50 {rebuild['p50_ms']:9.2f} ms | patch p50 {patch['p50_ms']:9.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
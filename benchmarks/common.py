@@ -0,0 +1,114 @@
+"""Helpers shared by the benchmark scripts.
+
+The models bind their engine at import time, so ``use_temp_database`` (or
+``use_memory_database``) has to be called before anything is imported from ``models``.
+"""
+import os
+import random
+import statistics
+import tempfile
+import time
+
+WORDS = [
+    "read", "write", "call", "clean", "cook", "run", "walk", "study", "train", "plan",
+    "book", "garden", "kitchen", "report", "email", "guitar", "piano", "swim", "yoga", "mom",
+    "dad", "bills", "taxes", "code", "review", "paint", "fix", "bike", "car", "groceries",
+]
+
+
+# Point the app at a fresh SQLite file in a temp directory
+def use_temp_database():
+    path = os.path.join(tempfile.mkdtemp(prefix="todo-bench-"), "bench.db")
+    os.environ["TODO_APP_DATABASE_URL"] = f"sqlite:///{path}"
+    return path
+
+
+# Point the app at an in-memory SQLite database, shared by every session
+def use_memory_database():
+    os.environ["TODO_APP_DATABASE_URL"] = "sqlite:///:memory:"
+
+
+# Turn off the statement logging of the app engine, it dominates the timings
+def quiet_engine():
+    from models.database import engine
+    engine.echo = False
+
+
+# Insert `count` synthetic categories, returns the ids of every category
+def seed_categories(count):
+    from sqlalchemy import select
+    from models.database import engine, Category
+
+    with engine.begin() as connection:
+        existing = set(connection.execute(select(Category.category_name)).scalars())
+        names = [f"category {index}" for index in range(count)]
+        rows = [{"category_name": name} for name in names if name not in existing]
+        if rows:
+            connection.execute(Category.__table__.insert(), rows)
+        return list(connection.execute(select(Category.id).order_by(Category.id)).scalars())
+
+
+# Insert `count` synthetic avatars with their category rows, returns the new ids
+def seed_avatars(count, seed=42):
+    from sqlalchemy import select, func
+    from models.database import engine, Avatar, init_avatar_categories
+
+    rng = random.Random(seed)
+    with engine.begin() as connection:
+        last_id = connection.execute(select(func.max(Avatar.id))).scalar() or 0
+        connection.execute(Avatar.__table__.insert(), [
+            {"name": f"{rng.choice(WORDS)} {index}", "level": 1, "experience": 0} for index in range(count)
+        ])
+        init_avatar_categories(connection)
+        return list(connection.execute(select(Avatar.id).where(Avatar.id > last_id).order_by(Avatar.id)).scalars())
+
+
+# Insert `count` synthetic quests for an avatar with Core batch inserts
+def seed_quests(avatar_id, category_ids, count, batch_size=10000, seed=42):
+    from models.database import engine, Quest
+    import datetime
+
+    rng = random.Random(seed)
+    start = datetime.date(2025, 1, 1)
+    with engine.begin() as connection:
+        for offset in range(0, count, batch_size):
+            rows = [
+                {
+                    "avatar_id": avatar_id,
+                    "quest_name": " ".join(rng.sample(WORDS, 3)),
+                    "category_id": rng.choice(category_ids),
+                    "completed": rng.random() < 0.3,
+                    "exp_amount": rng.randint(1, 50),
+                    "due_date": start + datetime.timedelta(days=rng.randint(0, 365)),
+                }
+                for _ in range(min(batch_size, count - offset))
+            ]
+            connection.execute(Quest.__table__.insert(), rows)
+
+
+# Time a callable several times and return the timings in milliseconds
+def measure(func, repeat=20):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+# Nearest-rank percentile of sorted timings
+def percentile(timings, fraction):
+    return timings[min(len(timings) - 1, max(0, round(fraction * len(timings)) - 1))]
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    total = sum(timings)
+    return {
+        "count": len(timings),
+        "p50_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(percentile(timings, 0.95), 3),
+        "p99_ms": round(percentile(timings, 0.99), 3),
+        "max_ms": round(timings[-1], 3),
+        "ops_per_sec": round(len(timings) / total * 1000, 1) if total else None,
+    }
@@ -0,0 +1,44 @@
+"""Headless timing of the background WriteQueue, no Kivy window involved.
+
+Times the submit call (what the UI thread pays) against the write itself. The
+ordering, main thread delivery and coalescing checks are in tests/test_write_queue.py.
+
+    python -m benchmarks.write_queue_harness --toggles 200
+"""
+import argparse
+import time
+from benchmarks.common import use_temp_database, quiet_engine, summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--toggles", type=int, default=200)
+    args = parser.parse_args()
+
+    use_temp_database()
+    from models import DataManager, WriteQueue, setup_database
+
+    quiet_engine()
+    setup_database()
+    db = DataManager()
+    avatar = db.get_avatar()
+    writer = WriteQueue(db)
+    quest_ids = [db.add_quest(avatar.id, f"harness quest {index}", "wisdom", 10) for index in range(4)]
+
+    # Submit cost on the caller thread vs. time until the write is done
+    submit_times = []
+    write_times = []
+    for index in range(args.toggles):
+        start = time.perf_counter()
+        future = writer.toggle_quest(quest_ids[index % 4])
+        submit_times.append((time.perf_counter() - start) * 1000)
+        future.result(timeout=30)
+        write_times.append((time.perf_counter() - start) * 1000)
+
+    writer.close()
+    print(f"submit (UI thread): p50 {summarize(submit_times)['p50_ms']:.3f} ms | "
+          f"write done: p50 {summarize(write_times)['p50_ms']:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
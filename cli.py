@@ -0,0 +1,216 @@
+import argparse
+import datetime
+import sys
+from contextlib import contextmanager
+from models import database as db
+from models import DataManager
+from models import migrations
+from models.quest_io import FORMATS, format_from_path
+from models import sync_io
+from models.history import PERIODS
+
+
+# Open a file, "-" meaning stdin / stdout
+@contextmanager
+def open_stream(path, mode):
+    if path == "-":
+        stream = sys.stdin if "r" in mode else sys.stdout
+        yield stream.buffer if "b" in mode else stream
+    elif "b" in mode:
+        with open(path, mode) as file:
+            yield file
+    else:
+        with open(path, mode, newline="", encoding="utf-8") as file:
+            yield file
+
+
+def import_quests(args):
+    file_format = args.format or format_from_path(args.file)
+    reader = FORMATS[file_format][0]
+    with open_stream(args.file, "r") as file:
+        quests = reader(file)
+        if args.avatar_id is not None:
+            quests = ({**quest, "avatar_id": args.avatar_id} for quest in quests)
+        count = DataManager().bulk_add_quests(quests, batch_size=args.batch_size)
+    print(f"Imported {count} quests", file=sys.stderr)
+
+
+def export_quests(args):
+    file_format = args.format or format_from_path(args.file)
+    writer = FORMATS[file_format][1]
+    with open_stream(args.file, "w") as file:
+        count = writer(DataManager().iter_quests(args.avatar_id, batch_size=args.batch_size), file)
+    print(f"Exported {count} quests", file=sys.stderr)
+
+
+def check_experience(args):
+    drift = DataManager().check_experience(repair=args.repair, avatar_id=args.avatar_id)
+    if drift is None:
+        sys.exit(1)
+    for table, key, stored, expected in drift:
+        print(f"{table} {key}: stored {stored}, expected {expected}")
+    action = "repaired" if args.repair else "found"
+    print(f"{len(drift)} inconsistencies {action}", file=sys.stderr)
+    if drift and not args.repair:
+        sys.exit(1)
+
+
+def manage_avatars(args):
+    data_manager = DataManager()
+    if args.create:
+        avatar_id = data_manager.create_avatar(args.create)
+        if avatar_id is None:
+            sys.exit(1)
+        print(f"Created avatar {avatar_id}", file=sys.stderr)
+    if args.switch is not None and not data_manager.switch_avatar(args.switch):
+        sys.exit(1)
+
+    current = data_manager.get_avatar()
+    for avatar in data_manager.list_avatars():
+        marker = "*" if current and avatar.id == current.id else " "
+        print(f"{marker} {avatar.id:>4}  {avatar.name}  level {avatar.level}, {avatar.experience} XP")
+
+
+def show_history(args):
+    data_manager = DataManager()
+    if args.rebuild:
+        if data_manager.rebuild_xp_history(args.avatar_id) is None:
+            sys.exit(1)
+    avatar_id = args.avatar_id if args.avatar_id is not None else data_manager.get_avatar().id
+    for row in data_manager.get_xp_history(avatar_id, args.period, args.start, args.end, args.category):
+        print(f"{row['period_start']}  {row['category_name']:<15} {row['exp']:>6} XP  {row['completions']:>4} done")
+
+
+def purge_deleted(args):
+    older_than = datetime.timedelta(days=args.older_than_days) if args.older_than_days is not None else None
+    purged = DataManager().purge_deleted(older_than=older_than, vacuum=not args.no_vacuum)
+    if purged is None:
+        sys.exit(1)
+    print(f"Purged {purged} deleted quests", file=sys.stderr)
+
+
+def sync_status(args):
+    data_manager = DataManager()
+    if args.new_device and data_manager.reset_sync_device() is None:
+        sys.exit(1)
+    state = data_manager.get_sync_state()
+    if state is None:
+        sys.exit(1)
+    print(f"Device {state['device_id']}, version {state['version']}, clock {state['clock']}")
+    for device_id, version in sorted(state["peers"].items()):
+        print(f"  imported from {device_id} up to version {version}")
+
+
+def sync_export(args):
+    file_format = args.format or sync_io.format_from_path(args.file)
+    _, writer, binary = sync_io.FORMATS[file_format]
+    exported = DataManager().export_changes(since=args.since, batch_size=args.batch_size)
+    if exported is None:
+        sys.exit(1)
+    header, changes = exported
+    with open_stream(args.file, "wb" if binary else "w") as file:
+        count = writer(header, changes, file)
+    print(f"Exported {count} changes, versions {header['since']} to {header['until']}", file=sys.stderr)
+
+
+def sync_import(args):
+    file_format = args.format or sync_io.format_from_path(args.file)
+    reader, _, binary = sync_io.FORMATS[file_format]
+    with open_stream(args.file, "rb" if binary else "r") as file:
+        header, changes = reader(file)
+        counts = DataManager().import_changes(header, changes, batch_size=args.batch_size)
+    if counts is None:
+        sys.exit(1)
+    print(f"Applied {counts['applied']} changes, kept {counts['kept']} local rows, skipped "
+          f"{counts['skipped']}, {counts['exp_updated']} exp totals updated", file=sys.stderr)
+
+
+def migrate_database(args):
+    with db.engine.connect() as connection:
+        version = migrations.get_schema_version(connection)
+    if args.status:
+        print(f"Schema version {version}, latest {migrations.LATEST_VERSION}")
+        for migration_version, description, _ in migrations.MIGRATIONS:
+            state = "applied" if migration_version <= version else "pending"
+            print(f"{migration_version:>4}  {state:8} {description}")
+        return
+
+    applied = migrations.migrate(target=args.target or migrations.LATEST_VERSION)
+    print(f"Applied {len(applied)} migrations, schema version "
+          f"{max(applied, default=version)}", file=sys.stderr)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Headless maintenance commands for the quest database.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="Bulk import quests from a CSV or JSON Lines file.")
+    import_parser.add_argument("file", help="File to read, '-' for stdin")
+    import_parser.add_argument("--format", choices=FORMATS, help="Default: guessed from the extension")
+    import_parser.add_argument("--avatar-id", type=int, help="Import every quest for this avatar")
+    import_parser.add_argument("--batch-size", type=int, default=1000)
+    import_parser.set_defaults(handler=import_quests)
+
+    export_parser = commands.add_parser("export", help="Stream quests to a CSV or JSON Lines file.")
+    export_parser.add_argument("file", help="File to write, '-' for stdout")
+    export_parser.add_argument("--format", choices=FORMATS, help="Default: guessed from the extension")
+    export_parser.add_argument("--avatar-id", type=int, help="Only export the quests of this avatar")
+    export_parser.add_argument("--batch-size", type=int, default=1000)
+    export_parser.set_defaults(handler=export_quests)
+
+    check_parser = commands.add_parser("check-xp", help="Recompute the exp totals and levels from the quests.")
+    check_parser.add_argument("--repair", action="store_true", help="Write the recomputed values")
+    check_parser.add_argument("--avatar-id", type=int, help="Only check this avatar")
+    check_parser.set_defaults(handler=check_experience)
+
+    avatars_parser = commands.add_parser("avatars", help="List, create or switch avatars.")
+    avatars_parser.add_argument("--create", metavar="NAME", help="Create an avatar")
+    avatars_parser.add_argument("--switch", metavar="ID", type=int, help="Use this avatar in the app")
+    avatars_parser.set_defaults(handler=manage_avatars)
+
+    history_parser = commands.add_parser("history", help="Exp earned per category per day, week or month.")
+    history_parser.add_argument("--period", choices=PERIODS, default="week")
+    history_parser.add_argument("--start", help="First date (YYYY-MM-DD)")
+    history_parser.add_argument("--end", help="Last date (YYYY-MM-DD)")
+    history_parser.add_argument("--category", help="Only this category")
+    history_parser.add_argument("--avatar-id", type=int, help="Default: the current avatar")
+    history_parser.add_argument("--rebuild", action="store_true", help="Recompute the rollups from the event log first")
+    history_parser.set_defaults(handler=show_history)
+
+    purge_parser = commands.add_parser("purge", help="Hard-delete the deleted quests and compact the file.")
+    purge_parser.add_argument("--older-than-days", type=float, help="Default: the app retention (1 day)")
+    purge_parser.add_argument("--no-vacuum", action="store_true", help="Don't compact the database file")
+    purge_parser.set_defaults(handler=purge_deleted)
+
+    sync_status_parser = commands.add_parser("sync-status", help="Device id and versions of the sync journal.")
+    sync_status_parser.add_argument("--new-device", action="store_true",
+                                    help="Give this database a new device id, after copying the file")
+    sync_status_parser.set_defaults(handler=sync_status)
+
+    sync_export_parser = commands.add_parser("sync-export", help="Write the changes since a version for another device.")
+    sync_export_parser.add_argument("file", help="File to write, '-' for stdout")
+    sync_export_parser.add_argument("--since", type=int, default=0,
+                                    help="Version of this device already imported by the other one (see its sync-status)")
+    sync_export_parser.add_argument("--format", choices=sync_io.FORMATS, help="Default: jsonl for .jsonl files, binary")
+    sync_export_parser.add_argument("--batch-size", type=int, default=1000)
+    sync_export_parser.set_defaults(handler=sync_export)
+
+    sync_import_parser = commands.add_parser("sync-import", help="Merge the changes exported by another device.")
+    sync_import_parser.add_argument("file", help="File to read, '-' for stdin")
+    sync_import_parser.add_argument("--format", choices=sync_io.FORMATS, help="Default: jsonl for .jsonl files, binary")
+    sync_import_parser.add_argument("--batch-size", type=int, default=1000)
+    sync_import_parser.set_defaults(handler=sync_import)
+
+    migrate_parser = commands.add_parser("migrate", help="Upgrade the database schema, without starting the app.")
+    migrate_parser.add_argument("--status", action="store_true", help="Only list the applied and pending migrations")
+    migrate_parser.add_argument("--target", type=int, help="Stop at this schema version")
+    migrate_parser.set_defaults(handler=migrate_database)
+
+    return parser
+
+
+if __name__ == '__main__':
+    arguments = build_parser().parse_args()
+    if arguments.handler is not migrate_database:
+        db.setup_database()
+    arguments.handler(arguments)
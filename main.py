@@ -1,18 +1,65 @@
-from kivymd.app import MDApp
-from kivymd.uix.bottomnavigation import MDBottomNavigation
-from screens import AvatarScreen, QuestScreen, AddQuestScreen
-from models import database as db
+import os
+import time
+
+# Read before the kivy imports: their cost is part of the time to the first frame (see on_first_frame)
+START_TIME = time.perf_counter()
+
+from kivy.clock import Clock  # noqa: E402
+from kivymd.app import MDApp  # noqa: E402
+
+# Seconds between two purges of the deleted quests, run on the writer thread
+PURGE_INTERVAL = 60 * 60
+
 
 class ToDoApp(MDApp):
     def build(self):
+        # Imported lazily, only the app class is needed before the window exists
+        from kivymd.uix.bottomnavigation import MDBottomNavigation
+        from models import DataManager, WriteQueue, setup_database
+        from screens import AvatarScreen, QuestScreen, AddQuestScreen
+        from screens.dispatch import schedule_on_main_thread
+
+        setup_database()
+        # Startup data shared by the screens, loaded once
+        data_manager = DataManager()
+        avatar = data_manager.get_avatar()
+        categories = data_manager.get_categories()
+        # Writes run on a background thread, their results come back through the Clock
+        self.writer = WriteQueue(data_manager, dispatch=schedule_on_main_thread)
+
+        # Hard-delete the old soft deleted quests now and then, off the UI thread
+        Clock.schedule_once(self.purge_deleted, 10)
+        Clock.schedule_interval(self.purge_deleted, PURGE_INTERVAL)
+
+        # Only the visible tab builds its widgets now, the others on first selection
         bottom_nav = MDBottomNavigation()
-        avatar_screen = AvatarScreen()
-        quest_screen = QuestScreen(avatar_screen)
+        avatar_screen = AvatarScreen(db=data_manager, avatar=avatar, categories=categories, writer=self.writer)
+        quest_screen = QuestScreen(avatar_screen, db=data_manager, avatar=avatar, writer=self.writer)
         bottom_nav.add_widget(avatar_screen)
         bottom_nav.add_widget(quest_screen)
-        bottom_nav.add_widget(AddQuestScreen(quest_screen, avatar_screen))
+        bottom_nav.add_widget(
+            AddQuestScreen(quest_screen, avatar_screen, db=data_manager, categories=categories, writer=self.writer)
+        )
         return bottom_nav
 
+    def purge_deleted(self, dt):
+        self.writer.submit("purge_deleted")
+
+    def on_stop(self):
+        # Flush the queued writes before the process exits
+        if getattr(self, "writer", None):
+            self.writer.close()
+
+    def on_start(self):
+        # Used by benchmarks/bench_startup.py: report the time to the first frame and quit
+        if os.environ.get("TODO_APP_STARTUP_PROBE"):
+            from kivy.core.window import Window
+            Window.bind(on_flip=self.on_first_frame)
+
+    def on_first_frame(self, window):
+        window.unbind(on_flip=self.on_first_frame)
+        print(f"time_to_first_frame_ms={(time.perf_counter() - START_TIME) * 1000:.1f}", flush=True)
+        self.stop()
+
 if __name__ == '__main__':
-    db.setup_database()
     ToDoApp().run()
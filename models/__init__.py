@@ -1,4 +1,9 @@
-from .data_manager import DataManager
+from .data_manager import DataManager, QUEST_PAGE_SIZE
 from .database import setup_database
+from .records import QuestRecord, CategoryRecord, AvatarRecord, TagRecord
+from .cache import cache
+from . import events
+from . import instrumentation
+from .write_queue import WriteQueue
 
-__all__ = ["setup_database", "DataManager"]
+__all__ = ["setup_database", "DataManager", "QUEST_PAGE_SIZE", "QuestRecord", "CategoryRecord", "AvatarRecord", "TagRecord", "cache", "events", "instrumentation", "WriteQueue"]
@@ -0,0 +1,65 @@
+import threading
+from sqlalchemy.orm import sessionmaker
+from models import database
+from models.cache import DataCache, cache as app_cache
+from models.repositories import SqlQuestRepository
+
+# Storage backends of the DataManager. A backend gives sessions and transactions on its database
+# (`session`, `begin`), the read-through cache of its avatars and categories (`cache`), the
+# repository answering the quest list reads (`quests`, see models/repositories.py), creates its
+# schema (`setup`) and compacts it (`compact`). The in-memory backend (models/memory_backend.py)
+# serves the quest reads from memory.
+
+
+class SqlBackend:
+    """SQLAlchemy / SQLite storage, on the app database by default or on any database URL.
+
+        DataManager(backend=SqlBackend("sqlite:////tmp/test.db"))
+    """
+
+    def __init__(self, database_url=None, engine=None, config=None):
+        if engine is None:
+            engine = database.create_app_engine(database_url, config) if database_url else database.engine
+        self.engine = engine
+        self.url = str(engine.url)
+        if engine is database.engine:
+            # The app database keeps the module session factory and the shared cache
+            self._sessions = database.Session
+            self.cache = app_cache
+        else:
+            self._sessions = sessionmaker(bind=engine)
+            self.cache = DataCache()
+        self.quests = SqlQuestRepository(self)
+
+    def session(self):
+        return self._sessions()
+
+    #connection in a transaction, committed when the block exits
+    def begin(self):
+        return self.engine.begin()
+
+    #run the migrations and create the default data
+    def setup(self):
+        database.setup_database(self.engine)
+
+    def compact(self):
+        database.compact_database(self.engine)
+
+    def dispose(self):
+        self.engine.dispose()
+
+    def __repr__(self):
+        return f"SqlBackend({self.url!r})"
+
+
+_default_backend = None
+_default_lock = threading.Lock()
+
+
+# Backend of the DataManagers created without one: the app database
+def default_backend():
+    global _default_backend
+    with _default_lock:
+        if _default_backend is None:
+            _default_backend = SqlBackend()
+        return _default_backend
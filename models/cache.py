@@ -0,0 +1,93 @@
+import threading
+from collections import Counter
+
+# In-memory read-through cache for the data that almost never changes (categories, avatars).
+# Entries are immutable records, dropped only by the DataManager mutations that change them.
+
+
+class DataCache:
+    """Shared by every DataManager, safe to use from the UI and the writer thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._categories = None  # Tuple of CategoryRecord
+        self._category_ids = {}  # Name -> id
+        self._category_names = {}  # Id -> name
+        self._avatars = {}  # Key -> AvatarRecord
+        self._generation = 0  # Bumped by every invalidation, a load started before one is not stored
+        self.hits = Counter()
+        self.misses = Counter()
+
+    #return all categories, `loader` fetches them on a miss
+    def categories(self, loader):
+        with self._lock:
+            if self._categories is not None:
+                self.hits["categories"] += 1
+                return self._categories
+            self.misses["categories"] += 1
+            generation = self._generation
+
+        categories = tuple(loader())
+        with self._lock:
+            if generation != self._generation:
+                return categories
+            self._categories = categories
+            self._category_ids = {category.category_name: category.id for category in categories}
+            self._category_names = {category.id: category.category_name for category in categories}
+        return categories
+
+    #return the id of a category name, None if it doesn't exist
+    def category_id(self, category_name, loader):
+        self.categories(loader)
+        with self._lock:
+            return self._category_ids.get(category_name)
+
+    #return the name of a category id, None if it doesn't exist
+    def category_name(self, category_id, loader):
+        self.categories(loader)
+        with self._lock:
+            return self._category_names.get(category_id)
+
+    #return an avatar snapshot, `loader` fetches it on a miss (misses on None are not cached)
+    def avatar(self, key, loader):
+        with self._lock:
+            avatar = self._avatars.get(key)
+            if avatar is not None:
+                self.hits["avatars"] += 1
+                return avatar
+            self.misses["avatars"] += 1
+            generation = self._generation
+
+        avatar = loader()
+        if avatar is not None:
+            with self._lock:
+                if generation == self._generation:
+                    self._avatars[key] = avatar
+        return avatar
+
+    def invalidate_categories(self):
+        with self._lock:
+            self._generation += 1
+            self._categories = None
+            self._category_ids = {}
+            self._category_names = {}
+
+    def invalidate_avatars(self):
+        with self._lock:
+            self._generation += 1
+            self._avatars.clear()
+
+    def clear(self):
+        self.invalidate_categories()
+        self.invalidate_avatars()
+
+    #hit / miss counters by cached entity
+    def stats(self):
+        with self._lock:
+            return {
+                name: {"hits": self.hits[name], "misses": self.misses[name]}
+                for name in ("categories", "avatars")
+            }
+
+
+cache = DataCache()
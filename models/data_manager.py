@@ -1,24 +1,123 @@
 import logging
 import datetime
-from models.database import get_session, Avatar, Category, AvatarCategory, Quest
+import heapq
+from itertools import islice
+from sqlalchemy import text, func, or_, select, literal
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import aliased
+from models.database import init_avatar_categories, Avatar, Category, AvatarCategory, Quest, AppSetting, \
+    QuestRecurrence, QuestEvent, XpRollup, SyncChange, SyncState, Tag, QuestTag, SYNC_COLUMNS, SQL_NEW_UID
+from models.backends import default_backend
+from models.repositories import ID_CHUNK_SIZE, chunks
+from models.quest_helpers import normalize_tag, normalize_tags, parse_date, format_date, tag_ids_by_name, \
+    link_tags, replace_quest_tags, drop_unused_tags, next_open_occurrence
+from models.records import QuestRecord, CategoryRecord, AvatarRecord
+from models.leveling import default_level_curve
+from models.recurrence import FREQUENCIES, iter_occurrences, occurrences_between, is_occurrence
+from models.history import PERIODS, period_start
+from models import events
+from models.instrumentation import instrument
+
+# Default number of quests per page in the paged quest queries
+QUEST_PAGE_SIZE = 50
+
+# Columns of an AvatarRecord
+AVATAR_COLUMNS = (Avatar.id, Avatar.name, Avatar.level, Avatar.experience)
+
+# Days covered by the "upcoming" part of the agenda
+AGENDA_DAYS = 7
+
+# Rows per executemany batch / per fetched page in the bulk import and export
+BULK_BATCH_SIZE = 1000
+
+# Soft deleted quests are hard-deleted by purge_deleted after this delay, they can be restored until then
+TOMBSTONE_RETENTION = datetime.timedelta(days=1)
+
+# Fields of the toggle results that are not part of the XP_CHANGED event
+XP_RESULT_ONLY_FIELDS = ("id", "quest_id", "completed", "due_date", "completed_occurrences")
+
+# Setting storing the id of the avatar used by the app
+CURRENT_AVATAR_SETTING = "current_avatar_id"
+
+# Format of the sync deltas (export_changes / import_changes)
+SYNC_FORMAT = "todo-sync/1"
+
+# Prefix of the settings storing the last version imported from each device
+SYNC_PEER_SETTING = "sync_peer:"
 
 # Configure logging
 logging.basicConfig(level=logging.ERROR)
 logger = logging.getLogger(__name__)
 
 
+# Every public method is timed when the instrumentation is enabled (models/instrumentation.py)
+@instrument
 class DataManager:
-    def __init__(self):
-        pass
+    def __init__(self, level_curve=None, backend=None):
+        self.level_curve = level_curve or default_level_curve
+        # Storage, the app database by default (see models/backends.py)
+        self.backend = backend or default_backend()
+        self.cache = self.backend.cache
+        # Quest list reads (see models/repositories.py), told about the quests each write changes
+        self.quests = self.backend.quests
 
-    #return first avatar
-    def get_avatar(self):
-        with get_session() as session:
-            return session.query(Avatar).first()
+    #return an avatar (the current one by default), as a cached immutable snapshot
+    def get_avatar(self, avatar_id=None):
+        if avatar_id is None:
+            return self.cache.avatar("current", self._load_current_avatar)
+        return self.cache.avatar(avatar_id, lambda: self._load_avatar(avatar_id))
+
+    #return every avatar
+    def list_avatars(self):
+        return self.cache.avatar("all", self._load_avatars)
+
+    #create an avatar with its exp rows for every category, returns its id
+    def create_avatar(self, name):
+        try:
+            with self.backend.begin() as connection:
+                avatar_id = connection.execute(
+                    Avatar.__table__.insert().values(name=name, level=1, experience=0)
+                ).inserted_primary_key[0]
+                init_avatar_categories(connection, avatar_id)
+            self.cache.invalidate_avatars()
+            return avatar_id
+        except Exception as e:
+            logger.exception(f"Error creating avatar '{name}': {e}")
+            return None
+
+    #select the avatar used by the app
+    def switch_avatar(self, avatar_id):
+        if self.get_avatar(avatar_id) is None:
+            logger.error(f"Avatar with ID {avatar_id} not found.")
+            return False
+        if not self.set_setting(CURRENT_AVATAR_SETTING, str(avatar_id)):
+            return False
+        self.cache.invalidate_avatars()
+        return True
+
+    def _load_current_avatar(self):
+        current_avatar_id = self.get_setting(CURRENT_AVATAR_SETTING)
+        if current_avatar_id is not None:
+            avatar = self._load_avatar(int(current_avatar_id))
+            if avatar is not None:
+                return avatar
+        # No avatar selected yet (or deleted): the first one
+        with self.backend.session() as session:
+            avatar = session.query(*AVATAR_COLUMNS).order_by(Avatar.id).first()
+            return AvatarRecord(*avatar) if avatar else None
+
+    def _load_avatar(self, avatar_id):
+        with self.backend.session() as session:
+            avatar = session.query(*AVATAR_COLUMNS).filter(Avatar.id == avatar_id).first()
+            return AvatarRecord(*avatar) if avatar else None
+
+    def _load_avatars(self):
+        with self.backend.session() as session:
+            return tuple(AvatarRecord(*avatar) for avatar in session.query(*AVATAR_COLUMNS).order_by(Avatar.id))
 
     #update avatar name
     def update_avatar_name(self, avatar_id, new_name):
-        with get_session() as session:
+        with self.backend.session() as session:
             try:
                 avatar = session.query(Avatar).filter_by(id=avatar_id).first()
                 if not avatar:
@@ -26,108 +125,912 @@ class DataManager:
                     return False
                 avatar.name = new_name
                 session.commit()
+                self.cache.invalidate_avatars()
                 return True
             except Exception as e:
                 session.rollback()
                 logger.exception(f"Error updating avatar name: {e}")
                 return False
 
-    #return all existing quest categories
+    #return a stored user setting
+    def get_setting(self, key, default=None):
+        with self.backend.session() as session:
+            setting = session.get(AppSetting, key)
+            return setting.value if setting else default
+
+    #store a user setting
+    def set_setting(self, key, value):
+        with self.backend.session() as session:
+            try:
+                session.merge(AppSetting(key=key, value=value))
+                session.commit()
+                return True
+            except Exception as e:
+                session.rollback()
+                logger.exception(f"Error saving setting '{key}': {e}")
+                return False
+
+    #return all existing quest categories, from the cache
     def get_categories(self):
-        with get_session() as session:
-            return session.query(Category).all()
+        return self.cache.categories(self._load_categories)
+
+    #return the id of a category from its name, None if unknown
+    def get_category_id(self, category_name):
+        return self.cache.category_id(category_name, self._load_categories)
+
+    def _load_categories(self):
+        with self.backend.session() as session:
+            return [CategoryRecord(*category) for category in session.query(Category.id, Category.category_name)]
+
+    #create a user-defined category with its exp rows for every avatar, returns its id
+    def create_category(self, category_name):
+        category_name = " ".join(category_name.split())
+        if not category_name:
+            logger.error("❌ A category needs a name.")
+            return None
+        if self._category_name_taken(category_name):
+            logger.error(f"❌ Category '{category_name}' already exists.")
+            return None
+        try:
+            with self.backend.begin() as connection:
+                category_id = connection.execute(
+                    Category.__table__.insert().values(category_name=category_name)
+                ).inserted_primary_key[0]
+                init_avatar_categories(connection)
+            self.cache.invalidate_categories()
+            return category_id
+        except Exception as e:
+            logger.exception(f"⚠ Error creating category '{category_name}': {e}")
+            return None
+
+    #rename a category, its quests and exp follow
+    def rename_category(self, category_id, new_name):
+        """Categories are matched by name between synced devices: on the other devices the
+        quests of the category move to a new one of that name as they are synced.
+        """
+        new_name = " ".join(new_name.split())
+        if not new_name:
+            logger.error("❌ A category needs a name.")
+            return False
+        if self._category_name_taken(new_name, category_id):
+            logger.error(f"❌ Category '{new_name}' already exists.")
+            return False
+        with self.backend.session() as session:
+            try:
+                updated = session.query(Category).filter(Category.id == category_id).update(
+                    {Category.category_name: new_name}, synchronize_session=False
+                )
+                if not updated:
+                    logger.error(f"Category with ID {category_id} not found.")
+                    return False
+                session.commit()
+                self.cache.invalidate_categories()
+                self.quests.changed()  # The quest rows carry the category name
+                return True
+            except Exception as e:
+                session.rollback()
+                logger.error(f"⚠ Error renaming category {category_id} to '{new_name}': {e}")
+                return False
+
+    # Category names differing only by case would look the same in the menus
+    def _category_name_taken(self, category_name, category_id=None):
+        category_name = category_name.lower()
+        return any(category.category_name.lower() == category_name and category.id != category_id
+                   for category in self.get_categories())
+
+    #delete a category that no quest uses, with its exp rows
+    def delete_category(self, category_id):
+        """The exp still held in the category (quests completed then purged) is taken off the
+        avatars. Returns False when quests, deleted ones included, still use the category.
+        """
+        with self.backend.session() as session:
+            try:
+                if session.query(Quest.id).filter(Quest.category_id == category_id).first() is not None:
+                    logger.error(f"❌ Category {category_id} is still used by quests.")
+                    return False
+                exp_rows = session.query(AvatarCategory.avatar_id, AvatarCategory.exp_points).filter(
+                    AvatarCategory.category_id == category_id, AvatarCategory.exp_points != 0
+                ).all()
+                for avatar_id, exp_points in exp_rows:
+                    self._apply_exp(session, avatar_id, category_id, -exp_points)
+                session.query(AvatarCategory).filter(AvatarCategory.category_id == category_id).delete(
+                    synchronize_session=False
+                )
+                if not session.query(Category).filter(Category.id == category_id).delete(synchronize_session=False):
+                    logger.error(f"Category with ID {category_id} not found.")
+                    session.rollback()
+                    return False
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                logger.exception(f"⚠ Error deleting category {category_id}: {e}")
+                return False
+        self.cache.invalidate_categories()
+        self.cache.invalidate_avatars()
+        return True
+
+    #hit / miss counters of the categories and avatar cache
+    def cache_stats(self):
+        return self.cache.stats()
 
     #return exp by categories for a specific avatar
     def get_avatar_experience_by_category(self, avatar_id):
-        with get_session() as session:
-            avatar_categories = session.query(AvatarCategory).filter(AvatarCategory.avatar_id == avatar_id).all()
-            return {
-                avatar_category.category.category_name: avatar_category.exp_points
-                for avatar_category in avatar_categories
-            }
+        with self.backend.session() as session:
+            rows = (
+                session.query(Category.category_name, AvatarCategory.exp_points)
+                .join(AvatarCategory, AvatarCategory.category_id == Category.id)
+                .filter(AvatarCategory.avatar_id == avatar_id)
+            )
+            return {category_name: exp_points for category_name, exp_points in rows}
 
-    #update exp level for a category
-    def update_experience(self, quest_id):
-        with get_session() as session:
+    #return the level progress of each category for a specific avatar
+    def get_avatar_progress_by_category(self, avatar_id):
+        return {
+            category_name: self.level_curve.progress(exp_points)
+            for category_name, exp_points in self.get_avatar_experience_by_category(avatar_id).items()
+        }
+
+    #toggle the completion of a quest and apply its exp in a single transaction
+    def toggle_quest(self, quest_id):
+        """Flips `completed` and adds / removes the quest exp on the avatar category, committed together.
+
+        A recurring quest completes its next occurrence instead (see `complete_occurrences`),
+        a completed occurrence is un-completed. A deleted quest is not found.
+        Returns the new state so callers don't need to query it again, None on error.
+        """
+        with self.backend.session() as session:
             try:
-                # Fetch the quest
-                quest = session.query(Quest).filter_by(id=quest_id).first()
-                if not quest:
-                    logger.error(f"❌ Quest with ID {quest_id} not found.")
-                    return
+                result = self._toggle_quest(session, quest_id)
+                if result is None:
+                    session.rollback()
+                    return None
 
-                # Fetch the avatar-category relationship
-                avatar_category = session.query(AvatarCategory).filter_by(
-                    avatar_id=quest.avatar_id, category_id=quest.category_id
-                ).first()
+                session.commit()
+                self.cache.invalidate_avatars()
+                self.quests.changed({quest_id, result.get("quest_id", quest_id)})
 
-                if not avatar_category:
-                    logger.error(
-                        f"⚠ AvatarCategory entry not found for Avatar {quest.avatar_id} and Category {quest.category_id}")
-                    return
+            except Exception as e:
+                session.rollback()
+                logger.exception(f"⚠ Error toggling quest {quest_id}: {e}")
+                return None
+
+        self._publish_xp_change(result)
+        return result
+
+    #toggle several quests in a single transaction, set-based like complete_quests
+    def toggle_quests(self, quest_ids):
+        """Flips every quest of `quest_ids` (a quest listed twice is toggled once) with one commit,
+        nothing is written when one of them doesn't exist or is deleted.
 
-                # Update experience based on quest completion status
-                if quest.completed:
-                    avatar_category.exp_points += quest.exp_amount
-                else:
-                    avatar_category.exp_points -= quest.exp_amount
+        The plain quests are flipped by one UPDATE per chunk of ids and their exp applied once
+        per avatar category; recurring quests and occurrences go through `_toggle_quest`.
+        Returns the new state of each quest in the order of `quest_ids`, like `toggle_quest`
+        (the totals are those of the category after the whole batch), None on error.
+        """
+        quest_ids = list(dict.fromkeys(quest_ids))
+        with self.backend.session() as session:
+            try:
+                results = {}
+                template_results = []
+                exp_by_category = {}  # (avatar id, category id) -> [category name, exp, (quest id, exp) list]
+                for chunk in chunks(quest_ids):
+                    rows = (
+                        session.query(Quest.id, Quest.avatar_id, Quest.category_id, Category.category_name,
+                                      Quest.exp_amount, Quest.completed, Quest.recurrence_id, QuestRecurrence.id)
+                        .join(Category, Quest.category_id == Category.id)
+                        .outerjoin(QuestRecurrence, QuestRecurrence.quest_id == Quest.id)
+                        .filter(Quest.id.in_(chunk), Quest.deleted_at.is_(None))
+                        .all()
+                    )
+                    if len(rows) != len(chunk):
+                        missing = set(chunk) - {row[0] for row in rows}
+                        logger.error(f"❌ Quests with ID {sorted(missing)} not found.")
+                        session.rollback()
+                        return None
+
+                    completed_ids, reopened_ids = [], []
+                    for quest_id, avatar_id, category_id, category_name, exp_amount, completed, recurrence_id, \
+                            rule_id in rows:
+                        if rule_id is not None or recurrence_id is not None:
+                            result = self._toggle_quest(session, quest_id)
+                            if result is None:
+                                session.rollback()
+                                return None
+                            results[quest_id] = result
+                            template_results.append(result)
+                            continue
+                        (completed_ids if not completed else reopened_ids).append(quest_id)
+                        exp_delta = -(exp_amount or 0) if completed else (exp_amount or 0)
+                        category_exp = exp_by_category.setdefault((avatar_id, category_id), [category_name, 0, []])
+                        category_exp[1] += exp_delta
+                        category_exp[2].append((quest_id, exp_delta))
+                        results[quest_id] = {
+                            "id": quest_id,
+                            "completed": not completed,
+                            "avatar_id": avatar_id,
+                            "category_id": category_id,
+                            "category_name": category_name,
+                            "exp_delta": exp_delta,
+                        }
 
+                    for ids, completed in ((completed_ids, True), (reopened_ids, False)):
+                        if ids:
+                            session.query(Quest).filter(Quest.id.in_(ids)).update(
+                                {Quest.completed: completed}, synchronize_session=False
+                            )
+
+                changes = []
+                for (avatar_id, category_id), (category_name, exp_delta, completions) in exp_by_category.items():
+                    totals = self._apply_exp(session, avatar_id, category_id, exp_delta, completions)
+                    if totals is None:
+                        session.rollback()
+                        return None
+                    for quest_id, _ in completions:
+                        results[quest_id].update(totals)
+                    changes.append({
+                        "avatar_id": avatar_id,
+                        "category_id": category_id,
+                        "category_name": category_name,
+                        "exp_delta": exp_delta,
+                        **totals
+                    })
                 session.commit()
-                logger.info(
-                    f"✅ Updated experience: Avatar {quest.avatar_id} - {avatar_category.exp_points} XP in Category {quest.category_id}")
+                self.cache.invalidate_avatars()
+                # An un-completed occurrence moves the due date of its recurring quest
+                self.quests.changed(
+                    quest_ids + [result["quest_id"] for result in template_results if "quest_id" in result]
+                )
 
             except Exception as e:
-                logger.error(f"⚠ Error updating experience for Quest {quest_id}: {e}")
                 session.rollback()
+                logger.exception(f"⚠ Error toggling quests {quest_ids}: {e}")
+                return None
+
+        for change in template_results + changes:
+            if change["exp_delta"]:
+                self._publish_xp_change(change)
+        return [results[quest_id] for quest_id in quest_ids]
 
-    #update status of completion a quest
-    def swap_quest_status(self, quest_id):
-        """Toggles the quest's completion status and commits to the DB."""
-        with get_session() as session:
+    # Toggle of one quest inside the caller's transaction, None if it can't be toggled
+    def _toggle_quest(self, session, quest_id):
+        quest = (
+            session.query(Quest.avatar_id, Quest.category_id, Category.category_name, Quest.exp_amount,
+                          Quest.completed, Quest.due_date, Quest.recurrence_id,
+                          QuestRecurrence.id.label("rule_id"))
+            .join(Category, Quest.category_id == Category.id)
+            .outerjoin(QuestRecurrence, QuestRecurrence.quest_id == Quest.id)
+            .filter(Quest.id == quest_id, Quest.deleted_at.is_(None))
+            .first()
+        )
+        if not quest:
+            logger.error(f"❌ Quest with ID {quest_id} not found.")
+            return None
+
+        if quest.rule_id is not None:
+            if quest.due_date is None:
+                logger.error(f"❌ Recurring quest {quest_id} has no occurrence left.")
+                return None
+            return self._complete_occurrences(session, quest_id, [quest.due_date])
+        if quest.recurrence_id is not None:
+            return self._uncomplete_occurrence(session, quest.recurrence_id, quest.due_date)
+
+        completed = not quest.completed
+        exp_delta = (quest.exp_amount or 0) if completed else -(quest.exp_amount or 0)
+        session.query(Quest).filter(Quest.id == quest_id).update(
+            {Quest.completed: completed}, synchronize_session=False
+        )
+        totals = self._apply_exp(session, quest.avatar_id, quest.category_id, exp_delta, [(quest_id, exp_delta)])
+        return totals and {
+            "id": quest_id,
+            "completed": completed,
+            "avatar_id": quest.avatar_id,
+            "category_id": quest.category_id,
+            "category_name": quest.category_name,
+            "exp_delta": exp_delta,
+            **totals
+        }
+
+    # Notify the screens of a committed exp change, with the fields of an XP_CHANGED event
+    @staticmethod
+    def _publish_xp_change(result):
+        change = {key: value for key, value in result.items() if key not in XP_RESULT_ONLY_FIELDS}
+        events.publish(events.XP_CHANGED, **change)
+
+    #create a quest repeated daily, weekly or monthly
+    def add_recurring_quest(self, avatar_id, title, category_name, exp_amount, start_date, frequency, interval=1,
+                            end_date=None, tags=None):
+        """Adds the template quest of the series, its rule and its tags, returns the quest id.
+
+        Only the template is stored, its due date is the next occurrence left to do. Occurrences
+        are generated for a date window by `get_occurrences` and stored once completed.
+        """
+        if frequency not in FREQUENCIES:
+            logger.error(f"Unknown frequency '{frequency}'.")
+            return None
+        start_date = parse_date(start_date)
+        end_date = parse_date(end_date)
+
+        with self.backend.session() as session:
             try:
-                #fetch the quest
-                logger.info(f"🔄 Fetching quest with ID {quest_id}")
-                quest = session.query(Quest).filter_by(id=quest_id).first()
-                if not quest:
-                    logger.error(f"❌ Quest not found.")
+                category_id = self.get_category_id(category_name)
+                if category_id is None:
+                    logger.error(f"Category '{category_name}' not found.")
                     return None
 
-                #update quest completion
-                quest.completed = not quest.completed
-                logger.info(f"✅ Updated status: {quest.completed}")
+                first_occurrence = next(iter_occurrences(frequency, interval, start_date, end_date), None)
+                quest = Quest(
+                    avatar_id=avatar_id,
+                    quest_name=title,
+                    category_id=category_id,
+                    due_date=first_occurrence,
+                    exp_amount=exp_amount
+                )
+                session.add(quest)
+                session.flush()
+                session.add(QuestRecurrence(
+                    quest_id=quest.id,
+                    frequency=frequency,
+                    interval=interval,
+                    start_date=start_date,
+                    end_date=end_date
+                ))
+                if tags:
+                    link_tags(session, [quest.id], tags)
                 session.commit()
+                self.quests.changed([quest.id])
+                return quest.id
 
             except Exception as e:
                 session.rollback()
-                logger.exception(f"⚠ Error updating quest status for : {e}")
+                logger.error(f"⚠ Error adding recurring quest '{title}': {e}")
                 return None
 
-    #return all quests related to an avatar
-    def get_avatar_quests(self, avatar):
-        """Fetches all quests for a given avatar."""
-        with get_session() as session:
-            quests = session.query(Quest).filter_by(avatar_id=avatar.id).all()
-            return [
+    #return the occurrences of the recurring quests of an avatar between two dates, by date
+    def get_occurrences(self, avatar_id, start_date, end_date):
+        """Generated from the rules for the window only, merged with the completed ones.
+
+        Each occurrence is a dict like the quest lists' with `quest_id` (the recurring quest),
+        `id` (the completed occurrence row, None while not completed) and `completed`.
+        """
+        start_date = parse_date(start_date)
+        end_date = parse_date(end_date)
+        with self.backend.session() as session:
+            rules = (
+                session.query(Quest.id, Quest.quest_name, Quest.category_id, Category.category_name, Quest.exp_amount,
+                              QuestRecurrence.id, QuestRecurrence.frequency, QuestRecurrence.interval,
+                              QuestRecurrence.start_date, QuestRecurrence.end_date)
+                .join(Category, Quest.category_id == Category.id)
+                .join(QuestRecurrence, QuestRecurrence.quest_id == Quest.id)
+                .filter(
+                    Quest.avatar_id == avatar_id,
+                    Quest.deleted_at.is_(None),
+                    QuestRecurrence.start_date <= end_date,
+                    or_(QuestRecurrence.end_date.is_(None), QuestRecurrence.end_date >= start_date)
+                )
+                .all()
+            )
+            if not rules:
+                return []
+
+            completed = {
+                (recurrence_id, due_date): occurrence_id
+                for occurrence_id, recurrence_id, due_date in session.query(
+                    Quest.id, Quest.recurrence_id, Quest.due_date
+                ).filter(
+                    Quest.recurrence_id.in_([rule[5] for rule in rules]),
+                    Quest.due_date.between(start_date, end_date)
+                )
+            }
+
+        def occurrences(rule):
+            quest_id, quest_name, category_id, category_name, exp_amount, rule_id, *repeat = rule
+            for day in occurrences_between(*repeat, start_date, end_date):
+                occurrence_id = completed.get((rule_id, day))
+                yield day, quest_id, {
+                    "id": occurrence_id,
+                    "quest_id": quest_id,
+                    "quest_name": quest_name,
+                    "category_id": category_id,
+                    "category_name": category_name,
+                    "due_date": day.isoformat(),
+                    "exp_amount": exp_amount,
+                    "completed": occurrence_id is not None
+                }
+
+        return [occurrence for _, _, occurrence in heapq.merge(*(occurrences(rule) for rule in rules),
+                                                                key=lambda item: item[:2])]
+
+    #complete several occurrences of a recurring quest at once
+    def complete_occurrences(self, quest_id, dates):
+        """Stores the occurrences as completed quests with one batch insert and applies their exp.
+
+        Dates already completed are skipped. The recurring quest's due date moves to the next
+        occurrence left to do. Returns the new state like `toggle_quest`, None on error.
+        """
+        with self.backend.session() as session:
+            try:
+                result = self._complete_occurrences(session, quest_id, dates)
+                if result is None:
+                    session.rollback()
+                    return None
+                session.commit()
+                self.cache.invalidate_avatars()
+                self.quests.changed([quest_id])
+
+            except Exception as e:
+                session.rollback()
+                logger.exception(f"⚠ Error completing occurrences of quest {quest_id}: {e}")
+                return None
+
+        if result["exp_delta"]:
+            self._publish_xp_change(result)
+        return result
+
+    #un-complete an occurrence of a recurring quest, removing its exp
+    def uncomplete_occurrence(self, quest_id, day):
+        with self.backend.session() as session:
+            try:
+                rule_id = session.query(QuestRecurrence.id).filter(QuestRecurrence.quest_id == quest_id).scalar()
+                if rule_id is None:
+                    logger.error(f"❌ Quest {quest_id} is not recurring.")
+                    return None
+                result = self._uncomplete_occurrence(session, rule_id, parse_date(day))
+                if result is None:
+                    session.rollback()
+                    return None
+                session.commit()
+                self.cache.invalidate_avatars()
+                self.quests.changed([quest_id])
+
+            except Exception as e:
+                session.rollback()
+                logger.exception(f"⚠ Error un-completing occurrence {day} of quest {quest_id}: {e}")
+                return None
+
+        self._publish_xp_change(result)
+        return result
+
+    def _complete_occurrences(self, session, quest_id, dates):
+        template = (
+            session.query(Quest.avatar_id, Quest.quest_name, Quest.category_id, Category.category_name,
+                          Quest.exp_amount, Quest.due_date, QuestRecurrence.id, QuestRecurrence.frequency,
+                          QuestRecurrence.interval, QuestRecurrence.start_date, QuestRecurrence.end_date)
+            .join(Category, Quest.category_id == Category.id)
+            .join(QuestRecurrence, QuestRecurrence.quest_id == Quest.id)
+            .filter(Quest.id == quest_id, Quest.deleted_at.is_(None))
+            .first()
+        )
+        if not template:
+            logger.error(f"❌ Recurring quest with ID {quest_id} not found.")
+            return None
+        avatar_id, quest_name, category_id, category_name, exp_amount, due_date, rule_id, *repeat = template
+
+        dates = sorted({parse_date(day) for day in dates})
+        invalid = [day for day in dates if not is_occurrence(*repeat, day)]
+        if invalid:
+            logger.error(f"❌ {invalid[0]} is not an occurrence of quest {quest_id}.")
+            return None
+
+        already_completed = set()
+        for start in range(0, len(dates), ID_CHUNK_SIZE):
+            already_completed.update(day for (day,) in session.query(Quest.due_date).filter(
+                Quest.recurrence_id == rule_id, Quest.due_date.in_(dates[start:start + ID_CHUNK_SIZE])
+            ))
+        new_dates = [day for day in dates if day not in already_completed]
+        if new_dates:
+            session.execute(Quest.__table__.insert(), [
                 {
-                    "id": quest.id,
-                    "quest_name": quest.quest_name,
-                    "category_id": quest.category_id,
-                    "category_name": quest.category.category_name,
-                    "due_date": quest.due_date.strftime('%Y-%m-%d') if quest.due_date else "No date",
-                    "exp_amount": quest.exp_amount,
-                    "completed": quest.completed
+                    "avatar_id": avatar_id,
+                    "quest_name": quest_name,
+                    "category_id": category_id,
+                    "completed": True,
+                    "exp_amount": exp_amount,
+                    "due_date": day,
+                    "recurrence_id": rule_id,
                 }
-                for quest in quests
-            ]
+                for day in new_dates
+            ])
+
+        exp_delta = (exp_amount or 0) * len(new_dates)
+        totals = self._apply_exp(session, avatar_id, category_id, exp_delta,
+                                 [(quest_id, exp_amount or 0) for _ in new_dates])
+        if totals is None:
+            return None
+
+        next_due = next_open_occurrence(session, rule_id, repeat, due_date or repeat[2])
+        if next_due != due_date:
+            session.query(Quest).filter(Quest.id == quest_id).update(
+                {Quest.due_date: next_due}, synchronize_session=False
+            )
+        return {
+            "id": quest_id,
+            "completed": False,  # The recurring quest stays open, its due date moves on
+            "due_date": format_date(next_due),
+            "completed_occurrences": len(new_dates),
+            "avatar_id": avatar_id,
+            "category_id": category_id,
+            "category_name": category_name,
+            "exp_delta": exp_delta,
+            **totals
+        }
+
+    def _uncomplete_occurrence(self, session, rule_id, day):
+        occurrence = (
+            session.query(Quest.id, Quest.avatar_id, Quest.category_id, Category.category_name, Quest.exp_amount,
+                          QuestRecurrence.quest_id)
+            .join(Category, Quest.category_id == Category.id)
+            .join(QuestRecurrence, QuestRecurrence.id == Quest.recurrence_id)
+            .filter(Quest.recurrence_id == rule_id, Quest.due_date == day)
+            .first()
+        )
+        if not occurrence:
+            logger.error(f"❌ Occurrence {day} of recurrence {rule_id} is not completed.")
+            return None
+        occurrence_id, avatar_id, category_id, category_name, exp_amount, quest_id = occurrence
+
+        session.query(Quest).filter(Quest.id == occurrence_id).delete(synchronize_session=False)
+        exp_delta = -(exp_amount or 0)
+        totals = self._apply_exp(session, avatar_id, category_id, exp_delta, [(quest_id, exp_delta)])
+        if totals is None:
+            return None
+
+        # The occurrence is left to do again, it becomes the due date if it is the earliest one
+        template = session.query(Quest).filter(Quest.id == quest_id)
+        due_date = template.with_entities(Quest.due_date).scalar()
+        if due_date is None or day < due_date:
+            template.update({Quest.due_date: day}, synchronize_session=False)
+            due_date = day
+        return {
+            "id": occurrence_id,
+            "quest_id": quest_id,
+            "completed": False,
+            "due_date": due_date.isoformat(),
+            "avatar_id": avatar_id,
+            "category_id": category_id,
+            "category_name": category_name,
+            "exp_delta": exp_delta,
+            **totals
+        }
+
+    # Add exp to an avatar category and to the avatar totals, inside the caller's transaction
+    def _apply_exp(self, session, avatar_id, category_id, exp_delta, completions=()):
+        """Incremental update of the materialized exp: category points, avatar experience and level.
+
+        `completions` lists the (quest id, exp delta) behind the change, appended to the history
+        in the same transaction (see `_log_completions`).
+        Returns the new totals with the category level progress, None if the avatar has no row
+        for the category.
+        """
+        avatar_category = session.query(AvatarCategory).filter_by(avatar_id=avatar_id, category_id=category_id)
+        updated = avatar_category.update(
+            {AvatarCategory.exp_points: AvatarCategory.exp_points + exp_delta}, synchronize_session=False
+        )
+        if not updated:
+            logger.error(f"⚠ AvatarCategory entry not found for Avatar {avatar_id} and Category {category_id}")
+            return None
+
+        avatar = session.query(Avatar).filter(Avatar.id == avatar_id)
+        avatar.update({Avatar.experience: func.coalesce(Avatar.experience, 0) + exp_delta}, synchronize_session=False)
+        experience, level = avatar.with_entities(Avatar.experience, Avatar.level).one()
+        new_level = self.level_curve.level_for(experience)
+        if new_level != level:
+            avatar.update({Avatar.level: new_level}, synchronize_session=False)
+
+        if completions:
+            self._log_completions(session, avatar_id, category_id, completions)
+
+        exp_points = avatar_category.with_entities(AvatarCategory.exp_points).scalar()
+        category_progress = self.level_curve.progress(exp_points)
+        return {
+            "exp_points": exp_points,
+            "category_level": category_progress.level,
+            "category_progress": category_progress.progress,
+            "category_needed": category_progress.needed,
+            "avatar_experience": experience,
+            "avatar_level": new_level
+        }
+
+    # Append the completion events and add them to the day / week / month rollups
+    @staticmethod
+    def _log_completions(session, avatar_id, category_id, completions, occurred_at=None):
+        """One executemany for the events and one upsert for the three rollup rows.
+
+        An un-completion (negative exp) counts as -1 completion in the bucket of the day it happens.
+        """
+        occurred_at = occurred_at or datetime.datetime.now()
+        session.execute(QuestEvent.__table__.insert(), [
+            {
+                "avatar_id": avatar_id,
+                "category_id": category_id,
+                "quest_id": quest_id,
+                "exp_delta": exp_delta,
+                "occurred_at": occurred_at
+            }
+            for quest_id, exp_delta in completions
+        ])
+
+        exp = sum(exp_delta for _, exp_delta in completions)
+        count = sum(1 if exp_delta >= 0 else -1 for _, exp_delta in completions)
+        day = occurred_at.date()
+        upsert = sqlite_insert(XpRollup).values([
+            {
+                "avatar_id": avatar_id,
+                "period": period,
+                "period_start": period_start(day, period),
+                "category_id": category_id,
+                "exp": exp,
+                "completions": count
+            }
+            for period in PERIODS
+        ])
+        session.execute(upsert.on_conflict_do_update(
+            index_elements=["avatar_id", "period", "period_start", "category_id"],
+            set_={
+                "exp": XpRollup.exp + upsert.excluded.exp,
+                "completions": XpRollup.completions + upsert.excluded.completions
+            }
+        ))
+
+    #return the exp earned per category per day, week or month, read from the rollups
+    def get_xp_history(self, avatar_id, period="day", start=None, end=None, category_name=None):
+        """A few rows per bucket, whatever the number of completions: a year of days is at most
+        365 rows per category. `start` / `end` are dates, both included, None for an open end.
+
+        Returns dicts with `period_start` (ISO date), `category_name`, `exp` and `completions`,
+        oldest first.
+        """
+        if period not in PERIODS:
+            logger.error(f"Unknown period '{period}'.")
+            return []
+        with self.backend.session() as session:
+            query = session.query(XpRollup.period_start, XpRollup.category_id, XpRollup.exp, XpRollup.completions)
+            query = query.filter(XpRollup.avatar_id == avatar_id, XpRollup.period == period)
+            if start is not None:
+                query = query.filter(XpRollup.period_start >= period_start(parse_date(start), period))
+            if end is not None:
+                query = query.filter(XpRollup.period_start <= parse_date(end))
+            if category_name is not None:
+                query = query.filter(XpRollup.category_id == self.get_category_id(category_name))
+            rows = query.order_by(XpRollup.period_start, XpRollup.category_id).all()
+
+        return [
+            {
+                "period_start": bucket.isoformat(),
+                "category_name": self.cache.category_name(category_id, self._load_categories),
+                "exp": exp,
+                "completions": completions
+            }
+            for bucket, category_id, exp, completions in rows
+        ]
+
+    #return the latest completion events of an avatar, newest first, a page at a time
+    def get_completion_events(self, avatar_id, before_id=None, limit=QUEST_PAGE_SIZE):
+        with self.backend.session() as session:
+            query = (
+                session.query(QuestEvent.id, QuestEvent.quest_id, Quest.quest_name, QuestEvent.category_id,
+                              QuestEvent.exp_delta, QuestEvent.occurred_at)
+                .outerjoin(Quest, Quest.id == QuestEvent.quest_id)
+                .filter(QuestEvent.avatar_id == avatar_id)
+            )
+            if before_id is not None:
+                query = query.filter(QuestEvent.id < before_id)
+            rows = query.order_by(QuestEvent.id.desc()).limit(limit).all()
+
+        return [
+            {
+                "id": event_id,
+                "quest_id": quest_id,
+                "quest_name": quest_name,  # None once the quest is purged
+                "category_name": self.cache.category_name(category_id, self._load_categories),
+                "exp_delta": exp_delta,
+                "occurred_at": occurred_at.isoformat(timespec="seconds")
+            }
+            for event_id, quest_id, quest_name, category_id, exp_delta, occurred_at in rows
+        ]
+
+    #recompute the rollups from the event log, for one avatar or all of them
+    def rebuild_xp_history(self, avatar_id=None):
+        """Repair tool, the rollups are normally kept up to date by every completion.
+
+        Returns the number of events read, None on error.
+        """
+        with self.backend.session() as session:
+            try:
+                rollups = {}
+                events_read = 0
+                query = session.query(QuestEvent.avatar_id, QuestEvent.category_id, QuestEvent.exp_delta,
+                                      QuestEvent.occurred_at)
+                if avatar_id is not None:
+                    query = query.filter(QuestEvent.avatar_id == avatar_id)
+                for event_avatar_id, category_id, exp_delta, occurred_at in query.yield_per(BULK_BATCH_SIZE):
+                    events_read += 1
+                    for period in PERIODS:
+                        key = (event_avatar_id, period, period_start(occurred_at.date(), period), category_id)
+                        totals = rollups.setdefault(key, [0, 0])
+                        totals[0] += exp_delta
+                        totals[1] += 1 if exp_delta >= 0 else -1
+
+                rollup_rows = session.query(XpRollup)
+                if avatar_id is not None:
+                    rollup_rows = rollup_rows.filter(XpRollup.avatar_id == avatar_id)
+                rollup_rows.delete(synchronize_session=False)
+                rows = [
+                    {
+                        "avatar_id": key[0],
+                        "period": key[1],
+                        "period_start": key[2],
+                        "category_id": key[3],
+                        "exp": exp,
+                        "completions": completions
+                    }
+                    for key, (exp, completions) in rollups.items()
+                ]
+                for batch in chunks(rows, BULK_BATCH_SIZE):
+                    session.execute(XpRollup.__table__.insert(), batch)
+                session.commit()
+                return events_read
+
+            except Exception as e:
+                session.rollback()
+                logger.exception(f"⚠ Error rebuilding the exp history: {e}")
+                return None
+
+    #recompute the materialized exp from the completed quests, and fix it if asked
+    def check_experience(self, repair=False, avatar_id=None):
+        """Bulk consistency check of avatar_category.exp_points and of the avatar experience / level.
+
+        The expected values are the sums of the exp of the completed quests, deleted ones included,
+        plus the exp of the completed quests already purged (avatar_category.purged_exp).
+        Limited to one avatar when `avatar_id` is given.
+        Returns a list of (table, key, stored value, expected value) tuples.
+        """
+        scope = avatar_id
+        with self.backend.session() as session:
+            try:
+                completed_quests = session.query(Quest.avatar_id, Quest.category_id, func.sum(Quest.exp_amount))
+                completed_quests = completed_quests.filter(Quest.completed.is_(True))
+                avatar_categories = session.query(
+                    AvatarCategory.avatar_id, AvatarCategory.category_id, AvatarCategory.exp_points,
+                    AvatarCategory.purged_exp
+                )
+                avatars = session.query(Avatar.id, Avatar.experience, Avatar.level)
+                if scope is not None:
+                    completed_quests = completed_quests.filter(Quest.avatar_id == scope)
+                    avatar_categories = avatar_categories.filter(AvatarCategory.avatar_id == scope)
+                    avatars = avatars.filter(Avatar.id == scope)
+
+                earned = {
+                    (avatar_id, category_id): exp or 0
+                    for avatar_id, category_id, exp in completed_quests.group_by(Quest.avatar_id, Quest.category_id)
+                }
+
+                drift = []
+                avatar_totals = {}
+                for avatar_id, category_id, exp_points, purged_exp in avatar_categories:
+                    expected = earned.get((avatar_id, category_id), 0) + purged_exp
+                    avatar_totals[avatar_id] = avatar_totals.get(avatar_id, 0) + expected
+                    if exp_points != expected:
+                        drift.append(("avatar_category", (avatar_id, category_id), exp_points, expected))
+                        if repair:
+                            session.query(AvatarCategory).filter_by(
+                                avatar_id=avatar_id, category_id=category_id
+                            ).update({AvatarCategory.exp_points: expected}, synchronize_session=False)
+
+                for avatar_id, experience, level in avatars:
+                    expected = avatar_totals.get(avatar_id, 0)
+                    expected_level = self.level_curve.level_for(expected)
+                    if experience != expected:
+                        drift.append(("avatar.experience", avatar_id, experience, expected))
+                    if level != expected_level:
+                        drift.append(("avatar.level", avatar_id, level, expected_level))
+                    if repair and (experience != expected or level != expected_level):
+                        session.query(Avatar).filter(Avatar.id == avatar_id).update(
+                            {Avatar.experience: expected, Avatar.level: expected_level}, synchronize_session=False
+                        )
+
+                if repair and drift:
+                    session.commit()
+                    self.cache.invalidate_avatars()
+                return drift
+
+            except Exception as e:
+                session.rollback()
+                logger.exception(f"⚠ Error checking experience: {e}")
+                return None
+
+    #return all quests related to an avatar
+    def get_avatar_quests(self, avatar, as_records=False, sort_key="id", descending=False):
+        """Fetches all quests for a given avatar, as dicts or QuestRecord objects.
+
+        The completed occurrences of recurring quests are not listed, only the recurring quest.
+        """
+        rows = self.quests.avatar_quests(avatar.id, sort_key, descending)
+        return [self._quest_from_row(row, as_records) for row in rows]
+
+    #return one page of quests related to an avatar
+    def get_avatar_quests_page(self, avatar_id, after=None, limit=QUEST_PAGE_SIZE, sort_key="id", descending=False,
+                               as_records=False, due_range=None, completed=None, tags=None):
+        """Keyset pagination over an avatar's quests, ordered by (sort key, id).
+
+        `after` is the cursor returned with the previous page (None for the first page).
+        `due_range` is a (start, end) pair of dates, both included, None for an open end
+        (see `agenda_range`); `completed` keeps only the done / not done quests; `tags` keeps
+        the quests carrying all the given tags.
+        Returns (quests, next_cursor); next_cursor is None once the last page is reached.
+        Raises ValueError when `limit` is below 1.
+        """
+        if limit < 1:
+            raise ValueError(f"A page holds at least one quest, got limit={limit}")
+        rows, next_cursor = self.quests.page(avatar_id, after, limit, sort_key, descending, due_range, completed,
+                                             normalize_tags(tags or ()))
+        return [self._quest_from_row(row, as_records) for row in rows], next_cursor
+
+    #return the open quests of an avatar that are overdue, due today and due in the next days
+    def get_agenda(self, avatar_id, days=AGENDA_DAYS, today=None, as_records=False):
+        """One range query (served by ix_quests_avatar_completed_due_date) split into the
+        "overdue", "today" and "upcoming" lists, each ordered by due date.
+
+        A recurring quest is listed once, at its next occurrence; `get_occurrences` expands a window.
+        """
+        today = today or datetime.date.today()
+        _, last_day = self.agenda_range("upcoming", today, days)
+        agenda = {"overdue": [], "today": [], "upcoming": []}
+        for row in self.quests.agenda(avatar_id, last_day):
+            due_date = row[4]
+            section = "overdue" if due_date < today else "today" if due_date == today else "upcoming"
+            agenda[section].append(self._quest_from_row(row, as_records))
+        return agenda
+
+    #return the (start, end) dates of a named agenda range, None for an open end
+    @staticmethod
+    def agenda_range(name, today=None, days=AGENDA_DAYS):
+        today = today or datetime.date.today()
+        if name == "overdue":
+            return None, today - datetime.timedelta(days=1)
+        if name == "today":
+            return today, today
+        if name == "upcoming":
+            return today + datetime.timedelta(days=1), today + datetime.timedelta(days=days)
+        raise ValueError(f"Unknown agenda range '{name}'")
+
+    #return quest ids matching a search text, best matches first
+    def search_quest_ids(self, avatar_id, search_text, limit=None, tags=None):
+        """Full-text prefix search on quest names, then prefix match on category names.
+
+        Name matches come first in FTS5 rank order, followed by the remaining quests
+        whose category starts with the search text. `tags` keeps the quests carrying all of them.
+        """
+        return self.quests.search(avatar_id, search_text, limit, normalize_tags(tags or ()))
+
+    #return quests by id, keeping the order of the given ids
+    def get_quests_by_ids(self, quest_ids, as_records=False):
+        quests_by_id = {row[0]: self._quest_from_row(row, as_records) for row in self.quests.by_ids(quest_ids)}
+        return [quests_by_id[quest_id] for quest_id in quest_ids if quest_id in quests_by_id]
+
+    @staticmethod
+    def _quest_from_row(row, as_records=False):
+        quest_id, quest_name, category_id, category_name, due_date, exp_amount, completed = row
+        due_date = format_date(due_date)
+        if as_records:
+            return QuestRecord(quest_id, quest_name, category_id, category_name, due_date, exp_amount, completed)
+        return {
+            "id": quest_id,
+            "quest_name": quest_name,
+            "category_id": category_id,
+            "category_name": category_name,
+            "due_date": due_date,
+            "exp_amount": exp_amount,
+            "completed": completed
+        }
 
     #create a new quest
-    def add_quest(self, avatar_id, title, category_name, exp_amount, due_date=None):
-        """Adds a new quest to the database safely."""
-        with get_session() as session:
+    def add_quest(self, avatar_id, title, category_name, exp_amount, due_date=None, tags=None):
+        """Adds a new quest to the database safely, with its tags, returns its id."""
+        with self.backend.session() as session:
             try:
-                #fetch category object
-                category = session.query(Category).filter_by(category_name=category_name).first()
-                if not category:
+                #fetch category id
+                category_id = self.get_category_id(category_name)
+                if category_id is None:
                     logger.error(f"Category '{category_name}' not found.")
                     return
 
@@ -135,30 +1038,617 @@ class DataManager:
                 new_quest = Quest(
                     avatar_id=avatar_id,
                     quest_name=title,
-                    category_id=category.id,
+                    category_id=category_id,
                     due_date=datetime.datetime.strptime(due_date, '%Y-%m-%d') if due_date else None,
                     exp_amount=exp_amount
                 )
 
                 session.add(new_quest)
+                if tags:
+                    session.flush()
+                    link_tags(session, [new_quest.id], tags)
                 session.commit()  # 🔥 Ajout de session.commit()
+                self.quests.changed([new_quest.id])
+                return new_quest.id
 
             except Exception as e:
                 session.rollback()
                 logger.error(f"⚠ Error adding quest '{title}': {e}")
 
-    #remove a quest
+    #insert many quests from an iterable of dicts, streamed in batches
+    def bulk_add_quests(self, quests, batch_size=BULK_BATCH_SIZE):
+        """Bulk insert for imports and seeding, in a single transaction.
+
+        Each quest is a dict with `avatar_id`, `quest_name`, `category_name` and optionally
+        `exp_amount`, `due_date` ('YYYY-MM-DD' or date) and `completed`. Rows are inserted with
+        executemany in batches of `batch_size`, resolving categories from a name -> id map built once.
+        Quests with an unknown category are skipped. The exp of the completed ones is added to
+        their avatars, without history events (the completion dates are unknown).
+        Returns the number of inserted quests.
+        """
+        quests = iter(quests)
+        inserted = 0
+        skipped = 0
+        exp_by_category = {}  # (avatar id, category id) -> exp of the completed quests
+        with self.backend.session() as session:
+            try:
+                category_ids = {category.category_name: category.id for category in self.get_categories()}
+                while True:
+                    batch = list(islice(quests, batch_size))
+                    if not batch:
+                        break
+                    rows = [
+                        {
+                            "avatar_id": quest["avatar_id"],
+                            "quest_name": quest["quest_name"],
+                            "category_id": category_ids[quest["category_name"]],
+                            "completed": bool(quest.get("completed", False)),
+                            "exp_amount": quest.get("exp_amount") or 0,
+                            "due_date": parse_date(quest.get("due_date"))
+                        }
+                        for quest in batch
+                        if quest["category_name"] in category_ids
+                    ]
+                    skipped += len(batch) - len(rows)
+                    if rows:
+                        session.execute(Quest.__table__.insert(), rows)
+                        inserted += len(rows)
+                    for row in rows:
+                        if row["completed"]:
+                            key = (row["avatar_id"], row["category_id"])
+                            exp_by_category[key] = exp_by_category.get(key, 0) + row["exp_amount"]
+
+                for (avatar_id, category_id), exp_delta in exp_by_category.items():
+                    if exp_delta and self._apply_exp(session, avatar_id, category_id, exp_delta) is None:
+                        session.rollback()
+                        return 0
+                if skipped:
+                    logger.error(f"⚠ {skipped} quests skipped, unknown category.")
+                session.commit()
+                if exp_by_category:
+                    self.cache.invalidate_avatars()
+                if inserted:
+                    self.quests.changed()  # The new ids are not known
+                return inserted
+
+            except Exception as e:
+                session.rollback()
+                logger.error(f"⚠ Error in bulk quest import: {e}")
+                return 0
+
+    #stream quests as plain dicts without loading the whole table
+    def iter_quests(self, avatar_id=None, batch_size=BULK_BATCH_SIZE):
+        """Generator over quests in id order, fetched page by page with a keyset on id."""
+        last_id = 0
+        while True:
+            with self.backend.session() as session:
+                query = (
+                    session.query(Quest.id, Quest.avatar_id, Quest.quest_name, Category.category_name,
+                                  Quest.completed, Quest.exp_amount, Quest.due_date)
+                    .join(Category, Quest.category_id == Category.id)
+                    .filter(Quest.id > last_id, Quest.deleted_at.is_(None))
+                )
+                if avatar_id is not None:
+                    query = query.filter(Quest.avatar_id == avatar_id)
+                rows = query.order_by(Quest.id).limit(batch_size).all()
+
+            for row in rows:
+                yield {
+                    "id": row.id,
+                    "avatar_id": row.avatar_id,
+                    "quest_name": row.quest_name,
+                    "category_name": row.category_name,
+                    "completed": bool(row.completed),
+                    "exp_amount": row.exp_amount,
+                    "due_date": row.due_date.isoformat() if row.due_date else None
+                }
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1].id
+
+    #remove a quest, it can be restored until it is purged
     def remove_quest(self, quest_id):
-        with get_session() as session:
+        return bool(self.remove_quests([quest_id]))
+
+    #soft delete quests, a single UPDATE ... WHERE id IN (...) per chunk of ids
+    def remove_quests(self, quest_ids):
+        """Marks the quests deleted: they leave every list at once and are hard-deleted by
+        `purge_deleted` after TOMBSTONE_RETENTION. Returns the number of quests deleted, None on error.
+        """
+        return self._set_deleted(quest_ids, datetime.datetime.now())
+
+    #undo remove_quests
+    def restore_quests(self, quest_ids):
+        return self._set_deleted(quest_ids, None)
+
+    def _set_deleted(self, quest_ids, deleted_at):
+        with self.backend.session() as session:
             try:
-                quest = session.query(Quest).filter_by(id=quest_id).first()
-                if not quest:
-                    logger.error(f"Quest  ID '{quest_id}' not found.")
-                    return
+                count = 0
+                for chunk in chunks(quest_ids):
+                    quests = session.query(Quest).filter(Quest.id.in_(chunk))
+                    if deleted_at is None:
+                        quests = quests.filter(Quest.deleted_at.isnot(None))
+                    else:
+                        quests = quests.filter(Quest.deleted_at.is_(None))
+                    count += quests.update({Quest.deleted_at: deleted_at}, synchronize_session=False)
+                session.commit()
+                self.quests.changed(quest_ids)
+                return count
 
-                session.delete(quest)
-                session.commit()  # 🔥 Ajout de session.commit()
+            except Exception as e:
+                session.rollback()
+                logger.error(f"⚠ Error {'restoring' if deleted_at is None else 'removing'} quests {quest_ids}: {e}")
+                return None
+
+    #return the tags in use with their number of quests, of one avatar or of every avatar
+    def get_tags(self, avatar_id=None, with_counts=True):
+        """Sorted by name, deleted quests and completed occurrences are not counted.
+
+        Counting reads every link of the tags; without counts (quest_count is None) each tag
+        only looks for its first quest, enough to fill a menu.
+        Returns a list of TagRecord, None on error.
+        """
+        try:
+            return self.quests.tags(avatar_id, with_counts)
+        except Exception as e:
+            logger.error(f"⚠ Error reading the tags: {e}")
+            return None
+
+    #return the tags of quests, by quest id
+    def get_quest_tags(self, quest_ids):
+        """Read through the junction primary key. Returns {quest id: sorted tag names}, the quests
+        without tags are left out.
+        """
+        return self.quests.quest_tags(quest_ids)
+
+    #replace the tags of a quest, returns its new tags
+    def set_quest_tags(self, quest_id, tag_names):
+        with self.backend.session() as session:
+            try:
+                if session.get(Quest, quest_id) is None:
+                    logger.error(f"❌ Quest with ID {quest_id} not found.")
+                    return None
+                tags = replace_quest_tags(session, quest_id, tag_names)
+                drop_unused_tags(session)
+                session.commit()
+                self.quests.changed([quest_id])
+                return tags
+            except Exception as e:
+                session.rollback()
+                logger.error(f"⚠ Error tagging quest {quest_id}: {e}")
+                return None
+
+    #add tags to several quests, the new tag names are created
+    def add_tags(self, quest_ids, tag_names):
+        """Returns the number of (quest, tag) links added, None on error."""
+        with self.backend.session() as session:
+            try:
+                added = 0
+                for chunk in chunks(quest_ids):
+                    quest_ids_chunk = [quest_id for (quest_id,) in session.query(Quest.id).filter(Quest.id.in_(chunk))]
+                    added += link_tags(session, quest_ids_chunk, tag_names)
+                session.commit()
+                self.quests.changed(quest_ids)
+                return added
+            except Exception as e:
+                session.rollback()
+                logger.error(f"⚠ Error adding tags {tag_names} to quests {quest_ids}: {e}")
+                return None
+
+    #remove tags from several quests
+    def remove_tags(self, quest_ids, tag_names):
+        """Returns the number of (quest, tag) links removed, None on error."""
+        with self.backend.session() as session:
+            try:
+                tag_ids = list(tag_ids_by_name(session, normalize_tags(tag_names)).values())
+                removed = 0
+                if tag_ids:
+                    for chunk in chunks(quest_ids):
+                        removed += session.query(QuestTag).filter(
+                            QuestTag.quest_id.in_(chunk), QuestTag.tag_id.in_(tag_ids)
+                        ).delete(synchronize_session=False)
+                    drop_unused_tags(session)
+                session.commit()
+                self.quests.changed(quest_ids)
+                return removed
+            except Exception as e:
+                session.rollback()
+                logger.error(f"⚠ Error removing tags {tag_names} from quests {quest_ids}: {e}")
+                return None
+
+    #rename a tag on every quest, merged into the tag of the new name when it exists
+    def rename_tag(self, tag_name, new_name):
+        """The quests are moved to the new tag rather than the tag renamed in place, so the change
+        is journaled on each quest and reaches the synced devices. Returns the number of quests
+        moved, None on error.
+        """
+        tag_name, new_name = normalize_tag(tag_name), normalize_tag(new_name)
+        if not new_name:
+            logger.error("❌ A tag needs a name.")
+            return None
+        with self.backend.session() as session:
+            try:
+                tag_id = tag_ids_by_name(session, [tag_name]).get(tag_name)
+                if tag_id is None:
+                    logger.error(f"Tag '{tag_name}' not found.")
+                    return None
+                if new_name == tag_name:
+                    return 0
+                new_id = tag_ids_by_name(session, [new_name], create=True)[new_name]
+                tagged = select(QuestTag.quest_id, literal(new_id)).where(QuestTag.tag_id == tag_id)
+                session.execute(sqlite_insert(QuestTag).from_select(["quest_id", "tag_id"], tagged)
+                                .on_conflict_do_nothing())
+                moved = session.query(QuestTag).filter(QuestTag.tag_id == tag_id).delete(synchronize_session=False)
+                session.query(Tag).filter(Tag.id == tag_id).delete(synchronize_session=False)
+                session.commit()
+                self.quests.changed()
+                return moved
+            except Exception as e:
+                session.rollback()
+                logger.error(f"⚠ Error renaming tag '{tag_name}' to '{new_name}': {e}")
+                return None
+
+    #remove a tag from every quest, returns the number of quests untagged
+    def delete_tag(self, tag_name):
+        tag_name = normalize_tag(tag_name)
+        with self.backend.session() as session:
+            try:
+                tag_id = tag_ids_by_name(session, [tag_name]).get(tag_name)
+                if tag_id is None:
+                    logger.error(f"Tag '{tag_name}' not found.")
+                    return None
+                removed = session.query(QuestTag).filter(QuestTag.tag_id == tag_id).delete(synchronize_session=False)
+                session.query(Tag).filter(Tag.id == tag_id).delete(synchronize_session=False)
+                session.commit()
+                self.quests.changed()
+                return removed
+            except Exception as e:
+                session.rollback()
+                logger.error(f"⚠ Error deleting tag '{tag_name}': {e}")
+                return None
+
+    #complete several quests at once, a single UPDATE ... WHERE id IN (...) per chunk of ids
+    def complete_quests(self, quest_ids):
+        """Completes the open quests among `quest_ids` and applies their exp, in one transaction.
+
+        A recurring quest completes its next occurrence, like `toggle_quest`.
+        Returns the new state of each changed quest ({"id", "completed", "due_date"}), None on error.
+        """
+        with self.backend.session() as session:
+            try:
+                states = []
+                exp_by_category = {}  # (avatar id, category id) -> [category name, exp, (quest id, exp) list]
+                template_results = []
+                for chunk in chunks(quest_ids):
+                    rows = (
+                        session.query(Quest.id, Quest.avatar_id, Quest.category_id, Category.category_name,
+                                      Quest.exp_amount, Quest.due_date, QuestRecurrence.id)
+                        .join(Category, Quest.category_id == Category.id)
+                        .outerjoin(QuestRecurrence, QuestRecurrence.quest_id == Quest.id)
+                        .filter(Quest.id.in_(chunk), Quest.completed == False, Quest.deleted_at.is_(None),
+                                Quest.recurrence_id.is_(None))
+                        .all()
+                    )
+                    plain_ids = []
+                    for quest_id, avatar_id, category_id, category_name, exp_amount, due_date, rule_id in rows:
+                        if rule_id is not None:
+                            if due_date is not None:
+                                result = self._complete_occurrences(session, quest_id, [due_date])
+                                if result is None:
+                                    session.rollback()
+                                    return None
+                                template_results.append(result)
+                                states.append({"id": quest_id, "completed": False, "due_date": result["due_date"]})
+                            continue
+                        plain_ids.append(quest_id)
+                        category_exp = exp_by_category.setdefault((avatar_id, category_id), [category_name, 0, []])
+                        category_exp[1] += exp_amount or 0
+                        category_exp[2].append((quest_id, exp_amount or 0))
+                        states.append({"id": quest_id, "completed": True, "due_date": format_date(due_date)})
+
+                    if plain_ids:
+                        session.query(Quest).filter(Quest.id.in_(plain_ids)).update(
+                            {Quest.completed: True}, synchronize_session=False
+                        )
+
+                changes = []
+                for (avatar_id, category_id), (category_name, exp_delta, completions) in exp_by_category.items():
+                    totals = self._apply_exp(session, avatar_id, category_id, exp_delta, completions)
+                    if totals is None:
+                        session.rollback()
+                        return None
+                    changes.append({
+                        "avatar_id": avatar_id,
+                        "category_id": category_id,
+                        "category_name": category_name,
+                        "exp_delta": exp_delta,
+                        **totals
+                    })
+                session.commit()
+                self.cache.invalidate_avatars()
+                self.quests.changed(quest_ids)
+
+            except Exception as e:
+                session.rollback()
+                logger.exception(f"⚠ Error completing quests {quest_ids}: {e}")
+                return None
+
+        # The last event of a category carries its final totals
+        for change in template_results + changes:
+            if change["exp_delta"]:
+                self._publish_xp_change(change)
+        return states
+
+    #hard-delete the quests soft deleted for longer than `older_than`, in chunks
+    def purge_deleted(self, older_than=None, chunk_size=ID_CHUNK_SIZE, vacuum=True):
+        """Each chunk is its own short transaction so the app can keep writing in between.
+
+        The file is compacted afterwards (see database.compact_database) when anything was purged.
+        Returns the number of quests purged, None on error.
+        """
+        cutoff = datetime.datetime.now() - (TOMBSTONE_RETENTION if older_than is None else older_than)
+        purged = 0
+        while True:
+            with self.backend.session() as session:
+                try:
+                    quest_ids = [
+                        quest_id for (quest_id,) in session.query(Quest.id)
+                        .filter(Quest.deleted_at.isnot(None), Quest.deleted_at <= cutoff)
+                        .limit(chunk_size)
+                    ]
+                    if not quest_ids:
+                        break
+                    self._keep_purged_exp(session, quest_ids)
+                    # A recurring quest loses its rule, its completed occurrences stay (and keep their exp)
+                    session.query(QuestRecurrence).filter(QuestRecurrence.quest_id.in_(quest_ids)).delete(
+                        synchronize_session=False
+                    )
+                    session.query(Quest).filter(Quest.id.in_(quest_ids)).delete(synchronize_session=False)
+                    # After the quests, their journal entry is already the tombstone
+                    session.query(QuestTag).filter(QuestTag.quest_id.in_(quest_ids)).delete(synchronize_session=False)
+                    drop_unused_tags(session)
+                    session.commit()
+                    self.quests.changed(quest_ids)
+                    purged += len(quest_ids)
+
+                except Exception as e:
+                    session.rollback()
+                    logger.error(f"⚠ Error purging deleted quests: {e}")
+                    return None
+            if len(quest_ids) < chunk_size:
+                break
+
+        if purged and vacuum:
+            self.backend.compact()
+        logger.info(f"✅ Purged {purged} deleted quests")
+        return purged
+
+    # The purged quests keep their exp, it is counted apart so check_experience still finds it
+    @staticmethod
+    def _keep_purged_exp(session, quest_ids):
+        purged = (
+            session.query(Quest.avatar_id, Quest.category_id, func.sum(Quest.exp_amount))
+            .filter(Quest.id.in_(quest_ids), Quest.completed.is_(True))
+            .group_by(Quest.avatar_id, Quest.category_id)
+        )
+        for avatar_id, category_id, exp in purged.all():
+            DataManager._add_purged_exp(session, avatar_id, category_id, exp)
+
+    @staticmethod
+    def _add_purged_exp(session, avatar_id, category_id, exp):
+        if exp:
+            session.query(AvatarCategory).filter_by(avatar_id=avatar_id, category_id=category_id).update(
+                {AvatarCategory.purged_exp: AvatarCategory.purged_exp + exp}, synchronize_session=False
+            )
+
+    #id of this device, its change counter and the versions imported from the other devices
+    def get_sync_state(self):
+        """Returns a dict with `device_id`, `version` (of the last change of this database), `clock`
+        and `peers`: device id -> version of the last delta imported from that device. None on error.
+        """
+        with self.backend.session() as session:
+            try:
+                device_id, version, clock = session.query(
+                    SyncState.device_id, SyncState.version, SyncState.clock
+                ).one()
+                peers = {
+                    key[len(SYNC_PEER_SETTING):]: int(value)
+                    for key, value in session.query(AppSetting.key, AppSetting.value)
+                    .filter(AppSetting.key.startswith(SYNC_PEER_SETTING, autoescape=True))
+                }
+            except Exception as e:
+                logger.error(f"⚠ Error reading the sync state: {e}")
+                return None
+        return {"device_id": device_id, "version": version, "clock": clock, "peers": peers}
+
+    #give this database a new device id, after copying the database file to another device
+    def reset_sync_device(self):
+        try:
+            with self.backend.begin() as connection:
+                connection.execute(text(f"UPDATE sync_state SET device_id = {SQL_NEW_UID}"))
+                return connection.execute(text("SELECT device_id FROM sync_state")).scalar()
+        except Exception as e:
+            logger.error(f"⚠ Error resetting the sync device: {e}")
+            return None
+
+    #changes of the synced rows since a version of this device, the delta to import on another device
+    def export_changes(self, since=0, batch_size=BULK_BATCH_SIZE):
+        """Returns (header, changes), None on error. The header names this device and the versions
+        covered (`since`, `until`]; the other device merges the delta with `import_changes`.
+
+        Each changed quest, avatar and avatar category row is sent once, in its current state (or
+        as a tombstone when it was deleted) with the clock of its last change. The changes are a
+        generator reading the journal in batches, table by table in the SYNC_COLUMNS order.
+        """
+        state = self.get_sync_state()
+        if state is None:
+            return None
+        header = {
+            "format": SYNC_FORMAT,
+            "device_id": state["device_id"],
+            "since": since,
+            "until": state["version"],
+            "clock": state["clock"],
+        }
+        return header, self._iter_changes(since, state["version"], batch_size)
+
+    def _iter_changes(self, since, until, batch_size):
+        for table in SYNC_COLUMNS:
+            last_version = since
+            while True:
+                with self.backend.session() as session:
+                    entries = (
+                        session.query(SyncChange.row_id, SyncChange.category_id, SyncChange.uid, SyncChange.deleted,
+                                      SyncChange.version, SyncChange.clock, SyncChange.device_id)
+                        .filter(SyncChange.table_name == table, SyncChange.version > last_version,
+                                SyncChange.version <= until)
+                        .order_by(SyncChange.version)
+                        .limit(batch_size)
+                        .all()
+                    )
+                    rows = self._sync_rows(session, table, {entry.row_id for entry in entries if not entry.deleted})
+
+                for entry in entries:
+                    change = {"table": table, "clock": entry.clock, "device_id": entry.device_id,
+                              "deleted": bool(entry.deleted)}
+                    if table == "avatar_category":
+                        change["avatar_uid"] = entry.uid
+                        change["category_name"] = self.cache.category_name(entry.category_id, self._load_categories)
+                    else:
+                        change["uid"] = entry.uid
+                    if not entry.deleted:
+                        row = rows.get((entry.row_id, entry.category_id))
+                        if row is None:
+                            continue  # Deleted since `until`, its tombstone goes in the next delta
+                        change.update(row)
+                    yield change
+                if len(entries) < batch_size:
+                    break
+                last_version = entries[-1].version
+
+    # Current values of journaled rows, by (row id, category id) like the journal
+    @staticmethod
+    def _sync_rows(session, table, row_ids):
+        rows = {}
+        for chunk in chunks(row_ids):
+            if table == "avatar":
+                for avatar_id, name in session.query(Avatar.id, Avatar.name).filter(Avatar.id.in_(chunk)):
+                    rows[(avatar_id, 0)] = {"name": name}
+            elif table == "avatar_category":
+                avatar_categories = session.query(
+                    AvatarCategory.avatar_id, AvatarCategory.category_id, AvatarCategory.exp_points
+                ).filter(AvatarCategory.avatar_id.in_(chunk))
+                for avatar_id, category_id, exp_points in avatar_categories:
+                    rows[(avatar_id, category_id)] = {"exp_points": exp_points}
+            else:
+                # An occurrence refers to its recurring quest by uid
+                rule = aliased(QuestRecurrence)
+                template = aliased(Quest)
+                quests = (
+                    session.query(Quest.id, Avatar.uid, Quest.quest_name, Category.category_name, Quest.completed,
+                                  Quest.exp_amount, Quest.due_date, Quest.deleted_at, QuestRecurrence.frequency,
+                                  QuestRecurrence.interval, QuestRecurrence.start_date, QuestRecurrence.end_date,
+                                  template.uid)
+                    .join(Avatar, Quest.avatar_id == Avatar.id)
+                    .join(Category, Quest.category_id == Category.id)
+                    .outerjoin(QuestRecurrence, QuestRecurrence.quest_id == Quest.id)
+                    .outerjoin(rule, rule.id == Quest.recurrence_id)
+                    .outerjoin(template, template.id == rule.quest_id)
+                    .filter(Quest.id.in_(chunk))
+                )
+                for quest_id, avatar_uid, quest_name, category_name, completed, exp_amount, due_date, deleted_at, \
+                        frequency, interval, start_date, end_date, template_uid in quests:
+                    rows[(quest_id, 0)] = {
+                        "avatar_uid": avatar_uid,
+                        "quest_name": quest_name,
+                        "category_name": category_name,
+                        "completed": bool(completed),
+                        "exp_amount": exp_amount,
+                        "due_date": due_date.isoformat() if due_date else None,
+                        "deleted_at": deleted_at.isoformat() if deleted_at else None,
+                        "recurrence": frequency and {
+                            "frequency": frequency,
+                            "interval": interval,
+                            "start_date": start_date.isoformat(),
+                            "end_date": end_date.isoformat() if end_date else None
+                        },
+                        "template_uid": template_uid,
+                        "tags": []
+                    }
+                # Tags are synced with their quest, by name
+                tags = (
+                    session.query(QuestTag.quest_id, Tag.name)
+                    .join(Tag, Tag.id == QuestTag.tag_id)
+                    .filter(QuestTag.quest_id.in_(chunk))
+                    .order_by(Tag.name)
+                )
+                for quest_id, name in tags:
+                    if (quest_id, 0) in rows:
+                        rows[(quest_id, 0)]["tags"].append(name)
+        return rows
+
+    #merge a delta exported by another device with export_changes
+    def import_changes(self, header, changes, batch_size=BULK_BATCH_SIZE):
+        """Merged in a single transaction. Conflicts are resolved per row, the last writer wins: a
+        change replaces the local row when its (clock, device id) is greater than the one of the last
+        change of the row on this device. Concurrent toggles of a quest therefore end in the state of
+        the latest one on both devices, whatever the order of the imports.
+
+        The exp columns are not copied: the exp the merged quests add or take away (completion or
+        exp changed, occurrence un-completed) is applied to their avatar categories in the same
+        transaction, the exp of the quests purged on the other device is kept like after a local
+        purge. The exp history stays per device. Returns counters: `applied`, `kept` (the local row
+        is newer), `skipped` (unknown avatar or recurring quest) and `exp_updated` (avatar categories
+        whose exp changed); None on error.
+        """
+        from models.sync import ChangeMerge  # The merge uses the helpers of this module
+
+        if header.get("format") != SYNC_FORMAT:
+            logger.error(f"❌ Unknown sync format '{header.get('format')}'.")
+            return None
+        state = self.get_sync_state()
+        if state is None:
+            return None
+        if header["device_id"] == state["device_id"]:
+            logger.error("❌ The changes come from this device, reset the device id of a copied database.")
+            return None
+
+        changes = iter(changes)
+        with self.backend.session() as session:
+            try:
+                merge = ChangeMerge(session)
+                while True:
+                    batch = list(islice(changes, batch_size))
+                    if not batch:
+                        break
+                    merge.merge(batch)
+                merge.finish()
+
+                exp_updated = 0
+                for (avatar_id, category_id), exp_delta in merge.exp_deltas.items():
+                    if not exp_delta:
+                        continue
+                    if self._apply_exp(session, avatar_id, category_id, exp_delta) is None:
+                        raise ValueError(f"No exp row for avatar {avatar_id} and category {category_id}")
+                    exp_updated += 1
+                for (avatar_id, category_id), exp in merge.purged_exp.items():
+                    self._add_purged_exp(session, avatar_id, category_id, exp)
+
+                # Export since this version to send the next changes of that device
+                if header["until"] > state["peers"].get(header["device_id"], 0):
+                    session.merge(AppSetting(key=SYNC_PEER_SETTING + header["device_id"], value=str(header["until"])))
+                session.commit()
 
             except Exception as e:
                 session.rollback()
-                logger.error(f"⚠ Error adding quest : {e}")
\ No newline at end of file
+                logger.exception(f"⚠ Error importing the changes of device {header['device_id']}: {e}")
+                return None
+
+        if merge.categories_created:
+            self.cache.invalidate_categories()
+        self.cache.invalidate_avatars()
+        self.quests.changed()
+        counts = {**merge.counts, "exp_updated": exp_updated}
+        logger.info(f"✅ Imported the changes of device {header['device_id']}: {counts}")
+        return counts
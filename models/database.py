@@ -1,13 +1,102 @@
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Boolean, Date
+import os
+import json
+import logging
+from sqlalchemy import create_engine, event, Column, Integer, String, ForeignKey, Boolean, Date, DateTime, Index, \
+    PrimaryKeyConstraint, text
+from sqlalchemy import select, insert, exists, literal, true
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.pool import QueuePool, StaticPool
 
-DATABASE_URL = "sqlite:///app-db.db"
-engine = create_engine(DATABASE_URL, echo=True)
+logger = logging.getLogger(__name__)
 
-# Create table if not existing
+# The location can be overridden (benchmarks, scripts) before the models are imported
+DATABASE_URL = os.environ.get("TODO_APP_DATABASE_URL", "sqlite:///app-db.db")
+
+# Engine configuration file, its values are overridden by the environment variables
+ENGINE_CONFIG_PATH = os.environ.get("TODO_APP_DB_CONFIG", "db-config.json")
+
+# SQLite PRAGMAs applied to every new connection, by profile
+ENGINE_PROFILES = {
+    # SQLite defaults: rollback journal, fsync on every commit
+    "legacy": {
+        "journal_mode": "DELETE",  # The journal mode is persistent, switch back from WAL explicitly
+        "synchronous": "FULL",
+    },
+    # Write-ahead log, fsync only at checkpoints, bigger page cache and memory-mapped reads
+    "wal": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024,  # Negative: size in KiB
+        "temp_store": "MEMORY",
+    },
+    # Write-ahead log but still fsync on every commit
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -16 * 1024,
+        "temp_store": "MEMORY",
+    },
+}
+DEFAULT_ENGINE_PROFILE = "wal"
+
+
+# Read the engine settings from the config file and the environment
+def load_engine_config(config_path=ENGINE_CONFIG_PATH):
+    """Returns a dict with `profile`, `echo`, `pool_size` and extra `pragmas`.
+
+    The JSON config file may define any of these keys; TODO_APP_DB_PROFILE and
+    TODO_APP_SQL_ECHO take precedence over it.
+    """
+    config = {"profile": DEFAULT_ENGINE_PROFILE, "echo": False, "pool_size": 5, "pragmas": {}}
+    if config_path and os.path.exists(config_path):
+        with open(config_path, encoding="utf-8") as file:
+            config.update(json.load(file))
+
+    if "TODO_APP_DB_PROFILE" in os.environ:
+        config["profile"] = os.environ["TODO_APP_DB_PROFILE"]
+    if "TODO_APP_SQL_ECHO" in os.environ:
+        config["echo"] = os.environ["TODO_APP_SQL_ECHO"].lower() in ("1", "true", "yes")
+
+    if config["profile"] not in ENGINE_PROFILES:
+        logger.error(f"Unknown database profile '{config['profile']}', using '{DEFAULT_ENGINE_PROFILE}'.")
+        config["profile"] = DEFAULT_ENGINE_PROFILE
+    return config
+
+
+# Create an engine applying the PRAGMAs of a profile on every new connection
+def create_app_engine(database_url=DATABASE_URL, config=None):
+    config = config or load_engine_config()
+    pragmas = {**ENGINE_PROFILES[config["profile"]], **config.get("pragmas", {})}
+
+    options = {"echo": config.get("echo", False)}
+    if database_url.startswith("sqlite") and ":memory:" not in database_url:
+        # Keep connections (and their page cache) open instead of reconnecting for every session
+        options.update(
+            poolclass=QueuePool,
+            pool_size=config.get("pool_size", 5),
+            connect_args={"check_same_thread": False}
+        )
+    elif ":memory:" in database_url:
+        # A memory database lives in its connection, every session shares the same one
+        options.update(poolclass=StaticPool, connect_args={"check_same_thread": False})
+    new_engine = create_engine(database_url, **options)
+
+    @event.listens_for(new_engine, "connect")
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    return new_engine
+
+
+engine = create_app_engine()
+
+# The tables are created by the migrations (models/migrations.py)
 Base = declarative_base()
-Base.metadata.create_all(engine)
 
 # Create session
 Session = sessionmaker(bind=engine)
@@ -19,10 +108,16 @@ class Avatar(Base):
     name = Column(String, nullable=False)
     level = Column(Integer, default=1)
     experience = Column(Integer, default=0)
+    # Identifies the avatar across devices (sync journal), set by a trigger on insert
+    uid = Column(String, nullable=True)
 
     quests = relationship("Quest", back_populates="avatar", cascade="all, delete")
     categories = relationship("AvatarCategory", back_populates="avatar", cascade="all, delete")
 
+    __table_args__ = (
+        Index("ix_avatar_uid", "uid", unique=True),
+    )
+
 
 class Category(Base):
     __tablename__ = "categories"
@@ -39,32 +134,304 @@ class Quest(Base):
     completed = Column(Boolean, default=False)
     exp_amount = Column(Integer, default=0)
     due_date = Column(Date, nullable=True)  # New column for the due date
+    # Set on the completed occurrences of a recurring quest, they are hidden from the quest lists
+    recurrence_id = Column(Integer, ForeignKey("quest_recurrences.id"), nullable=True)
+    # Set by a soft delete, the row is hard-deleted later by DataManager.purge_deleted
+    deleted_at = Column(DateTime, nullable=True)
+    # Identifies the quest across devices (sync journal), set by a trigger on insert
+    uid = Column(String, nullable=True)
 
     avatar = relationship("Avatar", back_populates="quests")
     category = relationship("Category")
 
+    __table_args__ = (
+        Index("ix_quests_avatar_category", "avatar_id", "category_id"),
+        # Serve the sorted quest list, the id tiebreak comes from the implicit rowid
+        Index("ix_quests_avatar_due_date", "avatar_id", "due_date"),
+        Index("ix_quests_avatar_exp_amount", "avatar_id", "exp_amount"),
+        Index("ix_quests_avatar_quest_name", "avatar_id", "quest_name"),
+        # Date range queries of the agenda on the open quests
+        Index("ix_quests_avatar_completed_due_date", "avatar_id", "completed", "due_date"),
+        # An occurrence is completed at most once
+        Index("ix_quests_recurrence_due_date", "recurrence_id", "due_date", unique=True),
+        # Only the deleted quests, for the purge and the undo
+        Index("ix_quests_deleted_at", "deleted_at", sqlite_where=text("deleted_at IS NOT NULL")),
+        Index("ix_quests_uid", "uid", unique=True),
+    )
+
+
+# Repeat rule of a recurring quest. The quest is the template of the series, its due date is the
+# next occurrence left to do; the occurrences are generated from the rule (models/recurrence.py).
+class QuestRecurrence(Base):
+    __tablename__ = "quest_recurrences"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    quest_id = Column(Integer, ForeignKey("quests.id"), nullable=False, unique=True)
+    frequency = Column(String, nullable=False)  # daily, weekly or monthly
+    interval = Column(Integer, nullable=False, default=1)
+    start_date = Column(Date, nullable=False)
+    end_date = Column(Date, nullable=True)
+
+
+# Free-form labels of the quests, linked through quest_tags
+class Tag(Base):
+    __tablename__ = "tags"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String, nullable=False, unique=True)  # Trimmed and lowercase, see quest_helpers.normalize_tag
+    # Rows of the tag in quest_tags, kept by triggers; plans the tag filters (deleted quests included)
+    quest_count = Column(Integer, nullable=False, default=0, server_default=text("0"))
+
+
+# Quest <-> tag junction, indexed both ways: the primary key lists the tags of a quest, the
+# tag index the quests of a tag (covering, the tag filters never read the junction rows)
+class QuestTag(Base):
+    __tablename__ = "quest_tags"
+    quest_id = Column(Integer, ForeignKey("quests.id"), nullable=False)
+    tag_id = Column(Integer, ForeignKey("tags.id"), nullable=False)
+
+    __table_args__ = (
+        PrimaryKeyConstraint("quest_id", "tag_id"),
+        Index("ix_quest_tags_tag_quest", "tag_id", "quest_id"),
+    )
+
 
 class AvatarCategory(Base):
     __tablename__ = "avatar_category"
     avatar_id = Column(Integer, ForeignKey("avatar.id"), primary_key=True)
     category_id = Column(Integer, ForeignKey("categories.id"), primary_key=True)
     exp_points = Column(Integer, default=0)
+    # Exp of the completed quests hard-deleted by a purge, still part of exp_points (see check_experience)
+    purged_exp = Column(Integer, nullable=False, default=0, server_default=text("0"))
 
     avatar = relationship("Avatar", back_populates="categories")
     category = relationship("Category")
 
+# Key / value store for user preferences (selected sort, ...)
+class AppSetting(Base):
+    __tablename__ = "app_settings"
+    key = Column(String, primary_key=True)
+    value = Column(String, nullable=True)
+
+
+# Append-only log of the exp changes: one row per quest completed (positive exp) or un-completed (negative)
+class QuestEvent(Base):
+    __tablename__ = "quest_events"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    avatar_id = Column(Integer, nullable=False)
+    category_id = Column(Integer, nullable=False)
+    quest_id = Column(Integer, nullable=True)  # No foreign key, the log outlives the purged quests
+    exp_delta = Column(Integer, nullable=False)
+    occurred_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_quest_events_avatar_occurred_at", "avatar_id", "occurred_at"),
+    )
+
+
+# Exp and completions per avatar, category and day / week / month, updated with every event
+class XpRollup(Base):
+    __tablename__ = "xp_rollups"
+    avatar_id = Column(Integer, nullable=False)
+    period = Column(String, nullable=False)  # day, week or month
+    period_start = Column(Date, nullable=False)
+    category_id = Column(Integer, nullable=False)
+    exp = Column(Integer, nullable=False, default=0)
+    completions = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        PrimaryKeyConstraint("avatar_id", "period", "period_start", "category_id"),
+    )
+
+
+# Change journal of the synced tables (quests, avatar, avatar_category) for the sync between devices.
+# One row per changed row with its last change, written by the triggers of create_sync_journal.
+class SyncChange(Base):
+    __tablename__ = "sync_journal"
+    table_name = Column(String, nullable=False)
+    row_id = Column(Integer, nullable=False)  # quests.id, avatar.id or avatar_category.avatar_id
+    category_id = Column(Integer, nullable=False, default=0)  # avatar_category.category_id, 0 for the other tables
+    uid = Column(String, nullable=True)  # uid of the quest or avatar (of the avatar for avatar_category)
+    deleted = Column(Boolean, nullable=False, default=False)  # The row was hard-deleted, uid is its tombstone
+    version = Column(Integer, nullable=False)  # Local change counter, the deltas are exported since a version
+    clock = Column(Integer, nullable=False)  # Lamport clock of the change, orders the changes of all devices
+    device_id = Column(String, nullable=False)  # Device that made the change, breaks the ties of the clock
+
+    __table_args__ = (
+        PrimaryKeyConstraint("table_name", "row_id", "category_id"),
+        Index("ix_sync_journal_table_version", "table_name", "version"),
+        # Rows of the imported changes are looked up by uid
+        Index("ix_sync_journal_table_uid", "table_name", "uid"),
+    )
+
+
+# Single row (id 1): the id of this device and its change counter and clock
+class SyncState(Base):
+    __tablename__ = "sync_state"
+    id = Column(Integer, primary_key=True)
+    device_id = Column(String, nullable=False)
+    version = Column(Integer, nullable=False, default=0)
+    clock = Column(Integer, nullable=False, default=0)
+
 # Return a function for data manager
 def get_session():
     session = Session()
     return session
 
+# Create the full-text index on quest names, kept in sync with the quests table by triggers
+def create_search_index(connection):
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'quests_fts'")
+    ).first()
+    if exists:
+        return
+
+    connection.execute(text(
+        "CREATE VIRTUAL TABLE quests_fts USING fts5("
+        "quest_name, content='quests', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    ))
+    connection.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS quests_fts_insert AFTER INSERT ON quests BEGIN "
+        "INSERT INTO quests_fts(rowid, quest_name) VALUES (new.id, new.quest_name); "
+        "END"
+    ))
+    connection.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS quests_fts_delete AFTER DELETE ON quests BEGIN "
+        "INSERT INTO quests_fts(quests_fts, rowid, quest_name) VALUES ('delete', old.id, old.quest_name); "
+        "END"
+    ))
+    connection.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS quests_fts_update AFTER UPDATE OF quest_name ON quests BEGIN "
+        "INSERT INTO quests_fts(quests_fts, rowid, quest_name) VALUES ('delete', old.id, old.quest_name); "
+        "INSERT INTO quests_fts(rowid, quest_name) VALUES (new.id, new.quest_name); "
+        "END"
+    ))
+    # Index the quests that existed before the search table
+    connection.execute(text("INSERT INTO quests_fts(quests_fts) VALUES ('rebuild')"))
+
+
+# Random 128 bits in hex, the uids of the synced rows and the device ids
+SQL_NEW_UID = "lower(hex(randomblob(16)))"
+
+# Columns whose change is recorded in the sync journal, the others are derived (level, experience).
+# In the order of the tables in a delta, the quests refer to the avatars.
+SYNC_COLUMNS = {
+    "avatar": ("name",),
+    "quests": ("avatar_id", "quest_name", "category_id", "completed", "exp_amount", "due_date", "recurrence_id",
+               "deleted_at"),
+    "avatar_category": ("exp_points",),
+}
+
+
+# Statements of a trigger body recording a change of a row in the sync journal
+def _journal_change(table, row_id, category_id, uid, deleted):
+    return (
+        "UPDATE sync_state SET version = version + 1, clock = clock + 1; "
+        "INSERT OR REPLACE INTO sync_journal "
+        "(table_name, row_id, category_id, uid, deleted, version, clock, device_id) "
+        f"SELECT '{table}', {row_id}, {category_id}, {uid}, {deleted}, version, clock, device_id FROM sync_state; "
+    )
+
+
+# Create the sync journal tables and the triggers filling them on every write of the synced tables
+def create_sync_journal(connection):
+    Base.metadata.create_all(connection, tables=[SyncChange.__table__, SyncState.__table__])
+    if connection.execute(text("SELECT 1 FROM sync_state")).first() is None:
+        connection.execute(text(
+            f"INSERT INTO sync_state (id, device_id, version, clock) VALUES (1, {SQL_NEW_UID}, 0, 0)"
+        ))
+
+    def changed(table):
+        return " OR ".join(f"old.{column} IS NOT new.{column}" for column in SYNC_COLUMNS[table])
+
+    avatar_uid = "(SELECT uid FROM avatar WHERE id = {0}.avatar_id)"
+    # The uid of a deleted avatar is only left in its tombstone
+    deleted_avatar_uid = (
+        "coalesce((SELECT uid FROM avatar WHERE id = old.avatar_id), "
+        "(SELECT uid FROM sync_journal WHERE table_name = 'avatar' AND row_id = old.avatar_id AND category_id = 0))"
+    )
+    triggers = {
+        # Rows inserted without uid get a random one, the synced rows keep theirs
+        "sync_quests_insert": "AFTER INSERT ON quests BEGIN "
+                              f"UPDATE quests SET uid = {SQL_NEW_UID} WHERE id = new.id AND new.uid IS NULL; "
+                              + _journal_change("quests", "new.id", 0, "(SELECT uid FROM quests WHERE id = new.id)", 0),
+        "sync_quests_update": f"AFTER UPDATE ON quests WHEN {changed('quests')} BEGIN "
+                              + _journal_change("quests", "new.id", 0, "new.uid", 0),
+        "sync_quests_delete": "AFTER DELETE ON quests BEGIN " + _journal_change("quests", "old.id", 0, "old.uid", 1),
+        "sync_avatar_insert": "AFTER INSERT ON avatar BEGIN "
+                              f"UPDATE avatar SET uid = {SQL_NEW_UID} WHERE id = new.id AND new.uid IS NULL; "
+                              + _journal_change("avatar", "new.id", 0, "(SELECT uid FROM avatar WHERE id = new.id)", 0),
+        "sync_avatar_update": f"AFTER UPDATE ON avatar WHEN {changed('avatar')} BEGIN "
+                              + _journal_change("avatar", "new.id", 0, "new.uid", 0),
+        "sync_avatar_delete": "AFTER DELETE ON avatar BEGIN " + _journal_change("avatar", "old.id", 0, "old.uid", 1),
+        "sync_avatar_category_insert": "AFTER INSERT ON avatar_category BEGIN "
+                                       + _journal_change("avatar_category", "new.avatar_id", "new.category_id",
+                                                         avatar_uid.format("new"), 0),
+        "sync_avatar_category_update": f"AFTER UPDATE ON avatar_category WHEN {changed('avatar_category')} BEGIN "
+                                       + _journal_change("avatar_category", "new.avatar_id", "new.category_id",
+                                                         avatar_uid.format("new"), 0),
+        "sync_avatar_category_delete": "AFTER DELETE ON avatar_category BEGIN "
+                                       + _journal_change("avatar_category", "old.avatar_id", "old.category_id",
+                                                         deleted_avatar_uid, 1),
+    }
+    for name, body in triggers.items():
+        connection.execute(text(f"CREATE TRIGGER IF NOT EXISTS {name} {body}END"))
+
+
+# Adding or removing a tag is a change of the quest for the sync journal, its tags are synced with it
+def create_quest_tag_triggers(connection):
+    for name, event_name, row in (("sync_quest_tags_insert", "INSERT", "new"),
+                                  ("sync_quest_tags_delete", "DELETE", "old")):
+        # Not when the quest itself is deleted, its tombstone is already journaled
+        connection.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event_name} ON quest_tags "
+            f"WHEN EXISTS (SELECT 1 FROM quests WHERE id = {row}.quest_id) BEGIN "
+            + _journal_change("quests", f"{row}.quest_id", 0, f"(SELECT uid FROM quests WHERE id = {row}.quest_id)", 0)
+            + "END"
+        ))
+
+
+# Keep tags.quest_count in step with the junction rows
+def create_tag_count_triggers(connection):
+    for name, event_name, row, delta in (("tags_count_insert", "INSERT", "new", "+ 1"),
+                                         ("tags_count_delete", "DELETE", "old", "- 1")):
+        connection.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event_name} ON quest_tags BEGIN "
+            f"UPDATE tags SET quest_count = quest_count {delta} WHERE id = {row}.tag_id; END"
+        ))
+
+
+# Create the indexes declared on the models that are missing from an existing database, or only the named ones
+def create_indexes(connection, names=None):
+    for table in Base.metadata.tables.values():
+        for index in table.indexes:
+            if names is None or index.name in names:
+                index.create(connection, checkfirst=True)
+
+
+# Give the free pages back to the file system after a purge
+def compact_database(bind=None):
+    """Incremental vacuum when the database is in auto_vacuum=INCREMENTAL mode, full VACUUM otherwise
+    (which also switches it to incremental mode when a migration asked for it)."""
+    with (bind or engine).connect() as connection:
+        auto_vacuum = connection.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+        # executescript runs the statement to completion, a single step only frees one page
+        connection.connection.executescript("PRAGMA incremental_vacuum;" if auto_vacuum == 2 else "VACUUM;")
+
+
+# Data created by setup_database in an empty database
+DEFAULT_AVATAR_NAME = "Unknow"
+# The same on every device, so the default avatars of two databases are one avatar for the sync
+DEFAULT_AVATAR_UID = "default-avatar"
+DEFAULT_CATEGORIES = ("wisdom", "constitution", "reflexion", "family")
+
+
 # Create a default avatar to initate the app
-def add_default_avatar():
-    session = get_session()
+def add_default_avatar(bind=None):
+    session = Session(bind=bind) if bind is not None else get_session()
 
     existing_avatar = session.query(Avatar).all()
     if not existing_avatar:
-        new_avatar = Avatar(name="Unknow", level=0, experience=0)
+        new_avatar = Avatar(name=DEFAULT_AVATAR_NAME, level=1, experience=0, uid=DEFAULT_AVATAR_UID)
 
         session.add(new_avatar)
         session.commit()
@@ -72,43 +439,45 @@ def add_default_avatar():
 
 
 # Create basic categories when first intialisation
-def add_default_categories():
-    session = get_session()
+def add_default_categories(bind=None):
+    session = Session(bind=bind) if bind is not None else get_session()
 
     existing_categories = session.query(Category).all()
     if not existing_categories:
-        default_categories = ["wisdom", "constitution", "reflexion", "family"]
-        categories_to_add = [Category(category_name=category) for category in default_categories]
+        categories_to_add = [Category(category_name=category) for category in DEFAULT_CATEGORIES]
 
         session.add_all(categories_to_add)
         session.commit()
     session.close()
 
 
+# Insert the missing avatar - category rows with one INSERT ... SELECT, for one avatar or all of them
+def init_avatar_categories(connection, avatar_id=None):
+    missing = ~exists().where(
+        (AvatarCategory.avatar_id == Avatar.id) & (AvatarCategory.category_id == Category.id)
+    )
+    rows = select(Avatar.id, Category.id, literal(0)).select_from(Avatar).join(Category, true()).where(missing)
+    if avatar_id is not None:
+        rows = rows.where(Avatar.id == avatar_id)
+    connection.execute(
+        insert(AvatarCategory).from_select(["avatar_id", "category_id", "exp_points"], rows)
+    )
+
+
 # Create avatar - categories relationnal table to manage exp by categories by avatar
-def add_avatar_categories():
-    session = get_session()
-    avatar = session.query(Avatar).first()
-
-    if avatar:
-        categories = session.query(Category).all()
-        for category in categories:
-            existing_relation = session.query(AvatarCategory).filter(AvatarCategory.avatar_id == avatar.id,
-                                                                     AvatarCategory.category_id == category.id).first()
-            if not existing_relation:
-                avatar_category = AvatarCategory(avatar_id=avatar.id, category_id=category.id, exp_points=0)
-                session.add(avatar_category)
+def add_avatar_categories(bind=None):
+    with (bind or engine).begin() as connection:
+        init_avatar_categories(connection)
 
-        session.commit()
-    session.close()
 
+# Setup the database when first initialization, on the app engine or on `bind`
+def setup_database(bind=None):
+    from models.migrations import migrate  # The migrations use the models of this module
 
-# Setup the database when first initialization
-def setup_database():
-    # Création des tables
-    Base.metadata.create_all(engine)
+    # Création des tables, nothing to do when the schema is current
+    migrate(bind=bind)
     # Ajout des données par défaut
-    add_default_avatar()
-    add_default_categories()
-    add_avatar_categories()
+    add_default_avatar(bind)
+    add_default_categories(bind)
+    add_avatar_categories(bind)
 
@@ -0,0 +1,30 @@
+from collections import defaultdict
+import logging
+
+# Minimal publish / subscribe so the screens can react to data changes without querying again
+logger = logging.getLogger(__name__)
+
+# Published after a quest completion is committed:
+# avatar_id, category_id, category_name, exp_delta, exp_points (new total of the category)
+XP_CHANGED = "xp_changed"
+
+_subscribers = defaultdict(list)
+
+
+def subscribe(event_name, callback):
+    if callback not in _subscribers[event_name]:
+        _subscribers[event_name].append(callback)
+
+
+def unsubscribe(event_name, callback):
+    if callback in _subscribers[event_name]:
+        _subscribers[event_name].remove(callback)
+
+
+#call the subscribers of an event, a failing subscriber doesn't stop the others
+def publish(event_name, **payload):
+    for callback in list(_subscribers[event_name]):
+        try:
+            callback(**payload)
+        except Exception as e:
+            logger.exception(f"Error in '{event_name}' subscriber {callback}: {e}")
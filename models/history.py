@@ -0,0 +1,16 @@
+import datetime
+
+# Time buckets of the exp rollups (xp_rollups table)
+
+PERIODS = ("day", "week", "month")
+
+
+#first day of the bucket holding `day`: the day itself, the Monday of its week or the 1st of its month
+def period_start(day, period):
+    if period == "day":
+        return day
+    if period == "week":
+        return day - datetime.timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    raise ValueError(f"Unknown period '{period}', expected one of {PERIODS}")
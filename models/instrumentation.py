@@ -0,0 +1,229 @@
+import atexit
+import bisect
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from sqlalchemy import event
+
+# Opt-in timing of the hot paths: wall time, SQL statements and rows of each instrumented call,
+# aggregated into histograms. Off unless TODO_APP_PROFILE is set (or enable() is called);
+# when off an instrumented call only pays for one flag check.
+#   TODO_APP_PROFILE=1                 enable
+#   TODO_APP_PROFILE_FILE=stats.json   dump the histograms there when the process exits
+#   TODO_APP_PROFILE_INTERVAL=30       log a summary every 30 seconds
+logger = logging.getLogger(__name__)
+
+# Upper bounds (ms) of the histogram buckets, the last bucket counts everything slower
+BUCKET_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+class Histogram:
+    """Latency distribution of one instrumented call, with its statement and row totals."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.statements = 0
+        self.rows = 0
+
+    def add(self, elapsed_ms, statements, rows):
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS_MS, elapsed_ms)] += 1
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.statements += statements
+        self.rows += rows
+
+    #upper bound of the bucket holding the given fraction of the calls
+    def percentile(self, fraction):
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return BUCKET_BOUNDS_MS[index] if index < len(BUCKET_BOUNDS_MS) else self.max_ms
+        return 0.0
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": round(self.max_ms, 3),
+            "statements_per_call": round(self.statements / self.count, 2) if self.count else 0.0,
+            "rows_per_call": round(self.rows / self.count, 2) if self.count else 0.0,
+            "buckets": dict(zip([f"<={bound}" for bound in BUCKET_BOUNDS_MS] + ["slower"], self.buckets)),
+        }
+
+
+_enabled = False
+_lock = threading.Lock()
+_histograms = {}
+_local = threading.local()  # `calls`: stack of [statements, rows] of the calls running on this thread
+_engines = []
+_reporter = None
+
+
+def is_enabled():
+    return _enabled
+
+
+# Start recording, SQL statements are counted on `bind` (the app engine by default)
+def enable(bind=None, dump_path=None, log_interval=None):
+    global _enabled, _reporter
+    if bind is None:
+        from models.database import engine as bind
+    if bind not in _engines:
+        event.listen(bind, "before_cursor_execute", _before_cursor_execute)
+        event.listen(bind, "after_cursor_execute", _after_cursor_execute)
+        _engines.append(bind)
+    _enabled = True
+
+    if dump_path:
+        atexit.register(dump, dump_path)
+    if log_interval and _reporter is None:
+        _reporter = threading.Thread(target=_log_periodically, args=(log_interval,), daemon=True)
+        _reporter.start()
+
+
+def disable():
+    global _enabled
+    _enabled = False
+    for bind in _engines:
+        event.remove(bind, "before_cursor_execute", _before_cursor_execute)
+        event.remove(bind, "after_cursor_execute", _after_cursor_execute)
+    _engines.clear()
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+# Summary of every histogram, by call name
+def report():
+    with _lock:
+        return {name: histogram.summary() for name, histogram in sorted(_histograms.items())}
+
+
+def dump(path):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(report(), file, indent=2)
+
+
+# One line per call name, slowest total first
+def log_report():
+    with _lock:
+        histograms = sorted(_histograms.items(), key=lambda item: item[1].total_ms, reverse=True)
+        lines = [
+            f"{name}: {histogram.count} calls, p50 {histogram.percentile(0.5)} ms, "
+            f"p99 {histogram.percentile(0.99)} ms, max {histogram.max_ms:.1f} ms, "
+            f"{histogram.statements / histogram.count:.1f} statements, {histogram.rows / histogram.count:.1f} rows"
+            for name, histogram in histograms
+        ]
+    if lines:
+        logger.warning("Hot path timings\n" + "\n".join(lines))
+
+
+def _log_periodically(interval):
+    while True:
+        time.sleep(interval)
+        if _enabled:
+            log_report()
+
+
+# The statements are counted on every call running on the thread, nested calls included
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    for call in getattr(_local, "calls", ()):
+        call[0] += 1
+
+
+#rows changed by a DML statement, SQLite reports -1 for queries (their rows are counted on the result)
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if cursor.rowcount > 0:
+        for call in getattr(_local, "calls", ()):
+            call[1] += cursor.rowcount
+
+
+#rows returned by a call: the length of a list result (dicts are single records, not counted)
+def _result_rows(result):
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        result = result[0]  # (page, cursor) of the paged queries
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    return 0
+
+
+class timer:
+    """Context manager recording the block under `name`: `with timer("QuestScreen.load_quests"): ...`"""
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = 0  # Set by the block to count the rows it returned
+
+    def __enter__(self):
+        if _enabled:
+            self._call = [0, 0]
+            if not hasattr(_local, "calls"):
+                _local.calls = []
+            _local.calls.append(self._call)
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if not hasattr(self, "_start"):
+            return False
+        elapsed_ms = (time.perf_counter() - self._start) * 1000
+        _local.calls.pop()  # Calls nest, this one is on top
+        statements, rows = self._call
+        with _lock:
+            histogram = _histograms.get(self.name)
+            if histogram is None:
+                histogram = _histograms[self.name] = Histogram()
+            histogram.add(elapsed_ms, statements, rows + self.rows)
+        return False
+
+
+# Decorator recording every call of a function, under its qualified name by default
+def timed(name=None):
+    def decorator(func):
+        call_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with timer(call_name) as call:
+                result = func(*args, **kwargs)
+                call.rows = _result_rows(result)
+                return result
+
+        return wrapper
+    return decorator
+
+
+# Class decorator applying `timed` to the public methods (generators excluded, they return before running)
+def instrument(cls):
+    for attribute, value in list(vars(cls).items()):
+        if attribute.startswith("_"):
+            continue
+        if isinstance(value, staticmethod):
+            func = value.__func__
+            if not inspect.isgeneratorfunction(func):
+                setattr(cls, attribute, staticmethod(timed(f"{cls.__name__}.{attribute}")(func)))
+        elif inspect.isfunction(value) and not inspect.isgeneratorfunction(value):
+            setattr(cls, attribute, timed(f"{cls.__name__}.{attribute}")(value))
+    return cls
+
+
+if os.environ.get("TODO_APP_PROFILE", "").lower() in ("1", "true", "yes"):
+    interval = os.environ.get("TODO_APP_PROFILE_INTERVAL")
+    enable(dump_path=os.environ.get("TODO_APP_PROFILE_FILE"), log_interval=float(interval) if interval else None)
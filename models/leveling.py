@@ -0,0 +1,47 @@
+import os
+from collections import namedtuple
+
+# Level of an amount of exp, with the exp earned inside the level and the exp the level needs
+LevelProgress = namedtuple("LevelProgress", "level progress needed")
+
+
+class LevelCurve:
+    """Geometric level curve: going from level n to n + 1 needs `base * growth ** (n - 1)` exp.
+
+    Levels start at 1 with 0 exp. The defaults can be changed with the
+    TODO_APP_LEVEL_BASE and TODO_APP_LEVEL_GROWTH environment variables.
+    """
+
+    def __init__(self, base=100, growth=1.5, max_level=1000):
+        if base <= 0 or growth < 1:
+            raise ValueError("The level curve needs base > 0 and growth >= 1")
+        self.base = base
+        self.growth = growth
+        self.max_level = max_level
+
+    @classmethod
+    def from_environment(cls):
+        return cls(
+            base=float(os.environ.get("TODO_APP_LEVEL_BASE", 100)),
+            growth=float(os.environ.get("TODO_APP_LEVEL_GROWTH", 1.5))
+        )
+
+    #exp needed to go from `level` to the next one
+    def exp_for_level(self, level):
+        return round(self.base * self.growth ** (level - 1))
+
+    def progress(self, exp):
+        exp = max(exp or 0, 0)
+        level = 1
+        needed = self.exp_for_level(level)
+        while exp >= needed and level < self.max_level:
+            exp -= needed
+            level += 1
+            needed = self.exp_for_level(level)
+        return LevelProgress(level, exp, needed)
+
+    def level_for(self, exp):
+        return self.progress(exp).level
+
+
+default_level_curve = LevelCurve.from_environment()
@@ -0,0 +1,427 @@
+import bisect
+import itertools
+import re
+import threading
+import unicodedata
+from models.backends import SqlBackend
+from models.database import Category, Quest, Tag, QuestTag
+from models.data_manager import BULK_BATCH_SIZE
+from models.repositories import QUEST_SORT_COLUMNS, SqlQuestRepository, chunks, drive_from_rarest_tag
+from models.records import TagRecord
+
+# Storage for the DataManager with the quest reads served from memory: the lists, pages, agenda,
+# search and tags come from dicts of __slots__ rows and the indexes of the quest lists, no SQL.
+#
+# It is not a pure in-memory storage: the writes, the exp rules, the tags, the recurring quests,
+# the history and the sync run on a SQL database. Keeping them in the DataManager only, on SQL,
+# leaves one copy of that logic instead of a second Python one that would drift from it.
+# Standalone the database is a private in-memory SQLite one, no disk I/O, a throwaway storage
+# for tests and benchmarks:
+#
+#     backend = MemoryBackend()
+#     backend.setup()
+#     data_manager = DataManager(backend=backend)
+#
+# With a `backing` SqlBackend the memory copy is a write-through cache in front of it. The copy is
+# loaded on first use, then the DataManager reports the quests each write changes and only those
+# are read again; the writes made without a DataManager of this backend need a `reload()`.
+# The name matches of a search are in id order, not in the rank order of the SQL full-text search.
+
+# Database of a standalone MemoryBackend
+MEMORY_DATABASE_URL = "sqlite:///:memory:"
+
+# Columns of a QuestRow, with the name of its category
+QUEST_ROW_COLUMNS = (
+    Quest.id,
+    Quest.avatar_id,
+    Quest.quest_name,
+    Quest.category_id,
+    Category.category_name,
+    Quest.due_date,
+    Quest.exp_amount,
+    Quest.completed,
+    Quest.deleted_at,
+)
+
+_INFINITY = float("inf")
+
+
+class QuestRow:
+    """Stored quest, `words` are the tokens of its name for the search index."""
+    __slots__ = ("id", "avatar_id", "quest_name", "category_id", "due_date", "exp_amount", "completed", "deleted_at",
+                 "words")
+
+    def __init__(self, id, avatar_id, quest_name, category_id, due_date, exp_amount, completed, deleted_at=None):
+        self.id = id
+        self.avatar_id = avatar_id
+        self.quest_name = quest_name
+        self.category_id = category_id
+        self.due_date = due_date
+        self.exp_amount = exp_amount
+        self.completed = completed
+        self.deleted_at = deleted_at
+        self.words = frozenset(_tokens(quest_name))
+
+
+#lowercase words without diacritics, like the unicode61 tokenizer of the SQL full-text index
+def _tokens(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    return re.findall(r"\w+", "".join(char for char in text if not unicodedata.combining(char)))
+
+
+# Sort key of a quest list, NULLs first like SQLite, the id breaks the ties
+def _sort_key(value, quest_id):
+    return (value is not None, value, quest_id)
+
+
+class MemoryBackend:
+    """Same API as SqlBackend (see models/backends.py), the quest reads served from memory."""
+
+    def __init__(self, backing=None):
+        self.backing = backing
+        self.database = backing if backing is not None else SqlBackend(MEMORY_DATABASE_URL)
+        self.engine = self.database.engine
+        self.url = self.database.url
+        self.cache = self.database.cache
+        self.quests = MemoryQuestRepository(self.database)
+
+    def session(self):
+        return self.database.session()
+
+    def begin(self):
+        return self.database.begin()
+
+    #run the migrations and create the default data
+    def setup(self):
+        self.database.setup()
+        self.quests.changed()
+
+    def compact(self):
+        self.database.compact()
+
+    #read the quests again, after writes made without a DataManager of this backend
+    def reload(self):
+        self.quests.changed()
+
+    #replace the standalone database by a copy of the database of a SqlBackend
+    def load(self, source):
+        """A memory snapshot of a database: `MemoryBackend().load(SqlBackend(url))`."""
+        if self.backing is not None:
+            raise ValueError("A MemoryBackend with a backing database can't load another one")
+        with source.engine.connect() as source_connection, self.database.engine.connect() as connection:
+            source_connection.connection.backup(connection.connection.dbapi_connection)
+        self.cache.invalidate_categories()
+        self.cache.invalidate_avatars()
+        self.quests.changed()
+
+    def dispose(self):
+        if self.backing is None:
+            self.database.dispose()
+
+    def __repr__(self):
+        return f"MemoryBackend(backing={self.backing!r})"
+
+
+class MemoryQuestRepository:
+    """The reads of SqlQuestRepository (models/repositories.py) answered from a memory copy of the
+    quests. The completed occurrences of recurring quests are not copied, they are only read by id.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._sql = SqlQuestRepository(backend)
+        self._lock = threading.RLock()
+        self._stale = True  # Loaded from the database on first use
+        self._clear()
+
+    def avatar_quests(self, avatar_id, sort_key="id", descending=False):
+        with self._lock:
+            self._load()
+            _, quests = self._sorted_quests(avatar_id, sort_key)
+            quests = reversed(quests) if descending else quests
+            return [self._row(quest) for quest in quests if quest.deleted_at is None]
+
+    def page(self, avatar_id, after, limit, sort_key="id", descending=False, due_range=None, completed=None, tags=()):
+        attribute = QUEST_SORT_COLUMNS[sort_key].key
+        with self._lock:
+            self._load()
+            tag_sets = self._tag_sets(tags)
+            if tag_sets is None:
+                return [], None
+            if tag_sets and drive_from_rarest_tag([len(quest_ids) for quest_ids in tag_sets], len(self._quests), limit):
+                # Like the SQL query: the quests of a rare tag are sorted instead of scanning the avatar's quests
+                avatar_quests = self._avatar_quests.get(avatar_id, {})
+                quests = sorted((avatar_quests[quest_id] for quest_id in tag_sets.pop(0) if quest_id in avatar_quests),
+                                key=lambda quest: _sort_key(getattr(quest, attribute), quest.id))
+                keys = [_sort_key(getattr(quest, attribute), quest.id) for quest in quests]
+            else:
+                keys, quests = self._sorted_quests(avatar_id, sort_key)
+            # Keyset: bisect to the cursor instead of skipping the previous pages
+            if not descending:
+                start = bisect.bisect_right(keys, _sort_key(*after)) if after is not None else 0
+                candidates = itertools.islice(quests, start, None)
+            else:
+                end = bisect.bisect_left(keys, _sort_key(*after)) if after is not None else len(quests)
+                candidates = (quests[index] for index in range(end - 1, -1, -1))
+
+            page = []
+            for quest in candidates:
+                if quest.deleted_at is not None or not self._matches(quest, due_range, completed) or \
+                        any(quest.id not in quest_ids for quest_ids in tag_sets):
+                    continue
+                page.append(quest)
+                if len(page) > limit:
+                    break
+
+            next_cursor = None
+            if len(page) > limit:
+                page = page[:limit]
+                next_cursor = (getattr(page[-1], attribute), page[-1].id)
+            return [self._row(quest) for quest in page], next_cursor
+
+    def agenda(self, avatar_id, last_day):
+        with self._lock:
+            self._load()
+            keys, quests = self._sorted_quests(avatar_id, "due_date")
+            # The quests with a due date are after the NULLs, up to the last day of the agenda
+            start = bisect.bisect_left(keys, (True,))
+            end = bisect.bisect_right(keys, (True, last_day, _INFINITY))
+            return [self._row(quest) for quest in quests[start:end]
+                    if not quest.completed and quest.deleted_at is None]
+
+    #word prefix search on quest names, then prefix match on category names
+    def search(self, avatar_id, search_text, limit=None, tags=()):
+        """Same matches as the SQL full-text search; the name matches are in id order (no rank)."""
+        terms = _tokens(search_text)
+        if not terms:
+            return []
+        with self._lock:
+            self._load()
+            tag_sets = self._tag_sets(tags)
+            if tag_sets is None:
+                return []
+            words = self._sorted_words()
+            matches = None
+            for term in terms:
+                term_matches = set()
+                for index in range(bisect.bisect_left(words, term), len(words)):
+                    if not words[index].startswith(term):
+                        break
+                    term_matches |= self._word_quests[words[index]]
+                matches = term_matches if matches is None else matches & term_matches
+            avatar_quests = self._avatar_quests.get(avatar_id, {})
+            if tag_sets:
+                # From the quests of the rarest tag, in id order
+                avatar_quests = {quest_id: avatar_quests[quest_id] for quest_id in sorted(tag_sets[0])
+                                 if quest_id in avatar_quests and all(quest_id in quest_ids for quest_ids in tag_sets[1:])}
+                candidates = avatar_quests.values()
+            else:
+                # A quest stored again by a write is last in avatar_quests, the id order is the sorted one
+                candidates = self._sorted_quests(avatar_id, "id")[1]
+            quest_ids = [quest_id for quest_id in sorted(matches)
+                         if quest_id in avatar_quests and avatar_quests[quest_id].deleted_at is None]
+            if limit is not None and len(quest_ids) >= limit:
+                return quest_ids[:limit]
+
+            prefix = search_text.strip().lower()
+            category_ids = {category_id for category_id, name in self._categories.items()
+                            if name.lower().startswith(prefix)}
+            seen = set(quest_ids)
+            for quest in candidates:
+                if quest.category_id in category_ids and quest.deleted_at is None and quest.id not in seen:
+                    quest_ids.append(quest.id)
+                    if limit is not None and len(quest_ids) >= limit:
+                        break
+            return quest_ids
+
+    def by_ids(self, quest_ids):
+        with self._lock:
+            self._load()
+            rows, missing = [], []
+            for quest_id in quest_ids:
+                quest = self._quests.get(quest_id)
+                if quest is None:
+                    missing.append(quest_id)
+                elif quest.deleted_at is None:
+                    rows.append(self._row(quest))
+        # Completed occurrences, or quests that don't exist
+        if missing:
+            rows.extend(self._sql.by_ids(missing))
+        return rows
+
+    def tags(self, avatar_id=None, with_counts=True):
+        with self._lock:
+            self._load()
+            tags = []
+            for name in sorted(self._tag_quests):
+                quests = (self._quests[quest_id] for quest_id in self._tag_quests[name])
+                live = (quest for quest in quests
+                        if quest.deleted_at is None and (avatar_id is None or quest.avatar_id == avatar_id))
+                if with_counts:
+                    count = sum(1 for quest in live)
+                    if count:
+                        tags.append(TagRecord(name, count))
+                elif next(live, None) is not None:
+                    tags.append(TagRecord(name, None))
+            return tags
+
+    def quest_tags(self, quest_ids):
+        with self._lock:
+            self._load()
+            return {quest_id: sorted(self._quest_tags[quest_id]) for quest_id in quest_ids
+                    if self._quest_tags.get(quest_id)}
+
+    #read the changed quests again, or everything on the next read when they are not known
+    def changed(self, quest_ids=None):
+        with self._lock:
+            if quest_ids is None:
+                self._stale = True
+            elif not self._stale:
+                self._refresh(quest_ids)
+
+    # Storage and indexes
+
+    def _clear(self):
+        self._categories = {}  # Id -> name, of the categories of the stored quests
+        self._quests = {}  # Id -> QuestRow
+        self._avatar_quests = {}  # Avatar id -> {quest id -> QuestRow}, in id order
+        self._sorted = {}  # Avatar id -> {sort key -> (sort keys, rows)}, built on first use
+        self._word_quests = {}  # Word of a quest name -> quest ids
+        self._quest_tags = {}  # Quest id -> tag names
+        self._tag_quests = {}  # Tag name -> quest ids, a tag without quests is removed
+        self._words = None  # Sorted words, for the prefix searches
+
+    #load every quest and tag from the database when the memory copy is stale
+    def _load(self):
+        if not self._stale:
+            return
+        self._clear()
+        with self.backend.session() as session:
+            rows = self._quest_rows_query(session).order_by(Quest.id)
+            for row in rows.yield_per(BULK_BATCH_SIZE):
+                self._store(row)
+            tags = session.query(QuestTag.quest_id, Tag.name).join(Tag, Tag.id == QuestTag.tag_id)
+            for quest_id, name in tags.yield_per(BULK_BATCH_SIZE):
+                if quest_id in self._quests:
+                    self._link_tag(quest_id, name)
+        self._stale = False
+
+    # Read some quests and their tags again, the ones no longer found are dropped
+    def _refresh(self, quest_ids):
+        with self.backend.session() as session:
+            for chunk in chunks(dict.fromkeys(quest_ids)):
+                rows = {row[0]: row for row in self._quest_rows_query(session).filter(Quest.id.in_(chunk))}
+                tags = {}
+                for quest_id, name in (
+                    session.query(QuestTag.quest_id, Tag.name)
+                    .join(Tag, Tag.id == QuestTag.tag_id)
+                    .filter(QuestTag.quest_id.in_(chunk))
+                ):
+                    tags.setdefault(quest_id, set()).add(name)
+
+                for quest_id in chunk:
+                    row = rows.get(quest_id)
+                    if row is None:
+                        quest = self._quests.get(quest_id)
+                        if quest is not None:
+                            self._remove_quest(quest)
+                        continue
+                    self._store(row)
+                    names = tags.get(quest_id, set())
+                    current = set(self._quest_tags.get(quest_id, ()))
+                    for name in current - names:
+                        self._unlink_tag(quest_id, name)
+                    for name in names - current:
+                        self._link_tag(quest_id, name)
+
+    @staticmethod
+    def _quest_rows_query(session):
+        return (
+            session.query(*QUEST_ROW_COLUMNS)
+            .join(Category, Quest.category_id == Category.id)
+            .filter(Quest.recurrence_id.is_(None))
+        )
+
+    # Add or update a quest from its QUEST_ROW_COLUMNS
+    def _store(self, row):
+        quest_id, avatar_id, quest_name, category_id, category_name, due_date, exp_amount, completed, deleted_at = row
+        self._categories[category_id] = category_name
+        quest = self._quests.get(quest_id)
+        if quest is not None and (quest.avatar_id, quest.quest_name, quest.due_date, quest.exp_amount) == \
+                (avatar_id, quest_name, due_date, exp_amount):
+            # Same place in the sorted lists and in the word index, updated in place
+            quest.category_id = category_id
+            quest.completed = completed
+            quest.deleted_at = deleted_at
+            return
+        if quest is not None:
+            self._remove_quest(quest, keep_tags=True)
+        quest = QuestRow(quest_id, avatar_id, quest_name, category_id, due_date, exp_amount, completed, deleted_at)
+        self._quests[quest_id] = quest
+        self._avatar_quests.setdefault(avatar_id, {})[quest_id] = quest
+        self._sorted.pop(avatar_id, None)
+        for word in quest.words:
+            quests = self._word_quests.setdefault(word, set())
+            if not quests:
+                self._words = None  # A new word, or one left out of the sorted words once unused
+            quests.add(quest_id)
+
+    def _remove_quest(self, quest, keep_tags=False):
+        del self._quests[quest.id]
+        del self._avatar_quests[quest.avatar_id][quest.id]
+        self._sorted.pop(quest.avatar_id, None)
+        for word in quest.words:
+            self._word_quests[word].discard(quest.id)
+        if not keep_tags:
+            for name in list(self._quest_tags.get(quest.id, ())):
+                self._unlink_tag(quest.id, name)
+
+    def _link_tag(self, quest_id, name):
+        self._tag_quests.setdefault(name, set()).add(quest_id)
+        self._quest_tags.setdefault(quest_id, set()).add(name)
+
+    def _unlink_tag(self, quest_id, name):
+        quest_ids = self._tag_quests[name]
+        quest_ids.discard(quest_id)
+        if not quest_ids:
+            del self._tag_quests[name]
+        self._quest_tags[quest_id].discard(name)
+
+    # Quest ids of each tag of a filter, the rarest first; None when a tag has no quests
+    def _tag_sets(self, tags):
+        tag_sets = [self._tag_quests.get(name) for name in tags]
+        if not all(tag_sets):
+            return None
+        return sorted(tag_sets, key=len)
+
+    #(sort keys, rows) of an avatar's quests in (sort column, id) order, deleted ones included
+    def _sorted_quests(self, avatar_id, sort_key):
+        orders = self._sorted.setdefault(avatar_id, {})
+        order = orders.get(sort_key)
+        if order is None:
+            attribute = QUEST_SORT_COLUMNS[sort_key].key
+            rows = sorted(self._avatar_quests.get(avatar_id, {}).values(),
+                          key=lambda quest: _sort_key(getattr(quest, attribute), quest.id))
+            order = orders[sort_key] = ([_sort_key(getattr(quest, attribute), quest.id) for quest in rows], rows)
+        return order
+
+    def _sorted_words(self):
+        if self._words is None:
+            self._words = sorted(word for word, quest_ids in self._word_quests.items() if quest_ids)
+        return self._words
+
+    @staticmethod
+    def _matches(quest, due_range, completed):
+        if completed is not None and bool(quest.completed) != completed:
+            return False
+        if due_range is not None:
+            start, end = due_range
+            if quest.due_date is None or (start is not None and quest.due_date < start) or \
+                    (end is not None and quest.due_date > end):
+                return False
+        return True
+
+    # A row in QUEST_COLUMNS order, like the ones of the SQL queries
+    def _row(self, quest):
+        return (quest.id, quest.quest_name, quest.category_id, self._categories[quest.category_id], quest.due_date,
+                quest.exp_amount, quest.completed)
@@ -0,0 +1,178 @@
+import logging
+from sqlalchemy import inspect, text
+from models.database import engine, Base, Avatar, Category, Quest, AvatarCategory, AppSetting, QuestRecurrence, \
+    QuestEvent, XpRollup, Tag, QuestTag, create_indexes, create_search_index, create_sync_journal, \
+    create_quest_tag_triggers, create_tag_count_triggers, SQL_NEW_UID, DEFAULT_AVATAR_UID
+
+logger = logging.getLogger(__name__)
+
+
+# Create the tables of the first schema, the databases made before the migrations already have them
+def create_base_tables(connection):
+    tables = [Avatar.__table__, Category.__table__, Quest.__table__, AvatarCategory.__table__]
+    Base.metadata.create_all(connection, tables=tables)
+
+
+# Databases older than the due date feature have no quests.due_date column
+def add_quest_due_date(connection):
+    add_column(connection, "quests", "due_date", "DATE")
+
+
+# The indexes of the quest lists. Version 3 also made ix_quests_avatar_id, which is no longer declared
+# on the model: version 12 drops it from the databases that have it
+def create_quest_indexes(connection):
+    create_indexes(connection, names={
+        "ix_quests_avatar_category",
+        "ix_quests_avatar_due_date",
+        "ix_quests_avatar_exp_amount",
+        "ix_quests_avatar_quest_name",
+    })
+
+
+def create_settings_table(connection):
+    Base.metadata.create_all(connection, tables=[AppSetting.__table__])
+
+
+def create_recurrences(connection):
+    Base.metadata.create_all(connection, tables=[QuestRecurrence.__table__])
+    add_column(connection, "quests", "recurrence_id", "INTEGER REFERENCES quest_recurrences (id)")
+    create_indexes(connection, names={"ix_quests_recurrence_due_date"})
+
+
+def create_agenda_index(connection):
+    create_indexes(connection, names={"ix_quests_avatar_completed_due_date"})
+
+
+# Soft delete, the free pages of the purged quests are given back by incremental vacuums
+def add_soft_delete(connection):
+    add_column(connection, "quests", "deleted_at", "DATETIME")
+    create_indexes(connection, names={"ix_quests_deleted_at"})
+    # Takes effect at the next VACUUM, run by the first purge
+    connection.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+
+
+# Exp history, the completions made before this version have no date and are not in it
+def create_history_tables(connection):
+    Base.metadata.create_all(connection, tables=[QuestEvent.__table__, XpRollup.__table__])
+
+
+# Sync journal: uids for the synced rows, the journal and its triggers. The rows that exist already
+# are journaled at version 1, so a first export sends the whole database.
+def add_sync_journal(connection):
+    for table in ("quests", "avatar"):
+        add_column(connection, table, "uid", "VARCHAR")
+        connection.execute(text(f"UPDATE {table} SET uid = {SQL_NEW_UID} WHERE uid IS NULL"))
+    create_indexes(connection, names={"ix_quests_uid", "ix_avatar_uid"})
+    create_sync_journal(connection)
+    connection.execute(text("UPDATE sync_state SET version = 1, clock = 1 WHERE version = 0"))
+    connection.execute(text(
+        "INSERT OR IGNORE INTO sync_journal (table_name, row_id, category_id, uid, deleted, version, clock, device_id) "
+        "SELECT 'avatar', id, 0, uid, 0, 1, 1, (SELECT device_id FROM sync_state) FROM avatar "
+        "UNION ALL SELECT 'quests', id, 0, uid, 0, 1, 1, (SELECT device_id FROM sync_state) FROM quests "
+        "UNION ALL SELECT 'avatar_category', avatar_id, category_id, (SELECT uid FROM avatar WHERE id = avatar_id), "
+        "0, 1, 1, (SELECT device_id FROM sync_state) FROM avatar_category"
+    ))
+
+
+def create_tags(connection):
+    Base.metadata.create_all(connection, tables=[Tag.__table__, QuestTag.__table__])
+    create_quest_tag_triggers(connection)
+    create_tag_count_triggers(connection)
+
+
+# ix_quests_avatar_id is a prefix of ix_quests_avatar_category, it only slowed down the quest writes
+def drop_quest_avatar_index(connection):
+    connection.execute(text("DROP INDEX IF EXISTS ix_quests_avatar_id"))
+
+
+# The exp of the purged quests stays in exp_points, it is now counted in purged_exp. Before this
+# version only the purges could leave more exp in a category than its completed quests hold, that
+# excess is taken as their exp.
+def add_purged_exp(connection):
+    add_column(connection, "avatar_category", "purged_exp", "INTEGER NOT NULL DEFAULT 0")
+    connection.execute(text(
+        "UPDATE avatar_category SET purged_exp = max(coalesce(exp_points, 0) - coalesce(("
+        "SELECT sum(exp_amount) FROM quests WHERE quests.avatar_id = avatar_category.avatar_id "
+        "AND quests.category_id = avatar_category.category_id AND quests.completed), 0), 0)"
+    ))
+
+
+# The default avatar (the first one) takes the uid shared by every device, unless this database already
+# imported a delta (data_manager.SYNC_PEER_SETTING): the other devices may know it by its old uid
+def share_default_avatar_uid(connection):
+    if connection.execute(text("SELECT 1 FROM app_settings WHERE key LIKE 'sync!_peer:%' ESCAPE '!'")).first():
+        return
+    if connection.execute(text("SELECT 1 FROM avatar WHERE uid = :uid"), {"uid": DEFAULT_AVATAR_UID}).first():
+        return
+    first_avatar = connection.execute(text("SELECT id, uid FROM avatar ORDER BY id LIMIT 1")).first()
+    if first_avatar is None:
+        return
+    connection.execute(text("UPDATE avatar SET uid = :uid WHERE id = :id"),
+                       {"uid": DEFAULT_AVATAR_UID, "id": first_avatar.id})
+    connection.execute(text(
+        "UPDATE sync_journal SET uid = :uid WHERE uid = :old_uid AND table_name IN ('avatar', 'avatar_category')"
+    ), {"uid": DEFAULT_AVATAR_UID, "old_uid": first_avatar.uid})
+
+
+# Ordered (version, description, function) list, the last version is the current schema.
+# Append new migrations at the end, never change or reorder the applied ones.
+MIGRATIONS = [
+    (1, "base tables", create_base_tables),
+    (2, "quests.due_date column", add_quest_due_date),
+    (3, "quest indexes", create_quest_indexes),
+    (4, "quest full-text search", create_search_index),
+    (5, "app_settings table", create_settings_table),
+    (6, "recurring quests", create_recurrences),
+    (7, "agenda index", create_agenda_index),
+    (8, "quest soft delete", add_soft_delete),
+    (9, "exp history", create_history_tables),
+    (10, "sync journal", add_sync_journal),
+    (11, "quest tags", create_tags),
+    (12, "drop the quests avatar_id index", drop_quest_avatar_index),
+    (13, "exp of the purged quests", add_purged_exp),
+    (14, "shared uid of the default avatar", share_default_avatar_uid),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+# Add a column unless the table already has it (created by a later version of the model)
+def add_column(connection, table, column, column_type):
+    columns = {info["name"] for info in inspect(connection).get_columns(table)}
+    if column not in columns:
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+
+
+def get_schema_version(connection):
+    return connection.execute(text("PRAGMA user_version")).scalar()
+
+
+# Apply the migrations newer than the schema version of the database
+def migrate(target=LATEST_VERSION, bind=None):
+    """Returns the list of applied versions, empty when the schema is already current.
+
+    Each migration runs in its own transaction together with the `user_version` bump, so an
+    interrupted run resumes from the last applied one.
+    """
+    bind = bind or engine
+    with bind.connect() as connection:
+        version = get_schema_version(connection)
+    if version >= target:
+        if version > LATEST_VERSION:
+            logger.warning(f"⚠ Database schema version {version} is newer than this app ({LATEST_VERSION}).")
+        return []  # Nothing to do, no DDL at startup
+
+    applied = []
+    for migration_version, description, apply in MIGRATIONS:
+        if migration_version > target:
+            break
+        with bind.begin() as connection:
+            # pysqlite doesn't open a transaction before DDL, take the write lock explicitly
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+            # Another process may have migrated while we waited for the lock
+            if get_schema_version(connection) >= migration_version:
+                continue
+            logger.info(f"Migrating the database to version {migration_version}: {description}")
+            apply(connection)
+            connection.exec_driver_sql(f"PRAGMA user_version = {migration_version}")
+        applied.append(migration_version)
+    return applied
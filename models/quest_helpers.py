@@ -0,0 +1,81 @@
+import datetime
+from sqlalchemy import exists
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models.database import Quest, Tag, QuestTag
+from models.recurrence import iter_occurrences
+from models.repositories import chunks
+
+# Date and tag helpers of the quest writes, shared by the DataManager and the merge of the synced
+# changes (models/sync.py). The ones taking a session run inside the caller's transaction.
+
+
+# Stored form of a tag: trimmed, single spaces, lowercase
+def normalize_tag(name):
+    return " ".join(name.split()).lower()
+
+
+# Distinct stored forms of tag names, in order, without the empty ones
+def normalize_tags(names):
+    return list(dict.fromkeys(tag for tag in map(normalize_tag, names) if tag))
+
+
+# Display form of a due date, isoformat is much cheaper than strftime on every row
+def format_date(value):
+    return value.isoformat() if value else "No date"
+
+
+# Date of a 'YYYY-MM-DD' string or of a date, None for an empty value
+def parse_date(value):
+    if not value:
+        return None
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(value)
+
+
+# Ids of stored tag names, the missing ones are created when `create` is set
+def tag_ids_by_name(session, names, create=False):
+    tag_ids = {}
+    for chunk in chunks(names):
+        if create:
+            session.execute(sqlite_insert(Tag).values([{"name": name} for name in chunk]).on_conflict_do_nothing())
+        tag_ids.update(session.query(Tag.name, Tag.id).filter(Tag.name.in_(chunk)))
+    return tag_ids
+
+
+# Link quests to tags (created if needed), returns the links added
+def link_tags(session, quest_ids, tag_names):
+    tag_ids = tag_ids_by_name(session, normalize_tags(tag_names), create=True)
+    links = [{"quest_id": quest_id, "tag_id": tag_id} for quest_id in quest_ids for tag_id in tag_ids.values()]
+    if not links:
+        return 0
+    return session.execute(sqlite_insert(QuestTag).on_conflict_do_nothing(), links).rowcount
+
+
+# Make the tags of a quest exactly `tag_names`, only the changed links are written (each one
+# journals the quest for the sync). The tags it leaves unused are kept. Returns the sorted tag names.
+def replace_quest_tags(session, quest_id, tag_names):
+    names = normalize_tags(tag_names)
+    current = dict(
+        session.query(Tag.name, Tag.id).join(QuestTag, QuestTag.tag_id == Tag.id).filter(QuestTag.quest_id == quest_id)
+    )
+    removed = [tag_id for name, tag_id in current.items() if name not in names]
+    if removed:
+        session.query(QuestTag).filter(QuestTag.quest_id == quest_id, QuestTag.tag_id.in_(removed)).delete(
+            synchronize_session=False
+        )
+    link_tags(session, [quest_id], [name for name in names if name not in current])
+    return sorted(names)
+
+
+# Tags left without quests go away, through the tag index
+def drop_unused_tags(session):
+    session.query(Tag).filter(~exists().where(QuestTag.tag_id == Tag.id)).delete(synchronize_session=False)
+
+
+# First occurrence of a recurring quest on or after `after` that is not completed, None when the series is over
+def next_open_occurrence(session, rule_id, repeat, after):
+    completed = {day for (day,) in session.query(Quest.due_date).filter(
+        Quest.recurrence_id == rule_id, Quest.due_date >= after
+    )}
+    return next((day for day in iter_occurrences(*repeat, after=after) if day not in completed), None)
@@ -0,0 +1,62 @@
+import csv
+import json
+
+# Streaming readers / writers for quest import and export (CSV and JSON Lines)
+QUEST_FIELDS = ["id", "avatar_id", "quest_name", "category_name", "completed", "exp_amount", "due_date"]
+
+
+#write quests to a CSV file one row at a time, returns the number of rows
+def write_csv(quests, file):
+    writer = csv.DictWriter(file, fieldnames=QUEST_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    count = 0
+    for quest in quests:
+        writer.writerow(quest)
+        count += 1
+    return count
+
+
+#write quests as one JSON object per line, returns the number of rows
+def write_jsonl(quests, file):
+    count = 0
+    for quest in quests:
+        file.write(json.dumps(quest, ensure_ascii=False))
+        file.write("\n")
+        count += 1
+    return count
+
+
+#read quests from a CSV file, converting the columns back to their types
+def read_csv(file):
+    for row in csv.DictReader(file):
+        yield {
+            "avatar_id": int(row["avatar_id"]),
+            "quest_name": row["quest_name"],
+            "category_name": row["category_name"],
+            "completed": row.get("completed", "").strip().lower() in ("1", "true", "yes"),
+            "exp_amount": int(row["exp_amount"]) if row.get("exp_amount") else 0,
+            "due_date": row.get("due_date") or None
+        }
+
+
+#read quests from a JSON Lines file, blank lines are ignored
+def read_jsonl(file):
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+FORMATS = {
+    "csv": (read_csv, write_csv),
+    "jsonl": (read_jsonl, write_jsonl),
+}
+
+
+#guess the format from the file extension
+def format_from_path(path, default="jsonl"):
+    extension = path.rsplit(".", 1)[-1].lower() if "." in path else ""
+    if extension == "csv":
+        return "csv"
+    if extension in ("jsonl", "ndjson", "json"):
+        return "jsonl"
+    return default
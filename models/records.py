@@ -0,0 +1,35 @@
+from collections import namedtuple
+
+# Lightweight read-only records returned by the data layer instead of ORM objects
+
+
+class QuestRecord:
+    """Compact quest row: no per-instance __dict__, no session state."""
+    __slots__ = ("id", "quest_name", "category_id", "category_name", "due_date", "exp_amount", "completed")
+
+    def __init__(self, id, quest_name, category_id, category_name, due_date, exp_amount, completed):
+        self.id = id
+        self.quest_name = quest_name
+        self.category_id = category_id
+        self.category_name = category_name
+        self.due_date = due_date
+        self.exp_amount = exp_amount
+        self.completed = completed
+
+    def __repr__(self):
+        return f"QuestRecord(id={self.id!r}, quest_name={self.quest_name!r})"
+
+
+class CategoryRecord(namedtuple("CategoryRecord", "id category_name")):
+    """Immutable category snapshot."""
+    __slots__ = ()
+
+
+class AvatarRecord(namedtuple("AvatarRecord", "id name level experience")):
+    """Immutable avatar snapshot, use `_replace` to derive an updated copy."""
+    __slots__ = ()
+
+
+class TagRecord(namedtuple("TagRecord", "name quest_count")):
+    """Immutable tag snapshot with the number of quests carrying it."""
+    __slots__ = ()
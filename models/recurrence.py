@@ -0,0 +1,58 @@
+import calendar
+import datetime
+from itertools import count
+
+# Occurrence dates of recurring quests, computed on demand: only the rule is stored, an occurrence
+# becomes a quests row when it is completed.
+
+FREQUENCIES = ("daily", "weekly", "monthly")
+
+_STEP_DAYS = {"daily": 1, "weekly": 7}
+
+
+#yield the occurrence dates of a rule from `after` (included) on, forever when there is no end date
+def iter_occurrences(frequency, interval, start_date, end_date=None, after=None):
+    """Jumps straight to the first occurrence on or after `after`, the earlier ones are never computed."""
+    if frequency not in FREQUENCIES:
+        raise ValueError(f"Unknown frequency '{frequency}', expected one of {FREQUENCIES}")
+    interval = max(1, interval or 1)
+    after = max(after or start_date, start_date)
+
+    for index in count(_first_index(frequency, interval, start_date, after)):
+        occurrence = _occurrence(frequency, interval, start_date, index)
+        if end_date is not None and occurrence > end_date:
+            return
+        if occurrence >= after:
+            yield occurrence
+
+
+#occurrence dates between two dates, both included
+def occurrences_between(frequency, interval, start_date, end_date, window_start, window_end):
+    for occurrence in iter_occurrences(frequency, interval, start_date, end_date, after=window_start):
+        if occurrence > window_end:
+            return
+        yield occurrence
+
+
+def is_occurrence(frequency, interval, start_date, end_date, day):
+    return next(iter_occurrences(frequency, interval, start_date, end_date, after=day), None) == day
+
+
+# Index of the first occurrence that can fall on or after `after`
+def _first_index(frequency, interval, start_date, after):
+    if frequency == "monthly":
+        months = (after.year - start_date.year) * 12 + after.month - start_date.month
+        return max(0, months // interval)
+    step = _STEP_DAYS[frequency] * interval
+    return max(0, -(-(after - start_date).days // step))
+
+
+def _occurrence(frequency, interval, start_date, index):
+    if frequency == "monthly":
+        month = start_date.month - 1 + index * interval
+        year = start_date.year + month // 12
+        month = month % 12 + 1
+        # Keep the day of the start date, clamped to the end of shorter months
+        day = min(start_date.day, calendar.monthrange(year, month)[1])
+        return datetime.date(year, month, day)
+    return start_date + datetime.timedelta(days=_STEP_DAYS[frequency] * interval * index)
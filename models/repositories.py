@@ -0,0 +1,276 @@
+import re
+from sqlalchemy import text, func, select, exists
+from models.database import Category, Quest, Tag, QuestTag
+from models.records import TagRecord
+
+# Quest list reads of the DataManager. The `quests` repository of a backend answers the list,
+# page, agenda, search and tag queries with rows in QUEST_COLUMNS order; the DataManager formats
+# them and keeps every write and the exp and tag rules. `changed` is called after each committed
+# write with the ids of the quests it touched (None when they are not known), for the
+# repositories keeping a copy of the quests (models/memory_backend.py).
+
+# Columns projected by the quest list queries, in QuestRecord order
+QUEST_COLUMNS = (
+    Quest.id,
+    Quest.quest_name,
+    Quest.category_id,
+    Category.category_name,
+    Quest.due_date,
+    Quest.exp_amount,
+    Quest.completed,
+)
+
+# Columns the paged quest queries can be ordered by
+QUEST_SORT_COLUMNS = {
+    "id": Quest.id,
+    "due_date": Quest.due_date,
+    "exp_amount": Quest.exp_amount,
+    "quest_name": Quest.quest_name,
+}
+
+# SQLite limits the number of bound parameters in a single statement
+ID_CHUNK_SIZE = 500
+
+# Cost of a quest read through the tag index (primary key lookup, then sorted) relative to one
+# read by the ordered scan of the avatar's quests
+TAG_DRIVE_COST = 3
+
+
+# Split a list of ids into chunks that fit in one statement
+def chunks(items, size=ID_CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+# True when a tag filter is cheaper driven from its rarest tag than checked on the ordered scan
+def drive_from_rarest_tag(counts, total, limit):
+    """`counts` are the numbers of quests of the tags, `total` the number of quests. With
+    independent tags the scan reads about (limit + 1) / product of the tag densities quests to
+    fill a page (all of them at most), the rarest tag reads all of its quests.
+    """
+    scanned = limit + 1
+    for count in counts:
+        scanned *= total / max(count, 1)
+    return TAG_DRIVE_COST * min(counts) < min(scanned, total)
+
+
+class SqlQuestRepository:
+    """The quest reads as SQL queries on the database of a SqlBackend."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    #rows of all the quests of an avatar, completed occurrences left out
+    def avatar_quests(self, avatar_id, sort_key="id", descending=False):
+        with self.backend.session() as session:
+            rows = self._quest_rows_query(session).filter(Quest.avatar_id == avatar_id, Quest.recurrence_id.is_(None))
+            return rows.order_by(*self._quest_order(sort_key, descending)).all()
+
+    #one page of rows and the cursor of the next one, see DataManager.get_avatar_quests_page
+    def page(self, avatar_id, after, limit, sort_key="id", descending=False, due_range=None, completed=None, tags=()):
+        sort_column = QUEST_SORT_COLUMNS[sort_key]
+        with self.backend.session() as session:
+            query = self._filter_avatar_tags(session, self._quest_rows_query(session), avatar_id, tags, limit)
+            if query is None:
+                return [], None
+            query = self._filter_due(query, due_range, completed)
+            if after is not None:
+                query = query.filter(self._after_cursor(sort_column, after, descending))
+            rows = query.order_by(*self._quest_order(sort_key, descending)).limit(limit + 1).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last_row = rows[-1]._mapping
+            next_cursor = (last_row[sort_column], last_row[Quest.id])
+        return rows, next_cursor
+
+    #rows of the open quests of an avatar due up to `last_day`, by due date
+    def agenda(self, avatar_id, last_day):
+        """One range query, served by ix_quests_avatar_completed_due_date."""
+        with self.backend.session() as session:
+            query = self._filter_due(
+                self._quest_rows_query(session).filter(Quest.avatar_id == avatar_id), (None, last_day), False
+            )
+            return query.order_by(Quest.due_date, Quest.id).all()
+
+    #quest ids matching a search text, see DataManager.search_quest_ids
+    def search(self, avatar_id, search_text, limit=None, tags=()):
+        terms = re.findall(r"\w+", search_text.lower())
+        if not terms:
+            return []
+
+        fts_query = " ".join(f'"{term}"*' for term in terms)
+        category_prefix = re.sub(r"([\\%_])", r"\\\1", search_text.strip().lower()) + "%"
+        sql_limit = limit if limit is not None else -1
+
+        with self.backend.session() as session:
+            tag_ids = [tag_id for (tag_id,) in session.query(Tag.id).filter(Tag.name.in_(tags))] if tags else []
+            if len(tag_ids) < len(tags):
+                return []
+            # The matches are few, each one is checked in the junction primary key
+            tag_filter = "".join(
+                f"AND EXISTS (SELECT 1 FROM quest_tags WHERE quest_id = quests.id AND tag_id = :tag_{index}) "
+                for index in range(len(tag_ids))
+            )
+            quest_ids = list(session.execute(
+                text(
+                    "SELECT quests.id FROM quests_fts "
+                    "JOIN quests ON quests.id = quests_fts.rowid "
+                    "WHERE quests_fts MATCH :fts_query AND quests.avatar_id = :avatar_id "
+                    "AND quests.recurrence_id IS NULL AND quests.deleted_at IS NULL "
+                    + tag_filter +
+                    "ORDER BY quests_fts.rank LIMIT :limit"
+                ),
+                {"fts_query": fts_query, "avatar_id": avatar_id, "limit": sql_limit,
+                 **{f"tag_{index}": tag_id for index, tag_id in enumerate(tag_ids)}}
+            ).scalars())
+            if limit is not None and len(quest_ids) >= limit:
+                return quest_ids
+
+            category_ids = [
+                category_id for (category_id,) in session.query(Category.id)
+                .filter(Category.category_name.like(category_prefix, escape="\\"))
+            ]
+            if not category_ids:
+                return quest_ids
+
+            seen = set(quest_ids)
+            category_matches = (
+                session.query(Quest.id)
+                .filter(Quest.avatar_id == avatar_id, Quest.category_id.in_(category_ids), Quest.recurrence_id.is_(None),
+                        Quest.deleted_at.is_(None))
+                .order_by(Quest.id)
+            )
+            for tag_id in tag_ids:
+                category_matches = category_matches.filter(
+                    exists().where((QuestTag.quest_id == Quest.id) & (QuestTag.tag_id == tag_id))
+                )
+            for (quest_id,) in category_matches.yield_per(ID_CHUNK_SIZE):
+                if quest_id in seen:
+                    continue
+                quest_ids.append(quest_id)
+                if limit is not None and len(quest_ids) >= limit:
+                    break
+            return quest_ids
+
+    #rows of the quests of `quest_ids` that exist, in no particular order
+    def by_ids(self, quest_ids):
+        rows = []
+        with self.backend.session() as session:
+            for chunk in chunks(quest_ids):
+                rows.extend(self._quest_rows_query(session).filter(Quest.id.in_(chunk)))
+        return rows
+
+    #the tags in use as TagRecords, see DataManager.get_tags
+    def tags(self, avatar_id=None, with_counts=True):
+        live_quest = (Quest.id == QuestTag.quest_id) & Quest.deleted_at.is_(None) & Quest.recurrence_id.is_(None)
+        if avatar_id is not None:
+            live_quest &= Quest.avatar_id == avatar_id
+        with self.backend.session() as session:
+            if not with_counts:
+                names = session.query(Tag.name).filter(
+                    exists().where(QuestTag.tag_id == Tag.id).where(live_quest)
+                )
+                return [TagRecord(name, None) for (name,) in names.order_by(Tag.name)]
+            rows = (
+                session.query(Tag.name, func.count())
+                .join(QuestTag, QuestTag.tag_id == Tag.id)
+                .join(Quest, live_quest)
+            )
+            return [TagRecord(*row) for row in rows.group_by(Tag.id).order_by(Tag.name)]
+
+    #{quest id: sorted tag names}, read through the junction primary key
+    def quest_tags(self, quest_ids):
+        tags = {}
+        with self.backend.session() as session:
+            for chunk in chunks(quest_ids):
+                rows = (
+                    session.query(QuestTag.quest_id, Tag.name)
+                    .join(Tag, Tag.id == QuestTag.tag_id)
+                    .filter(QuestTag.quest_id.in_(chunk))
+                    .order_by(QuestTag.quest_id, Tag.name)
+                )
+                for quest_id, name in rows:
+                    tags.setdefault(quest_id, []).append(name)
+        return tags
+
+    #nothing is kept between the queries
+    def changed(self, quest_ids=None):
+        pass
+
+    # Single joined query on plain columns: no lazy category load, no ORM identity map
+    @staticmethod
+    def _quest_rows_query(session):
+        return (
+            session.query(*QUEST_COLUMNS)
+            .join(Category, Quest.category_id == Category.id)
+            .filter(Quest.deleted_at.is_(None))
+        )
+
+    # Due date range and completion filters, a range leaves out the quests without a due date
+    @staticmethod
+    def _filter_due(query, due_range=None, completed=None):
+        if completed is not None:
+            query = query.filter(Quest.completed == completed)
+        if due_range is not None:
+            start, end = due_range
+            query = query.filter(Quest.due_date.isnot(None))
+            if start is not None:
+                query = query.filter(Quest.due_date >= start)
+            if end is not None:
+                query = query.filter(Quest.due_date <= end)
+        return query
+
+    # ORDER BY clause of the quest lists, the id tiebreak keeps the order stable
+    @staticmethod
+    def _quest_order(sort_key, descending=False):
+        sort_column = QUEST_SORT_COLUMNS[sort_key]
+        if descending:
+            return sort_column.desc(), Quest.id.desc()
+        return sort_column.asc(), Quest.id.asc()
+
+    # Rows after a keyset cursor, SQLite puts NULLs first in ascending order and last in descending order
+    @staticmethod
+    def _after_cursor(sort_column, after, descending=False):
+        sort_value, quest_id = after
+        if not descending:
+            if sort_value is None:
+                return ((sort_column.is_(None)) & (Quest.id > quest_id)) | sort_column.isnot(None)
+            return (sort_column > sort_value) | ((sort_column == sort_value) & (Quest.id > quest_id))
+        if sort_value is None:
+            return (sort_column.is_(None)) & (Quest.id < quest_id)
+        return (sort_column < sort_value) | ((sort_column == sort_value) & (Quest.id < quest_id)) | sort_column.is_(None)
+
+    # Quest list filter on tags: the quests of an avatar carrying all of them
+    @staticmethod
+    def _filter_avatar_tags(session, query, avatar_id, tags=(), limit=None):
+        """Either the avatar's quests are scanned in order and each one is checked in the junction
+        primary key until the page is full, or a rare tag drives the query: its quest ids are read
+        from the tag index, then the quests by primary key, filtered and sorted. The cheaper plan is
+        picked from the tag counts (see drive_from_rarest_tag).
+        Returns None when a tag doesn't exist (no quest matches).
+        """
+        if not tags:
+            return query.filter(Quest.avatar_id == avatar_id, Quest.recurrence_id.is_(None))
+        counts = dict(session.query(Tag.id, Tag.quest_count).filter(Tag.name.in_(tags)))
+        if len(counts) < len(tags):
+            return None
+
+        tag_ids = list(counts)
+        rarest = min(counts, key=counts.get)
+        total = session.query(func.max(Quest.id)).scalar() or 0
+        if drive_from_rarest_tag(counts.values(), total, limit):
+            # "+ 0" keeps SQLite off the avatar indexes, which would scan all the avatar's quests
+            query = query.filter(
+                Quest.avatar_id + 0 == avatar_id,
+                (Quest.recurrence_id + 0).is_(None),
+                Quest.id.in_(select(QuestTag.quest_id).where(QuestTag.tag_id == rarest)),
+            )
+            tag_ids.remove(rarest)
+        else:
+            query = query.filter(Quest.avatar_id == avatar_id, Quest.recurrence_id.is_(None))
+        for tag_id in tag_ids:
+            query = query.filter(exists().where((QuestTag.quest_id == Quest.id) & (QuestTag.tag_id == tag_id)))
+        return query
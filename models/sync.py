@@ -0,0 +1,304 @@
+import datetime
+import logging
+from sqlalchemy import text
+from models.database import init_avatar_categories, Avatar, Category, AvatarCategory, Quest, QuestRecurrence, \
+    QuestTag, SyncChange
+from models.repositories import chunks
+from models.quest_helpers import parse_date, replace_quest_tags, drop_unused_tags, next_open_occurrence
+
+# Merge of the changes exported by another device (DataManager.export_changes) into the database.
+# Quests and avatars are matched by uid, categories by name. Each synced row keeps the clock and
+# device of its last change in the journal; a change is applied when it is newer than that one.
+logger = logging.getLogger(__name__)
+
+
+#true when a change is more recent than the last local change of its row (None: unknown row)
+def is_newer(change, local):
+    return local is None or (change["clock"], change["device_id"]) > (local.clock, local.device_id)
+
+
+class ChangeMerge:
+    """Applies the changes inside the caller's transaction, batch by batch (`merge`), then `finish`.
+
+    The exp columns are not merged: `exp_deltas` collects the exp the merged quests add to or take
+    from each avatar category (their completion or exp changed), `purged_exp` the exp of the
+    completed quests purged on the other device. The caller applies both in the same transaction.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.counts = {"applied": 0, "kept": 0, "skipped": 0}
+        self.avatar_ids = dict(session.query(Avatar.uid, Avatar.id))
+        self.category_ids = dict(session.query(Category.category_name, Category.id))
+        self.rule_ids = {}  # uid of a recurring quest -> id of its rule
+        self.exp_deltas = {}  # (avatar id, category id) -> exp change of the merged quests
+        self.purged_exp = {}  # (avatar id, category id) -> exp of the completed quests purged by the merge
+        self.rules = set()  # Rules whose occurrences changed, the due date of their quest may move
+        self.deferred = []  # Occurrences received before their recurring quest
+        self.categories_created = False
+
+    #apply a batch of changes
+    def merge(self, changes):
+        local = self._local_rows(changes)
+        for change in changes:
+            table = change["table"]
+            if table == "avatar_category":
+                result = self._merge_avatar_category(change)
+            elif not is_newer(change, local.get((table, change["uid"]))):
+                result = "kept"
+            elif table == "avatar":
+                result = self._merge_avatar(change, local.get((table, change["uid"])))
+            elif table == "quests":
+                result = self._merge_quest(change, local.get((table, change["uid"])))
+            else:
+                logger.error(f"⚠ Unknown table '{table}' in the sync changes.")
+                result = "skipped"
+
+            if result == "deferred":
+                self.deferred.append(change)
+            else:
+                self.counts[result] += 1
+
+    #apply the deferred changes, move the due dates of the recurring quests and drop the unused tags
+    def finish(self):
+        deferred, self.deferred = self.deferred, []
+        for change in deferred:
+            result = self._merge_quest(change, self._local_rows([change]).get(("quests", change["uid"])))
+            if result == "deferred":
+                logger.error(f"⚠ Recurring quest {change['template_uid']} of occurrence {change['uid']} is unknown.")
+                result = "skipped"
+            self.counts[result] += 1
+
+        # An occurrence completed on the other device may be the due date of its recurring quest
+        for rule_id in self.rules:
+            template = (
+                self.session.query(Quest.id, Quest.due_date, QuestRecurrence.frequency, QuestRecurrence.interval,
+                                   QuestRecurrence.start_date, QuestRecurrence.end_date)
+                .join(QuestRecurrence, QuestRecurrence.quest_id == Quest.id)
+                .filter(QuestRecurrence.id == rule_id)
+                .first()
+            )
+            if template is None or template.due_date is None:
+                continue
+            quest_id, due_date, *repeat = template
+            next_due = next_open_occurrence(self.session, rule_id, repeat, due_date)
+            if next_due != due_date:
+                self.session.query(Quest).filter(Quest.id == quest_id).update(
+                    {Quest.due_date: next_due}, synchronize_session=False
+                )
+        drop_unused_tags(self.session)
+
+    # Journal entries of the rows of the changes, by (table, uid)
+    def _local_rows(self, changes):
+        local = {}
+        for table in ("avatar", "quests"):
+            uids = [change["uid"] for change in changes if change["table"] == table]
+            for chunk in chunks(uids):
+                rows = self.session.query(SyncChange.uid, SyncChange.row_id, SyncChange.deleted, SyncChange.clock,
+                                          SyncChange.device_id)
+                for row in rows.filter(SyncChange.table_name == table, SyncChange.uid.in_(chunk)):
+                    local[(table, row.uid)] = row
+        return local
+
+    def _merge_avatar(self, change, local):
+        uid = change["uid"]
+        alive = local is not None and not local.deleted
+        if change["deleted"]:
+            if alive:
+                self._delete_avatar(local.row_id)
+                self._stamp("avatar", local.row_id, uid, change)
+            return "applied"
+
+        if alive:
+            avatar_id = local.row_id
+            self.session.query(Avatar).filter(Avatar.id == avatar_id).update(
+                {Avatar.name: change["name"]}, synchronize_session=False
+            )
+        else:
+            self._drop_tombstone("avatar", uid)
+            avatar_id = self.session.execute(
+                Avatar.__table__.insert().values(uid=uid, name=change["name"], level=1, experience=0)
+            ).inserted_primary_key[0]
+            init_avatar_categories(self.session.connection(), avatar_id)
+            self.avatar_ids[uid] = avatar_id
+        self._stamp("avatar", avatar_id, uid, change)
+        return "applied"
+
+    # An avatar goes with its quests and exp rows
+    def _delete_avatar(self, avatar_id):
+        quest_ids = [quest_id for (quest_id,) in self.session.query(Quest.id).filter(Quest.avatar_id == avatar_id)]
+        for chunk in chunks(quest_ids):
+            self.session.query(QuestRecurrence).filter(QuestRecurrence.quest_id.in_(chunk)).delete(
+                synchronize_session=False
+            )
+        self.session.query(Quest).filter(Quest.avatar_id == avatar_id).delete(synchronize_session=False)
+        for chunk in chunks(quest_ids):
+            self.session.query(QuestTag).filter(QuestTag.quest_id.in_(chunk)).delete(synchronize_session=False)
+        self.session.query(AvatarCategory).filter(AvatarCategory.avatar_id == avatar_id).delete(synchronize_session=False)
+        self.session.query(Avatar).filter(Avatar.id == avatar_id).delete(synchronize_session=False)
+        self.avatar_ids = {uid: known_id for uid, known_id in self.avatar_ids.items() if known_id != avatar_id}
+        for exp in (self.exp_deltas, self.purged_exp):
+            for key in [key for key in exp if key[0] == avatar_id]:
+                del exp[key]
+
+    def _merge_quest(self, change, local):
+        uid = change["uid"]
+        alive = local is not None and not local.deleted
+        if change["deleted"]:
+            if alive:
+                quest = self._quest_exp(local.row_id)
+                if quest is not None:
+                    if quest.recurrence_id is not None:
+                        self.rules.add(quest.recurrence_id)
+                    if quest.completed and quest.exp_amount:
+                        key = (quest.avatar_id, quest.category_id)
+                        if quest.recurrence_id is not None and quest.deleted_at is None:
+                            # An occurrence un-completed on the other device
+                            self._add_exp(self.exp_deltas, key, -quest.exp_amount)
+                        else:
+                            # Purged there (only deleted quests are), the exp stays like after a local purge
+                            self._add_exp(self.purged_exp, key, quest.exp_amount)
+                # Like purge_deleted: a recurring quest loses its rule, its completed occurrences stay
+                self.session.query(QuestRecurrence).filter(QuestRecurrence.quest_id == local.row_id).delete(
+                    synchronize_session=False
+                )
+                self.session.query(Quest).filter(Quest.id == local.row_id).delete(synchronize_session=False)
+                self.session.query(QuestTag).filter(QuestTag.quest_id == local.row_id).delete(synchronize_session=False)
+                self._stamp("quests", local.row_id, uid, change)
+            return "applied"
+
+        avatar_id = self.avatar_ids.get(change["avatar_uid"])
+        if avatar_id is None:
+            logger.error(f"⚠ Avatar {change['avatar_uid']} of quest {uid} is unknown.")
+            return "skipped"
+        rule_id = None
+        if change.get("template_uid"):
+            rule_id = self._rule_id(change["template_uid"])
+            if rule_id is None:
+                return "deferred"
+
+        values = {
+            "avatar_id": avatar_id,
+            "quest_name": change["quest_name"],
+            "category_id": self._category_id(change["category_name"]),
+            "completed": bool(change["completed"]),
+            "exp_amount": change["exp_amount"],
+            "due_date": parse_date(change["due_date"]),
+            "deleted_at": datetime.datetime.fromisoformat(change["deleted_at"]) if change["deleted_at"] else None,
+            "recurrence_id": rule_id,
+        }
+        quest_id = local.row_id if alive else None
+        if quest_id is None and rule_id is not None:
+            # The same occurrence completed on both devices: a single row, with the uid of the latest change
+            existing = (
+                self.session.query(Quest.id, SyncChange.clock, SyncChange.device_id)
+                .outerjoin(SyncChange, (SyncChange.table_name == "quests") & (SyncChange.row_id == Quest.id)
+                           & (SyncChange.category_id == 0))
+                .filter(Quest.recurrence_id == rule_id, Quest.due_date == values["due_date"])
+                .first()
+            )
+            if existing is not None:
+                if existing.clock is not None and not is_newer(change, existing):
+                    return "kept"
+                quest_id = existing.id
+                values["uid"] = uid
+
+        if quest_id is not None:
+            previous = self._quest_exp(quest_id)
+            if previous is not None and previous.completed and previous.exp_amount:
+                self._add_exp(self.exp_deltas, (previous.avatar_id, previous.category_id), -previous.exp_amount)
+            self.session.query(Quest).filter(Quest.id == quest_id).update(values, synchronize_session=False)
+        else:
+            self._drop_tombstone("quests", uid)
+            quest_id = self.session.execute(Quest.__table__.insert().values(uid=uid, **values)).inserted_primary_key[0]
+
+        recurrence = change.get("recurrence")
+        if recurrence:
+            rule = {
+                "frequency": recurrence["frequency"],
+                "interval": recurrence["interval"],
+                "start_date": parse_date(recurrence["start_date"]),
+                "end_date": parse_date(recurrence["end_date"]),
+            }
+            rules = self.session.query(QuestRecurrence).filter(QuestRecurrence.quest_id == quest_id)
+            if not rules.update(rule, synchronize_session=False):
+                self.session.execute(QuestRecurrence.__table__.insert().values(quest_id=quest_id, **rule))
+            self.rule_ids[uid] = rules.with_entities(QuestRecurrence.id).scalar()
+            self.rules.add(self.rule_ids[uid])
+        if rule_id is not None:
+            self.rules.add(rule_id)
+        if "tags" in change:
+            replace_quest_tags(self.session, quest_id, change["tags"])
+        if values["completed"] and values["exp_amount"]:
+            self._add_exp(self.exp_deltas, (avatar_id, values["category_id"]), values["exp_amount"])
+        self._stamp("quests", quest_id, uid, change)
+        return "applied"
+
+    # Exp state of a local quest before the merge changes it
+    def _quest_exp(self, quest_id):
+        return (
+            self.session.query(Quest.avatar_id, Quest.category_id, Quest.completed, Quest.exp_amount,
+                               Quest.recurrence_id, Quest.deleted_at)
+            .filter(Quest.id == quest_id)
+            .first()
+        )
+
+    @staticmethod
+    def _add_exp(exp, key, amount):
+        exp[key] = exp.get(key, 0) + amount
+
+    # The exp rows follow the merged quests, a change only makes sure its category exists
+    def _merge_avatar_category(self, change):
+        if change["deleted"] or change["category_name"] in self.category_ids:
+            return "kept"
+        if change["avatar_uid"] not in self.avatar_ids:
+            return "skipped"
+        self._category_id(change["category_name"])
+        return "applied"
+
+    # Id of the rule of a recurring quest, from its uid
+    def _rule_id(self, template_uid):
+        if template_uid not in self.rule_ids:
+            self.rule_ids[template_uid] = (
+                self.session.query(QuestRecurrence.id)
+                .join(Quest, Quest.id == QuestRecurrence.quest_id)
+                .filter(Quest.uid == template_uid)
+                .scalar()
+            )
+        return self.rule_ids[template_uid]
+
+    # Id of a category, created with its exp rows when the other device has it and not this one
+    def _category_id(self, category_name):
+        category_id = self.category_ids.get(category_name)
+        if category_id is None:
+            category_id = self.session.execute(
+                Category.__table__.insert().values(category_name=category_name)
+            ).inserted_primary_key[0]
+            init_avatar_categories(self.session.connection())
+            self.category_ids[category_name] = category_id
+            self.categories_created = True
+        return category_id
+
+    # A row created again replaces the tombstone of its uid
+    def _drop_tombstone(self, table, uid):
+        self.session.query(SyncChange).filter(
+            SyncChange.table_name == table, SyncChange.uid == uid, SyncChange.deleted.is_(True)
+        ).delete(synchronize_session=False)
+
+    # Journal the merged row with the clock of the change instead of a local one, the clock of this
+    # device moves past it (Lamport). The version still moves on, so the row is sent to the other devices.
+    def _stamp(self, table, row_id, uid, change):
+        self.session.execute(text("UPDATE sync_state SET version = version + 1, clock = max(clock, :clock)"),
+                             {"clock": change["clock"]})
+        self.session.execute(text(
+            "INSERT OR REPLACE INTO sync_journal "
+            "(table_name, row_id, category_id, uid, deleted, version, clock, device_id) "
+            "SELECT :table_name, :row_id, 0, :uid, :deleted, version, :clock, :device_id FROM sync_state"
+        ), {
+            "table_name": table,
+            "row_id": row_id,
+            "uid": uid,
+            "deleted": bool(change["deleted"]),
+            "clock": change["clock"],
+            "device_id": change["device_id"],
+        })
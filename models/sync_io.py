@@ -0,0 +1,85 @@
+import json
+import zlib
+
+# Readers / writers of the sync deltas (DataManager.export_changes / import_changes): a header line
+# then one change per line, as JSON Lines or as the same lines deflated in a binary file
+BINARY_MAGIC = b"TQSYNC1\n"
+
+# Bytes read at once from a binary delta
+READ_SIZE = 64 * 1024
+
+
+def _dumps(record):
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+
+
+#write the header and the changes as one JSON object per line, returns the number of changes
+def write_jsonl(header, changes, file):
+    file.write(_dumps(header))
+    file.write("\n")
+    count = 0
+    for change in changes:
+        file.write(_dumps(change))
+        file.write("\n")
+        count += 1
+    return count
+
+
+#write the same lines deflated, in a file opened in binary mode
+def write_binary(header, changes, file):
+    compressor = zlib.compressobj(9)
+    file.write(BINARY_MAGIC)
+    file.write(compressor.compress(_dumps(header).encode() + b"\n"))
+    count = 0
+    for change in changes:
+        file.write(compressor.compress(_dumps(change).encode() + b"\n"))
+        count += 1
+    file.write(compressor.flush())
+    return count
+
+
+#read a JSON Lines delta, returns (header, generator of changes)
+def read_jsonl(file):
+    records = (json.loads(line) for line in file if line.strip())
+    header = next(records, None)
+    if header is None:
+        raise ValueError("Empty sync file")
+    return header, records
+
+
+def _inflate(file):
+    decompressor = zlib.decompressobj()
+    pending = b""
+    while True:
+        chunk = file.read(READ_SIZE)
+        data = pending + (decompressor.decompress(chunk) if chunk else decompressor.flush())
+        *lines, pending = data.split(b"\n")
+        for line in lines:
+            if line:
+                yield json.loads(line)
+        if not chunk:
+            return
+
+
+#read a binary delta, returns (header, generator of changes)
+def read_binary(file):
+    if file.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+        raise ValueError("Not a binary sync file")
+    records = _inflate(file)
+    header = next(records, None)
+    if header is None:
+        raise ValueError("Empty sync file")
+    return header, records
+
+
+# format -> (reader, writer, binary file)
+FORMATS = {
+    "jsonl": (read_jsonl, write_jsonl, False),
+    "binary": (read_binary, write_binary, True),
+}
+
+
+#guess the format from the file extension, binary unless it is a JSON one
+def format_from_path(path):
+    extension = path.rsplit(".", 1)[-1].lower() if "." in path else ""
+    return "jsonl" if extension in ("jsonl", "ndjson", "json") else "binary"
@@ -0,0 +1,144 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from models.data_manager import DataManager
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class WriteQueue:
+    """Runs DataManager writes on a single background thread, in submission order.
+
+    Every write returns a concurrent.futures.Future. When a callback is given it is
+    handed to `dispatch` with the result, so a UI can deliver it on its own thread
+    (the app passes a function using Clock.schedule_once). Toggles of a quest that
+    is already waiting in the queue are folded into the waiting write: an even
+    number of toggles writes nothing.
+    """
+
+    def __init__(self, data_manager=None, dispatch=None):
+        self.db = data_manager or DataManager()
+        self.dispatch = dispatch or (lambda deliver: deliver())
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._toggle_batch = None  # Quest id -> futures of the toggles not written yet, None when no batch is open
+        self._thread = threading.Thread(target=self._run, name="data-writer", daemon=True)
+        self._thread.start()
+
+    #queue a call of a DataManager method
+    def submit(self, method_name, *args, callback=None, **kwargs):
+        future = Future()
+        self._add_callback(future, callback)
+        with self._lock:
+            # The toggles submitted from now on are written after this call
+            self._toggle_batch = None
+            self._queue.put((future, getattr(self.db, method_name), args, kwargs))
+        return future
+
+    def add_quest(self, *args, callback=None, **kwargs):
+        return self.submit("add_quest", *args, callback=callback, **kwargs)
+
+    def add_recurring_quest(self, *args, callback=None, **kwargs):
+        return self.submit("add_recurring_quest", *args, callback=callback, **kwargs)
+
+    def remove_quest(self, quest_id, callback=None):
+        return self.submit("remove_quest", quest_id, callback=callback)
+
+    def remove_quests(self, quest_ids, callback=None):
+        return self.submit("remove_quests", quest_ids, callback=callback)
+
+    def restore_quests(self, quest_ids, callback=None):
+        return self.submit("restore_quests", quest_ids, callback=callback)
+
+    def complete_quests(self, quest_ids, callback=None):
+        return self.submit("complete_quests", quest_ids, callback=callback)
+
+    def update_avatar_name(self, avatar_id, new_name, callback=None):
+        return self.submit("update_avatar_name", avatar_id, new_name, callback=callback)
+
+    def set_quest_tags(self, quest_id, tag_names, callback=None):
+        return self.submit("set_quest_tags", quest_id, tag_names, callback=callback)
+
+    def add_tags(self, quest_ids, tag_names, callback=None):
+        return self.submit("add_tags", quest_ids, tag_names, callback=callback)
+
+    def remove_tags(self, quest_ids, tag_names, callback=None):
+        return self.submit("remove_tags", quest_ids, tag_names, callback=callback)
+
+    def create_category(self, category_name, callback=None):
+        return self.submit("create_category", category_name, callback=callback)
+
+    #queue a quest toggle, batched with the other toggles still waiting
+    def toggle_quest(self, quest_id, callback=None):
+        future = Future()
+        self._add_callback(future, callback)
+        with self._lock:
+            if self._toggle_batch is None:
+                self._toggle_batch = {}
+                self._queue.put((None, self._write_toggles, (self._toggle_batch,), {}))
+            self._toggle_batch.setdefault(quest_id, []).append(future)
+        return future
+
+    #queue toggles of several quests, returns one future per quest id
+    def toggle_quests(self, quest_ids):
+        return [self.toggle_quest(quest_id) for quest_id in quest_ids]
+
+    #wait for the queued writes, then stop the thread
+    def close(self, timeout=None):
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _add_callback(self, future, callback):
+        if callback is not None:
+            future.add_done_callback(
+                lambda done: self.dispatch(lambda: callback(done.result() if not done.exception() else None))
+            )
+
+    def _write_toggles(self, batch):
+        with self._lock:
+            # Close the batch, the next toggles open a new one
+            if self._toggle_batch is batch:
+                self._toggle_batch = None
+
+        # An even number of toggles of a quest cancels out, nothing to write for it
+        toggled_ids = [quest_id for quest_id, futures in batch.items() if len(futures) % 2]
+        unchanged_ids = [quest_id for quest_id, futures in batch.items() if not len(futures) % 2]
+        try:
+            toggled = self.db.toggle_quests(toggled_ids) if len(toggled_ids) > 1 else None
+            if toggled is None:
+                # A quest of the batch can't be toggled (or a single one): one transaction per quest,
+                # the failing ones get None like a direct toggle_quest call
+                toggled = [self.db.toggle_quest(quest_id) for quest_id in toggled_ids]
+            results = dict(zip(toggled_ids, toggled))
+            if unchanged_ids:
+                # Report the current state
+                for quest in self.db.get_quests_by_ids(unchanged_ids):
+                    results[quest["id"]] = {"id": quest["id"], "completed": quest["completed"], "exp_delta": 0}
+        except Exception as e:
+            logger.exception(f"Error in queued toggles of quests {list(batch)}: {e}")
+            for futures in batch.values():
+                for future in futures:
+                    future.set_exception(e)
+            return
+
+        for quest_id, futures in batch.items():
+            for future in futures:
+                future.set_result(results.get(quest_id))
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            if task is _STOP:
+                return
+            future, function, args, kwargs = task
+            if future is None:
+                function(*args, **kwargs)  # Resolves its own futures
+                continue
+            try:
+                future.set_result(function(*args, **kwargs))
+            except Exception as e:
+                logger.exception(f"Error in queued write '{function.__name__}': {e}")
+                future.set_exception(e)
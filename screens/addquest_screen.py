@@ -1,21 +1,41 @@
-from kivymd.uix.pickers import MDDatePicker
+import bisect
+import datetime
 from kivymd.uix.bottomnavigation import MDBottomNavigationItem
-from models import DataManager
+from models import DataManager, WriteQueue
+from models.recurrence import FREQUENCIES
 from kivymd.uix.scrollview import ScrollView
 from kivymd.uix.button import MDRaisedButton, MDIconButton
 from kivymd.uix.textfield import MDTextField
 from kivymd.uix.menu import MDDropdownMenu
 from kivy.uix.boxlayout import BoxLayout
+from .dispatch import schedule_on_main_thread
+
+# Categories listed at once in the category menu, typing in the field narrows the list
+CATEGORY_MENU_ITEMS = 30
 
 class AddQuestScreen(MDBottomNavigationItem):
-    def __init__(self, quest_screen, avatar_screen, **kwargs):
+    def __init__(self, quest_screen, avatar_screen, db=None, categories=None, writer=None, **kwargs):
         super().__init__(**kwargs)
         self.name = 'add'
         self.text = 'Add'
         self.quest_screen = quest_screen
         self.avatar_screen = avatar_screen
-        self.db = DataManager()
-
+        self.db = db or DataManager()
+        self.writer = writer or WriteQueue(self.db, dispatch=schedule_on_main_thread)
+        self.categories = categories
+        self.category_names = []  # Sorted names of self.categories, rebuilt when the categories change
+        self.category_keys = []  # Lowercase names, for the prefix search
+        self.built = False  # The widgets are built the first time the tab is shown
+
+    def on_pre_enter(self, *args):
+        super().on_pre_enter(*args)
+        self.build_screen()
+
+    # Build the widgets, once
+    def build_screen(self):
+        if self.built:
+            return
+        self.built = True
 
         ## ELEMENTS
         # Quest input field
@@ -28,9 +48,21 @@ class AddQuestScreen(MDBottomNavigationItem):
             hint_text='Select Date',
             readonly=True)
 
-        # Category input field
+        # Category input field, typing filters the menu or names a new category
         self.category_input = MDTextField(
             hint_text='Select Category',
+            multiline=False
+        )
+
+        # Tags input field
+        self.tags_input = MDTextField(
+            hint_text='Tags, separated by commas',
+            multiline=False
+        )
+
+        # Repeat input field, empty for a one-off quest
+        self.repeat_input = MDTextField(
+            hint_text='Repeat',
             readonly=True
         )
 
@@ -60,11 +92,23 @@ class AddQuestScreen(MDBottomNavigationItem):
         self.date_input.bind(focus=self.show_date_picker)
         self.layout.add_widget(self.date_input)
 
-        self.category_input.bind(focus=self.show_category_menu)
+        self.category_input.bind(focus=self.show_category_menu, text=self.on_category_text)
         self.layout.add_widget(self.category_input)
         self.category_menu = None # Initialize the category menu (but fill it dynamically later)
         self.populate_category_menu()  # Fetch categories from DB
 
+        self.repeat_input.bind(focus=self.show_repeat_menu)
+        self.layout.add_widget(self.repeat_input)
+        self.repeat_menu = MDDropdownMenu(
+            caller=self.repeat_input,
+            items=[{'text': 'never', 'on_release': lambda: self.set_repeat('')}] + [
+                {'text': frequency, 'on_release': lambda x=frequency: self.set_repeat(x)}
+                for frequency in FREQUENCIES
+            ],
+            width_mult=4
+        )
+
+        self.layout.add_widget(self.tags_input)
         self.layout.add_widget(self.exp_input)
 
         self.layout.add_widget(self.add_button)
@@ -75,40 +119,88 @@ class AddQuestScreen(MDBottomNavigationItem):
 
     ## LOGIC
     # Fetch categories and add them to the view
-    def populate_category_menu(self):
-        """Fetch categories from DB and populate dropdown."""
-        categories = self.db.get_categories()  # Fetch categories from DB
-
+    def populate_category_menu(self, prefix=""):
+        """Fill the dropdown with the categories starting with `prefix`, at most CATEGORY_MENU_ITEMS.
+
+        The names are sorted only when the categories change (they come from the DataManager
+        cache), a prefix is then found by bisection. The menu is created once, only its items
+        change. A typed name that is not a category gets a "New category" item.
+        """
+        categories = self.db.get_categories()
+        if categories != self.categories or not self.category_names:
+            self.categories = categories
+            self.category_names = sorted((category.category_name for category in categories), key=str.lower)
+            self.category_keys = [name.lower() for name in self.category_names]
+
+        typed = " ".join(prefix.split())
+        start = bisect.bisect_left(self.category_keys, typed.lower())
         menu_items = []
-        for category in categories:
+        for index in range(start, min(start + CATEGORY_MENU_ITEMS, len(self.category_keys))):
+            if not self.category_keys[index].startswith(typed.lower()):
+                break
             menu_items.append({
-                'text': category.category_name,  # Assuming Category model has a `name` attribute
-                'on_release': lambda x=category.category_name: self.set_category(x)
+                'text': self.category_names[index],
+                'on_release': lambda x=self.category_names[index]: self.set_category(x)
             })
-
-        # Initialize the category dropdown menu
-        self.category_menu = MDDropdownMenu(
-            caller=self.category_input,
-            items=menu_items,
-            width_mult=4
-        )
+        exists = start < len(self.category_keys) and self.category_keys[start] == typed.lower()
+        if typed and not exists:
+            menu_items.append({'text': f'New category "{typed}"', 'on_release': lambda: self.create_category(typed)})
+
+        if self.category_menu is None:
+            self.category_menu = MDDropdownMenu(
+                caller=self.category_input,
+                items=menu_items,
+                width_mult=4
+            )
+        else:
+            self.category_menu.items = menu_items
 
     # Open the category selection menu dynamically
     def show_category_menu(self, instance, value):
         if value:
-            if self.category_menu:
-                self.category_menu.open()
-            else:
-                print("Category menu is not initialized")
+            self.populate_category_menu(self.category_input.text)
+            self.category_menu.open()
+
+    # Narrow the menu to the typed prefix
+    def on_category_text(self, instance, text):
+        if not self.category_input.focus or text.lower() in self.category_keys:
+            return
+        self.populate_category_menu(text)
+        self.category_menu.dismiss()
+        self.category_menu.open()
 
     # Set the selected category in the input field and close the menu
     def set_category(self, category):
         self.category_input.text = category
         self.category_menu.dismiss()
 
+    # Create the typed category on the writer thread, then select it
+    def create_category(self, category_name):
+        self.category_menu.dismiss()
+        self.writer.create_category(
+            category_name, callback=lambda category_id: self.on_category_created(category_id, category_name)
+        )
+
+    def on_category_created(self, category_id, category_name):
+        if category_id is not None:
+            category_name = " ".join(category_name.split())
+            self.category_input.text = category_name
+            self.avatar_screen.add_category_row(category_name)
+
+    # Open the repeat selection menu
+    def show_repeat_menu(self, instance, value):
+        if value:
+            self.repeat_menu.open()
+
+    def set_repeat(self, frequency):
+        self.repeat_input.text = frequency
+        self.repeat_menu.dismiss()
+
     # Open date picker when the date input is focused
     def show_date_picker(self, instance, value):
         if value:
+            from kivymd.uix.pickers import MDDatePicker  # Heavy module, only needed when a date is picked
+
             date_dialog = MDDatePicker()
             date_dialog.bind(on_save=self.on_date_selected)
             date_dialog.open()
@@ -123,10 +215,22 @@ class AddQuestScreen(MDBottomNavigationItem):
         category_text = self.category_input.text if self.category_input.text else 'No category'
         date_text = self.date_input.text if self.date_input.text else None  # Use None if no date
         exp_amount = int(self.exp_input.text) if self.exp_input.text.isdigit() else 0
-
-        if quest_text:
-            # Save the quest in the database
-            self.db.add_quest(self.avatar_screen.avatar.id, quest_text, category_text, exp_amount, date_text)
-
-            # Refresh quest list dynamically
-            self.quest_screen.load_quests()
\ No newline at end of file
+        tags = [tag for tag in self.tags_input.text.split(",") if tag.strip()]
+
+        if quest_text and self.repeat_input.text:
+            # Only the rule is stored, the occurrences are generated when shown
+            self.writer.add_recurring_quest(
+                self.avatar_screen.avatar.id, quest_text, category_text, exp_amount,
+                date_text or datetime.date.today(), self.repeat_input.text, tags=tags,
+                callback=self.on_quest_added
+            )
+        elif quest_text:
+            # Save the quest in the database, then add it to the quest list
+            self.writer.add_quest(
+                self.avatar_screen.avatar.id, quest_text, category_text, exp_amount, date_text, tags=tags,
+                callback=self.on_quest_added
+            )
+
+    def on_quest_added(self, quest_id):
+        if quest_id is not None:
+            self.quest_screen.insert_quest(quest_id)
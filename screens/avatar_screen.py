@@ -1,26 +1,41 @@
 from kivymd.uix.label import MDLabel
 from kivymd.uix.progressbar import MDProgressBar
 from kivymd.uix.bottomnavigation import MDBottomNavigationItem
-from kivy.clock import Clock
-from models import DataManager
+from kivy.clock import Clock, mainthread
+from models import DataManager, WriteQueue, events, instrumentation
+from models.leveling import LevelProgress
 from kivy.uix.widget import Widget
 from kivymd.uix.scrollview import ScrollView
 from kivymd.uix.textfield import MDTextField
 from kivy.uix.boxlayout import BoxLayout
+from .dispatch import schedule_on_main_thread
 
 
 class AvatarScreen(MDBottomNavigationItem):
-    def __init__(self, **kwargs):
+    def __init__(self, db=None, avatar=None, categories=None, writer=None, **kwargs):
         super().__init__(**kwargs)
         self.name = 'avatar'
         self.text = 'Avatar'
-
+        self.built = False  # The widgets are built the first time the tab is shown
 
         # Data
-        self.db = DataManager()
-        self.avatar = self.db.get_avatar()
-        self.categories = self.db.get_categories()
-        self.category_experience = self.db.get_avatar_experience_by_category(self.avatar.id)
+        self.db = db or DataManager()
+        self.writer = writer or WriteQueue(self.db, dispatch=schedule_on_main_thread)
+        self.avatar = avatar or self.db.get_avatar()
+        self.categories = categories if categories is not None else self.db.get_categories()
+        events.subscribe(events.XP_CHANGED, self.on_xp_changed)
+
+    def on_pre_enter(self, *args):
+        super().on_pre_enter(*args)
+        self.build_screen()
+
+    # Build the widgets, once
+    @instrumentation.timed("AvatarScreen.build_screen")
+    def build_screen(self):
+        if self.built:
+            return
+        self.built = True
+        self.category_progress = self.db.get_avatar_progress_by_category(self.avatar.id)
 
 
         ## ELEMENTS
@@ -75,39 +90,54 @@ class AvatarScreen(MDBottomNavigationItem):
     # Create the categories widgets and progress bars
     def create_categories_UI(self):
         self.category_bars = {}
+        self.category_labels = {}
         for category in self.categories:
-            category_layout = BoxLayout(
-                orientation='horizontal',
-                size_hint_y=None,
-                height=40,
-                padding=20
-            )
-
-            category_label = MDLabel(
-                text=category.category_name.capitalize(),
-                halign='center',
-                size_hint_x=0.33
-            )
-            category_layout.add_widget(category_label)
-
-            exp_points = self.category_experience.get(category.category_name, 0)
-
-            progress_bar = MDProgressBar(
-                value=exp_points,
-                max=100,
-                size_hint_x=0.65,
-                size_hint_y=None,
-                height=10
-            )
-
-            progress_bar.pos_hint = {'center_y': 0.5}
-            category_layout.add_widget(progress_bar)
-            spacer = Widget(size_hint_x=0.25)  # Spacer
-            category_layout.add_widget(spacer)
-
-            # Add the category_layout to the main one of the view
-            self.layout.add_widget(category_layout)
-            self.category_bars[category] = progress_bar
+            self.add_category_row(category.category_name)
+
+    # Label and progress bar of one category
+    def add_category_row(self, category_name):
+        if not self.built or category_name in self.category_bars:
+            return  # A category created before the tab is shown is loaded with the others
+        category_layout = BoxLayout(
+            orientation='horizontal',
+            size_hint_y=None,
+            height=40,
+            padding=20
+        )
+
+        category_label = MDLabel(
+            text=category_name.capitalize(),
+            halign='center',
+            size_hint_x=0.33
+        )
+        category_layout.add_widget(category_label)
+
+        progress_bar = MDProgressBar(
+            size_hint_x=0.65,
+            size_hint_y=None,
+            height=10
+        )
+
+        progress_bar.pos_hint = {'center_y': 0.5}
+        category_layout.add_widget(progress_bar)
+        spacer = Widget(size_hint_x=0.25)  # Spacer
+        category_layout.add_widget(spacer)
+
+        # Add the category_layout to the main one of the view
+        self.layout.add_widget(category_layout)
+        self.category_bars[category_name] = progress_bar
+        self.category_labels[category_name] = category_label
+        self.show_category_progress(category_name, self.category_progress.get(category_name))
+
+    # Show the level of a category and the exp earned inside that level
+    def show_category_progress(self, category_name, progress):
+        if progress is None:
+            progress = self.db.level_curve.progress(0)
+        self.category_progress[category_name] = progress
+        self.category_labels[category_name].text = f"{category_name.capitalize()} (Lv {progress.level})"
+        progress_bar = self.category_bars[category_name]
+        progress_bar.max = progress.needed
+        progress_bar.value = progress.progress
 
     # Detect double tap and switch to text field for editing
     def on_name_double_tap(self, instance, touch):
@@ -147,12 +177,14 @@ class AvatarScreen(MDBottomNavigationItem):
         if not value:  # Focus lost
             new_name = instance.text.strip()
             if new_name and new_name != self.avatar.name:
-                # Update the DB
-                success = self.db.update_avatar_name(self.avatar.id, new_name)
-                if success:
-                    # Update internal data and refresh UI
-                    self.avatar.name = new_name
-                    self.avatar_label.text = new_name
+                # Update the UI now and the DB in the background, restore the old name if it fails
+                old_name = self.avatar.name
+                self.avatar = self.avatar._replace(name=new_name)
+                self.avatar_label.text = new_name
+                self.writer.update_avatar_name(
+                    self.avatar.id, new_name,
+                    callback=lambda success: self.on_avatar_name_saved(success, old_name)
+                )
 
             # Remove the text field and re-add the label
             self.name_box.remove_widget(self.name_edit)
@@ -160,43 +192,19 @@ class AvatarScreen(MDBottomNavigationItem):
             # Optionally, force a UI refresh:
             Clock.schedule_once(lambda dt: self.avatar_label.canvas.ask_update())
 
-    # Refreshes the avatar view UI properly
-    def refresh_avatar_view(self):
-        self.avatar = self.db.get_avatar()
-
-        # Update the actual UI elements, not just internal variables
-        self.avatar_label.text = f"{self.avatar.name}"
-        self.level_label.text = f"Level : {self.avatar.level}"
-
-        # Fetch the updated category experience
-        self.category_experience = self.db.get_avatar_experience_by_category(self.avatar.id)
-        # Ensure the progress bars update
-        for category in self.categories:
-            category_name = category.category_name  # Extract name for comparison
-            exp_points = float(self.category_experience.get(category_name, 0))
-            print(f"Category name = {category_name}")
-            print(f"exp_point = {exp_points}")
-
-            # Find the correct progress bar using category name
-            progress_bar = None
-            for cat, bar in self.category_bars.items():
-                if cat.category_name == category_name:
-                    progress_bar = bar
-                    break
-
-            if progress_bar:
-                category_layout = progress_bar.parent  # Get the parent layout
-                category_layout.remove_widget(progress_bar)  # Remove old progress bar
-
-                # Create a new progress bar
-                new_bar = MDProgressBar(
-                    value=exp_points,
-                    max=100,
-                    size_hint_x=0.6,
-                    size_hint_y=None,
-                    height=10
-                )
-                new_bar.pos_hint = {'center_y': 0.5}
-
-                category_layout.add_widget(new_bar)  # Add new progress bar
-                self.category_bars[category] = new_bar  # Update reference
+    def on_avatar_name_saved(self, success, old_name):
+        if not success:
+            self.avatar = self.avatar._replace(name=old_name)
+            self.avatar_label.text = old_name
+
+    # Move the bar of a category when a quest completion changes its exp, no database round-trip
+    # (published from the writer thread, so delivered on the main thread)
+    @mainthread
+    def on_xp_changed(self, avatar_id, category_name, avatar_level, avatar_experience, **kwargs):
+        if not self.built or avatar_id != self.avatar.id:
+            return
+        self.avatar = self.avatar._replace(level=avatar_level, experience=avatar_experience)
+        self.level_label.text = f"Level : {avatar_level}"
+        if category_name in self.category_bars:
+            progress = LevelProgress(kwargs["category_level"], kwargs["category_progress"], kwargs["category_needed"])
+            self.show_category_progress(category_name, progress)
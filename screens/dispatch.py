@@ -0,0 +1,6 @@
+from kivy.clock import Clock
+
+
+# Deliver a callback of a background task on the Kivy main thread, on the next frame
+def schedule_on_main_thread(deliver):
+    Clock.schedule_once(lambda dt: deliver())
@@ -0,0 +1,52 @@
+from kivy.properties import BooleanProperty, NumericProperty, ObjectProperty
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from kivy.utils import get_color_from_hex
+from kivymd.uix.list import TwoLineAvatarIconListItem, IconLeftWidget, IconRightWidget
+
+COMPLETED_COLOR = get_color_from_hex("#4CAF50")
+PENDING_COLOR = get_color_from_hex("#000000")
+SELECTED_COLOR = get_color_from_hex("#E0E0E0")
+
+
+class QuestListItem(RecycleDataViewBehavior, TwoLineAvatarIconListItem):
+    """Quest row reused by the RecycleView of the quest list.
+
+    Only the rows that are visible are instantiated; the RecycleView assigns
+    the data of the quest it currently shows to one of them when scrolling.
+    """
+    quest_id = NumericProperty(0)
+    completed = BooleanProperty(False)
+    selected = BooleanProperty(False)
+    quest_screen = ObjectProperty(None, allownone=True)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+        # Validate Button
+        self.validate_icon = IconLeftWidget(
+            icon="check-circle",
+            theme_text_color="Custom",
+            text_color=COMPLETED_COLOR if self.completed else PENDING_COLOR,
+            on_release=self.on_validate
+        )
+        self.add_widget(self.validate_icon)
+
+        # Delete Button
+        self.delete_icon = IconRightWidget(icon="trash-can", on_release=self.on_delete)
+        self.add_widget(self.delete_icon)
+
+    def on_completed(self, instance, value):
+        if hasattr(self, "validate_icon"):
+            self.validate_icon.text_color = COMPLETED_COLOR if value else PENDING_COLOR
+
+    def on_selected(self, instance, value):
+        self.bg_color = SELECTED_COLOR if value else (0, 0, 0, 0)
+
+    def on_release(self):
+        self.quest_screen.on_row_release(self.quest_id)
+
+    def on_validate(self, widget):
+        self.quest_screen.toggle_validate_quest(widget, self.quest_id)
+
+    def on_delete(self, widget):
+        self.quest_screen.delete_quest(self.quest_id)
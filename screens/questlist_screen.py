@@ -1,25 +1,75 @@
 from kivymd.uix.bottomnavigation import MDBottomNavigationItem
-from models import DataManager
-from kivymd.uix.list import TwoLineAvatarIconListItem, MDList, IconLeftWidget, IconRightWidget
-from kivymd.uix.scrollview import ScrollView
-from kivymd.uix.dialog import MDDialog
-from kivymd.uix.button import MDRaisedButton, MDIconButton
+from models import DataManager, WriteQueue, QUEST_PAGE_SIZE, instrumentation
+from kivymd.uix.button import MDRaisedButton, MDIconButton, MDFlatButton
+from kivymd.uix.label import MDLabel
 from kivymd.uix.textfield import MDTextField
 from kivymd.uix.menu import MDDropdownMenu
-from kivy.utils import get_color_from_hex
 from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.clock import Clock
+from kivy.metrics import dp
+from .quest_list_item import QuestListItem
+from .dispatch import schedule_on_main_thread
+
+# Delay between the last keystroke and the search query
+SEARCH_DELAY = 0.25
+
+# Setting storing the selected sort, "-" prefix for descending order
+SORT_SETTING = "quest_sort"
+
+# Setting storing the selected due date filter (an agenda range of DataManager, empty for all quests)
+FILTER_SETTING = "quest_filter"
+AGENDA_FILTERS = {"overdue": "Overdue", "today": "Due today", "upcoming": "Next 7 days"}
+
+# Setting storing the selected tags, comma separated: the list shows the quests carrying all of them
+TAG_FILTER_SETTING = "quest_tag_filter"
+
+# Seconds the undo bar stays visible after a delete
+UNDO_DELAY = 5
+
+# Fetch the next page when the list is scrolled this close to its end (0 = bottom)
+NEXT_PAGE_THRESHOLD = 0.1
 
 class QuestScreen(MDBottomNavigationItem):
-    def __init__(self, avatar_screen, **kwargs):
+    def __init__(self, avatar_screen, db=None, avatar=None, writer=None, **kwargs):
         super().__init__(**kwargs)
         self.name = 'quests'
         self.text = 'All Quests'
         self.avatar_screen = avatar_screen
+        self.built = False  # The widgets are built the first time the tab is shown
 
         # Data
-        self.db = DataManager()
-        self.avatar = self.db.get_avatar()
+        self.db = db or DataManager()
+        self.writer = writer or WriteQueue(self.db, dispatch=schedule_on_main_thread)
+        self.avatar = avatar or self.db.get_avatar()
         self.quests = []
+        self.quest_rows = {}  # Quest id -> index of its row in self.quests and the RecycleView data
+        self.pending_toggles = {}  # Quest id -> toggles sent to the writer and not confirmed yet
+        self.has_more_quests = False
+        self.next_cursor = None  # Keyset cursor of the next page of quests
+        self.search_ids = None  # Ranked ids of the current search, fetched page by page
+        self.search_offset = 0
+        self.selected_ids = set()  # Quests picked in selection mode
+        self.deleted_ids = []  # Quests of the last delete, until the undo bar is hidden
+
+    def on_pre_enter(self, *args):
+        super().on_pre_enter(*args)
+        self.build_screen()
+
+    # Build the widgets and load the first page of quests, once
+    @instrumentation.timed("QuestScreen.build_screen")
+    def build_screen(self):
+        if self.built:
+            return
+        self.built = True
+
+        # Sorting, restored from the last session
+        saved_sort = self.db.get_setting(SORT_SETTING, "id")
+        self.sort_descending = saved_sort.startswith("-")
+        self.sort_key = saved_sort.lstrip("-")
+        self.due_filter = self.db.get_setting(FILTER_SETTING, "") or None
+        self.tag_filter = [tag for tag in self.db.get_setting(TAG_FILTER_SETTING, "").split(",") if tag]
 
         # Layout
         self.layout = BoxLayout(orientation='vertical', padding=20, spacing=10)
@@ -33,20 +83,49 @@ class QuestScreen(MDBottomNavigationItem):
             height= "15dp"
 
         )
-        self.search_field.bind(text=self.load_quests)
+        self.search_trigger = Clock.create_trigger(self.load_quests, SEARCH_DELAY)
+        self.search_field.bind(text=lambda *args: self.search_trigger())
 
         # Top Bar
         self.sort_button = MDIconButton(icon="sort", on_release=self.open_sort_menu, size_hint=(None, None),pos_hint={'center_x': 0.5, 'center_y': 0.5 })
         self.top_bar = BoxLayout(size_hint_y=None, height=50)
         self.top_bar.add_widget(self.search_field)
+        self.filter_button = MDIconButton(icon="calendar", on_release=self.open_filter_menu, size_hint=(None, None),pos_hint={'center_x': 0.5, 'center_y': 0.5 })
+        self.tag_button = MDIconButton(icon="tag-multiple", on_release=self.open_tag_menu, size_hint=(None, None),pos_hint={'center_x': 0.5, 'center_y': 0.5 })
+        self.select_button = MDIconButton(icon="checkbox-multiple-marked-outline", on_release=self.toggle_selection_mode, size_hint=(None, None),pos_hint={'center_x': 0.5, 'center_y': 0.5 })
         self.top_bar.add_widget(self.sort_button)
+        self.top_bar.add_widget(self.filter_button)
+        self.top_bar.add_widget(self.tag_button)
+        self.top_bar.add_widget(self.select_button)
         self.layout.add_widget(self.top_bar)
 
-        # Scrollable List
-        self.scroll_view = ScrollView()
-        self.list_container = MDList()
-        self.scroll_view.add_widget(self.list_container)
-        self.layout.add_widget(self.scroll_view)
+        # Actions on the selected quests, shown in selection mode
+        self.selecting = False
+        self.selection_label = MDLabel(text="0 selected")
+        self.selection_bar = BoxLayout(size_hint_y=None, height=50, spacing=10)
+        self.selection_bar.add_widget(self.selection_label)
+        self.selection_bar.add_widget(MDRaisedButton(text="Complete", on_release=lambda x: self.complete_selected()))
+        self.selection_bar.add_widget(MDRaisedButton(text="Delete", on_release=lambda x: self.confirm_delete_selected()))
+
+        # Undo of the last delete, shown for UNDO_DELAY seconds
+        self.undo_label = MDLabel(text="")
+        self.undo_bar = BoxLayout(size_hint_y=None, height=50, spacing=10)
+        self.undo_bar.add_widget(self.undo_label)
+        self.undo_bar.add_widget(MDFlatButton(text="UNDO", on_release=lambda x: self.undo_delete()))
+        self.hide_undo_trigger = Clock.create_trigger(self.hide_undo_bar, UNDO_DELAY)
+
+        # Scrollable List, only the visible rows are instantiated
+        self.list_view = RecycleView(viewclass=QuestListItem)
+        self.list_container = RecycleBoxLayout(
+            orientation='vertical',
+            size_hint_y=None,
+            default_size=(None, dp(72)),
+            default_size_hint=(1, None)
+        )
+        self.list_container.bind(minimum_height=self.list_container.setter('height'))
+        self.list_view.add_widget(self.list_container)
+        self.list_view.bind(scroll_y=self.on_list_scroll)
+        self.layout.add_widget(self.list_view)
         self.add_widget(self.layout)
 
         # Sorting Menu
@@ -55,86 +134,385 @@ class QuestScreen(MDBottomNavigationItem):
             items=[
                 {"text": "Sort by Due Date", "on_release": lambda: self.sort_quests("due_date")},
                 {"text": "Sort by Experience", "on_release": lambda: self.sort_quests("exp_amount")},
+                {"text": "Sort by Name", "on_release": lambda: self.sort_quests("quest_name")},
+            ],
+            width_mult=4,
+        )
+
+        # Due date filter menu, only the open quests of the selected range are fetched
+        self.filter_menu = MDDropdownMenu(
+            caller=self.filter_button,
+            items=[{"text": "All quests", "on_release": lambda: self.filter_quests(None)}] + [
+                {"text": label, "on_release": lambda x=name: self.filter_quests(x)}
+                for name, label in AGENDA_FILTERS.items()
             ],
             width_mult=4,
         )
 
+        # Tag filter menu, its items are the avatar's tags when it is opened
+        self.tag_menu = MDDropdownMenu(caller=self.tag_button, items=[], width_mult=4)
+
         # Load data
         self.load_quests()
 
-    # Fetch quests from the database and populate the list
+    # Fetch the first page of quests from the database and populate the list
+    @instrumentation.timed("QuestScreen.load_quests")
     def load_quests(self, *args):
-        self.list_container.clear_widgets()  # Clear existing list items
-        search_text = self.search_field.text.lower()
-        self.quests = self.db.get_avatar_quests(self.avatar)  # Fetch quests
+        search_text = self.search_field.text.strip()
+        self.quests = []
+        self.quest_rows = {}
+        self.next_cursor = None
+        self.search_ids = None
+        self.search_offset = 0
 
-        filtered_quests = [
-            q for q in self.quests
-            if search_text in q['quest_name'].lower() or search_text in q['category_name'].lower()
-        ]
+        if search_text:
+            # Only the quests matched by the search index, in ranked order
+            self.search_ids = self.db.search_quest_ids(self.avatar.id, search_text, tags=self.tag_filter or None)
 
-        for quest in filtered_quests:
-            quest_id = quest["id"]
-            completed = quest.get("completed", False)
+        self.list_view.data = []
+        self.load_next_page()
+        self.list_view.scroll_y = 1
 
-            quest_item = TwoLineAvatarIconListItem(
-                text=quest['quest_name'],
-                secondary_text=f"[size=14sp]{quest['category_name']} | {quest['due_date']} | {quest['exp_amount']} XP[/size]"
+    # Append the next page of quests to the list
+    @instrumentation.timed("QuestScreen.load_next_page")
+    def load_next_page(self):
+        if self.search_ids is not None:
+            page_ids = self.search_ids[self.search_offset:self.search_offset + QUEST_PAGE_SIZE]
+            self.search_offset += len(page_ids)
+            page = self.db.get_quests_by_ids(page_ids)
+            has_more = self.search_offset < len(self.search_ids)
+        else:
+            page, self.next_cursor = self.db.get_avatar_quests_page(
+                self.avatar.id,
+                self.next_cursor,
+                sort_key=self.sort_key,
+                descending=self.sort_descending,
+                **self.filter_arguments()
             )
+            has_more = self.next_cursor is not None
 
-            # Validate Button
-            validate_icon = IconLeftWidget(
-                icon="check-circle",
-                theme_text_color="Custom",
-                text_color=get_color_from_hex("#4CAF50") if completed else get_color_from_hex("#000000"),
-                on_release=lambda x, qid=quest_id: self.toggle_validate_quest(x, qid)
-            )
-            quest_item.add_widget(validate_icon)
+        self.attach_tags(page)
+        self.has_more_quests = has_more
+        for index, quest in enumerate(page, start=len(self.quests)):
+            self.quest_rows[quest["id"]] = index
+        self.quests.extend(page)
+        self.list_view.data.extend([self.quest_row_data(quest) for quest in page])
 
-            # Delete Button
-            delete_icon = IconRightWidget(icon="trash-can",
-                                          on_release=lambda x, qid=quest_id: self.confirm_delete_quest(qid))
-            quest_item.add_widget(delete_icon)
+    # Query filters of the selected due date range and tags
+    def filter_arguments(self):
+        arguments = {}
+        if self.due_filter is not None:
+            arguments.update(due_range=self.db.agenda_range(self.due_filter), completed=False)
+        if self.tag_filter:
+            arguments["tags"] = self.tag_filter
+        return arguments
 
-            self.list_container.add_widget(quest_item)
+    # Add the tags of quests to their dicts, one query per page
+    def attach_tags(self, quests):
+        tags = self.db.get_quest_tags([quest["id"] for quest in quests])
+        for quest in quests:
+            quest["tags"] = tags.get(quest["id"], [])
+
+    # Fetch more quests when the user scrolls near the end of the loaded ones
+    def on_list_scroll(self, instance, scroll_y):
+        if scroll_y <= NEXT_PAGE_THRESHOLD and self.has_more_quests:
+            self.load_next_page()
+
+    # Data of one RecycleView row
+    def quest_row_data(self, quest):
+        tags = "".join(f" #{tag}" for tag in quest.get("tags", ()))
+        return {
+            "text": quest['quest_name'],
+            "secondary_text": f"[size=14sp]{quest['category_name']} | {quest['due_date']} | {quest['exp_amount']} XP{tags}[/size]",
+            "quest_id": quest["id"],
+            "completed": bool(quest.get("completed", False)),
+            "selected": quest["id"] in self.selected_ids,
+            "quest_screen": self,
+        }
 
     # Toggle quest validation status
     def toggle_validate_quest(self, widget, quest_id):
-        self.db.swap_quest_status(quest_id)
-        self.db.update_experience(quest_id)
-        self.avatar_screen.refresh_avatar_view()
+        # Flip the row right away, the write runs on the writer thread
+        index = self.quest_rows.get(quest_id)
+        if index is not None:
+            self.quests[index]["completed"] = not self.quests[index]["completed"]
+            self.update_row(index)
 
-        # Toggle button color
-        widget.text_color = get_color_from_hex("#000000") if widget.text_color == get_color_from_hex(
-            "#4CAF50") else get_color_from_hex("#4CAF50")
+        # The avatar screen is notified through events.XP_CHANGED
+        self.pending_toggles[quest_id] = self.pending_toggles.get(quest_id, 0) + 1
+        self.writer.toggle_quest(quest_id, callback=lambda result: self.on_quest_toggled(quest_id, result))
 
-        self.load_quests()
+    # Confirm the row state once the last pending toggle of the quest is written
+    def on_quest_toggled(self, quest_id, result):
+        self.pending_toggles[quest_id] -= 1
+        if self.pending_toggles[quest_id]:
+            return
+        del self.pending_toggles[quest_id]
+
+        index = self.quest_rows.get(quest_id)
+        if index is None:
+            return
+        if result is None:
+            # The write failed, show the stored state again
+            quests = self.db.get_quests_by_ids([quest_id])
+            if not quests:
+                return
+            result = quests[0]
+        quest = self.quests[index]
+        # A recurring quest stays open and moves to its next occurrence
+        due_date = result.get("due_date", quest["due_date"])
+        if quest["completed"] != result["completed"] or quest["due_date"] != due_date:
+            quest["completed"] = result["completed"]
+            quest["due_date"] = due_date
+            self.update_row(index)
+
+    # Re-render a single row, the RecycleView only refreshes the view showing it
+    def update_row(self, index):
+        self.list_view.data[index] = self.quest_row_data(self.quests[index])
+
+    # Add a newly created quest to the list at its sorted position
+    def insert_quest(self, quest_id):
+        self.insert_quests([quest_id])
+
+    # Add quests (new or restored) to the list at their sorted positions, fetched with one query
+    def insert_quests(self, quest_ids):
+        if not self.built:
+            return  # Loaded with the others when the tab is first shown
+        if self.search_ids is not None:
+            self.load_quests()  # Their rank in the search results is unknown
+            return
+
+        quests = self.db.get_quests_by_ids(list(quest_ids))
+        self.attach_tags(quests)
+        for quest in quests:
+            if quest["id"] in self.quest_rows or not self.matches_filter(quest):
+                continue
+            index = self.sorted_position(quest)
+            if index == len(self.quests) and self.has_more_quests:
+                continue  # It belongs to a page that is not loaded yet
+
+            self.quests.insert(index, quest)
+            self.list_view.data.insert(index, self.quest_row_data(quest))
+            self.reindex_rows(index)
+
+    # Remove the row of a quest from the list
+    def remove_quest_row(self, quest_id):
+        index = self.quest_rows.pop(quest_id, None)
+        if index is None:
+            return
+        del self.quests[index]
+        del self.list_view.data[index]
+        self.reindex_rows(index)
+
+    # Refresh the id -> index map of the rows from `start` on
+    def reindex_rows(self, start):
+        for index in range(start, len(self.quests)):
+            self.quest_rows[self.quests[index]["id"]] = index
 
-    # Show confirmation dialog before deleting a quest
-    def confirm_delete_quest(self, quest_id):
+    # True when the quest belongs to the selected due date range and carries the selected tags
+    def matches_filter(self, quest):
+        if not set(self.tag_filter).issubset(quest.get("tags", ())):
+            return False
+        if self.due_filter is None:
+            return True
+        if quest["completed"] or quest["due_date"] == "No date":
+            return False
+        start, end = self.db.agenda_range(self.due_filter)
+        due_date = quest["due_date"]  # ISO strings compare like dates
+        return (start is None or due_date >= start.isoformat()) and (end is None or due_date <= end.isoformat())
+
+    # Index of the first loaded quest that comes after `quest` in the current sort order
+    def sorted_position(self, quest):
+        key = self.sort_value(quest)
+        for index, loaded_quest in enumerate(self.quests):
+            loaded_key = self.sort_value(loaded_quest)
+            if self.sort_descending:
+                before = self.sorts_before(loaded_key, key)
+            else:
+                before = self.sorts_before(key, loaded_key)
+            if before:
+                return index
+        return len(self.quests)
+
+    def sort_value(self, quest):
+        value = quest[self.sort_key]
+        if self.sort_key == "due_date" and value == "No date":
+            value = None
+        return value, quest["id"]
+
+    # Ascending comparison of (value, id) keys, NULLs first like SQLite
+    @staticmethod
+    def sorts_before(key, other_key):
+        value, quest_id = key
+        other_value, other_id = other_key
+        if value == other_value:
+            return quest_id < other_id
+        if value is None:
+            return True
+        if other_value is None:
+            return False
+        return value < other_value
+
+    # Delete quests right away, they can be restored from the undo bar until it is hidden
+    def delete_quests(self, quest_ids):
+        quest_ids = list(quest_ids)
+        self.writer.remove_quests(quest_ids)  # Deleting a quest doesn't change the exp
+        for quest_id in quest_ids:
+            self.remove_quest_row(quest_id)
+
+        self.deleted_ids = quest_ids
+        self.undo_label.text = f"{len(quest_ids)} quest{'s' if len(quest_ids) > 1 else ''} deleted"
+        if self.undo_bar.parent is None:
+            self.layout.add_widget(self.undo_bar)
+        self.hide_undo_trigger.cancel()
+        self.hide_undo_trigger()
+
+    def delete_quest(self, quest_id):
+        """Remove quest and update UI."""
+        self.delete_quests([quest_id])
+
+    def undo_delete(self):
+        quest_ids = self.deleted_ids
+        self.hide_undo_bar()
+        if quest_ids:
+            # Queued after the delete, so it restores what the delete marked
+            self.writer.restore_quests(quest_ids, callback=lambda count: self.insert_quests(quest_ids))
+
+    def hide_undo_bar(self, *args):
+        self.hide_undo_trigger.cancel()
+        self.deleted_ids = []
+        if self.undo_bar.parent is not None:
+            self.layout.remove_widget(self.undo_bar)
+
+    # Selection mode: tapping a row selects it, the selection bar acts on every selected quest
+    def toggle_selection_mode(self, *args):
+        self.selecting = not self.selecting
+        if self.selecting:
+            self.layout.add_widget(self.selection_bar)
+        else:
+            self.layout.remove_widget(self.selection_bar)
+            self.clear_selection()
+        self.update_selection_label()
+
+    def on_row_release(self, quest_id):
+        if not self.selecting:
+            return
+        if quest_id in self.selected_ids:
+            self.selected_ids.discard(quest_id)
+        else:
+            self.selected_ids.add(quest_id)
+        index = self.quest_rows.get(quest_id)
+        if index is not None:
+            self.update_row(index)
+        self.update_selection_label()
+
+    def clear_selection(self):
+        selected_ids, self.selected_ids = self.selected_ids, set()
+        for quest_id in selected_ids:
+            index = self.quest_rows.get(quest_id)
+            if index is not None:
+                self.update_row(index)
+
+    def update_selection_label(self):
+        self.selection_label.text = f"{len(self.selected_ids)} selected"
+
+    # Show confirmation dialog before deleting the selected quests, a single row relies on the undo bar
+    def confirm_delete_selected(self):
+        if not self.selected_ids:
+            return
+        from kivymd.uix.dialog import MDDialog
+
+        count = len(self.selected_ids)
         self.dialog = MDDialog(
-            title="Delete Quest?",
-            text="Are you sure you want to delete this quest?",
+            title=f"Delete {count} quest{'s' if count > 1 else ''}?",
+            text="Are you sure you want to delete the selected quests?",
             buttons=[
                 MDRaisedButton(text="Cancel", on_release=lambda x: self.dialog.dismiss()),
-                MDRaisedButton(text="Delete", on_release=lambda x: self.delete_quest(quest_id)),
+                MDRaisedButton(text="Delete", on_release=lambda x: self.delete_selected()),
             ],
         )
         self.dialog.open()
 
-    def delete_quest(self, quest_id):
-        """Remove quest and update UI."""
-        self.db.remove_quest(quest_id)
-        self.avatar_screen.refresh_avatar_view()
-        self.load_quests()
+    def delete_selected(self):
         self.dialog.dismiss()
+        quest_ids = list(self.selected_ids)
+        self.selected_ids = set()
+        self.update_selection_label()
+        if quest_ids:
+            self.delete_quests(quest_ids)
+
+    # Complete the selected quests with one batch write
+    def complete_selected(self):
+        quest_ids = [quest_id for quest_id in self.selected_ids if quest_id in self.quest_rows]
+        self.clear_selection()
+        self.update_selection_label()
+        for quest_id in quest_ids:
+            index = self.quest_rows[quest_id]
+            if not self.quests[index]["completed"]:
+                self.quests[index]["completed"] = True
+                self.update_row(index)
+        if quest_ids:
+            self.writer.complete_quests(quest_ids, callback=lambda states: self.on_quests_completed(quest_ids, states))
+
+    # Show the stored state of the completed quests (recurring quests stay open with a new due date)
+    def on_quests_completed(self, quest_ids, states):
+        if states is None:
+            # The write failed, show the stored state again
+            states = self.db.get_quests_by_ids(quest_ids)
+        for state in states:
+            index = self.quest_rows.get(state["id"])
+            if index is None:
+                continue
+            quest = self.quests[index]
+            if quest["completed"] != state["completed"] or quest["due_date"] != state["due_date"]:
+                quest["completed"] = state["completed"]
+                quest["due_date"] = state["due_date"]
+                self.update_row(index)
 
     def open_sort_menu(self, instance):
         """Open the sorting dropdown menu."""
         self.sort_menu.open()
 
-    def sort_quests(self, key):
-        """Sort quests based on the selected key."""
-        self.quests.sort(key=lambda x: x[key])
+    def open_filter_menu(self, instance):
+        self.filter_menu.open()
+
+    # List the avatar's tags, the selected ones checked
+    def open_tag_menu(self, instance):
+        tags = self.db.get_tags(self.avatar.id, with_counts=False) or []
+        self.tag_menu.items = [{"text": "All tags", "on_release": lambda: self.filter_tags(None)}] + [
+            {"text": f"{'✓ ' if tag.name in self.tag_filter else ''}#{tag.name}",
+             "on_release": lambda x=tag.name: self.filter_tags(x)}
+            for tag in tags
+        ]
+        self.tag_menu.open()
+
+    def filter_tags(self, tag):
+        """Select or unselect a tag of the filter, None clears it."""
+        if tag is None:
+            self.tag_filter = []
+        elif tag in self.tag_filter:
+            self.tag_filter.remove(tag)
+        else:
+            self.tag_filter.append(tag)
+        self.db.set_setting(TAG_FILTER_SETTING, ",".join(self.tag_filter))
+        self.load_quests()
+        self.tag_menu.dismiss()
+
+    def filter_quests(self, name):
+        """Show the open quests of an agenda range, or every quest when `name` is None."""
+        self.due_filter = name
+        self.db.set_setting(FILTER_SETTING, name or "")
         self.load_quests()
+        self.filter_menu.dismiss()
+
+    def sort_quests(self, key):
+        """Sort quests based on the selected key, selecting the same key again reverses the order."""
+        if key == self.sort_key:
+            self.sort_descending = not self.sort_descending
+        else:
+            self.sort_key = key
+            self.sort_descending = False
+        self.db.set_setting(SORT_SETTING, f"-{key}" if self.sort_descending else key)
+
+        self.load_quests()  # The database returns the quests in the new order
         self.sort_menu.dismiss()
@@ -0,0 +1,441 @@
+"""Headless HTTP/JSON API over the DataManager, for scripts and other clients. No Kivy involved.
+
+    python server.py --port 8765
+    curl localhost:8765/avatars/current
+    curl -X POST localhost:8765/quests/12/toggle
+    curl -X POST -d '{"ids": [12, 13, 14]}' localhost:8765/quests/toggle
+
+Reads run on a thread pool as large as the engine connection pool, so each one gets its own
+pooled SQLite connection (WAL lets them run next to the writer). Writes go through the
+WriteQueue: a single writer thread, toggles batched into one transaction.
+Listens on a loopback address only (unless --allow-remote), there is no authentication.
+"""
+import argparse
+import asyncio
+import datetime
+import ipaddress
+import json
+import logging
+import re
+import signal
+import sys
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qsl
+from models import database as db
+from models import DataManager, WriteQueue, QUEST_PAGE_SIZE
+from models.repositories import QUEST_SORT_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# Largest page a client can ask for
+MAX_PAGE_SIZE = 500
+
+# Largest request body accepted (bytes)
+MAX_BODY_SIZE = 1024 * 1024
+
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Request:
+    __slots__ = ("method", "path", "query", "params", "body")
+
+    def __init__(self, method, path, query, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.params = {}
+        self.body = body
+
+    def int_param(self, name):
+        return int(self.params[name])
+
+    #query string value converted by `convert`, `default` when absent
+    def arg(self, name, convert=str, default=None):
+        if name not in self.query:
+            return default
+        try:
+            return convert(self.query[name])
+        except ValueError:
+            raise ApiError(400, f"Invalid value for '{name}': {self.query[name]!r}")
+
+    #page size asked with ?limit=, at most MAX_PAGE_SIZE
+    def limit(self):
+        limit = self.arg("limit", int, QUEST_PAGE_SIZE)
+        if limit < 1:
+            raise ApiError(400, f"Invalid value for 'limit': {limit}, expected at least 1")
+        return min(limit, MAX_PAGE_SIZE)
+
+    #id list of a batch request body: {"ids": [1, 2, 3]}
+    def ids(self):
+        ids = self.body.get("ids") if isinstance(self.body, dict) else None
+        if not isinstance(ids, list) or not all(type(quest_id) is int for quest_id in ids):
+            raise ApiError(400, "Expected a JSON body like {\"ids\": [1, 2, 3]}")
+        return ids
+
+
+def parse_bool(value):
+    if value.lower() in ("1", "true", "yes"):
+        return True
+    if value.lower() in ("0", "false", "no"):
+        return False
+    raise ValueError(value)
+
+
+# Comma separated tag names
+def parse_tags(value):
+    return [tag for tag in value.split(",") if tag.strip()]
+
+
+# JSON form of the values returned by the DataManager, json.dumps would write the records as lists
+def to_json(value):
+    if isinstance(value, dict):
+        return {key: to_json(item) for key, item in value.items()}
+    if isinstance(value, tuple) and hasattr(value, "_asdict"):
+        return to_json(value._asdict())  # AvatarRecord, CategoryRecord, TagRecord, LevelProgress
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+class ApiServer:
+    """Routes the requests to the DataManager, one instance per process."""
+
+    def __init__(self, data_manager=None, workers=None):
+        self.db = data_manager or DataManager()
+        self.writer = WriteQueue(self.db)
+        # One reader thread per pooled connection, more would only wait for a connection
+        self.readers = ThreadPoolExecutor(
+            max_workers=workers or db.load_engine_config().get("pool_size", 5), thread_name_prefix="api-reader"
+        )
+        # (method, path pattern, handler, True for the writes)
+        self.routes = [
+            ("GET", r"/health", self.health, False),
+            ("GET", r"/categories", self.list_categories, False),
+            ("GET", r"/avatars", self.list_avatars, False),
+            ("GET", r"/avatars/current", self.current_avatar, False),
+            ("GET", r"/avatars/(?P<avatar_id>\d+)", self.get_avatar, False),
+            ("GET", r"/avatars/(?P<avatar_id>\d+)/experience", self.get_experience, False),
+            ("GET", r"/avatars/(?P<avatar_id>\d+)/quests", self.list_quests, False),
+            ("GET", r"/avatars/(?P<avatar_id>\d+)/agenda", self.get_agenda, False),
+            ("GET", r"/avatars/(?P<avatar_id>\d+)/search", self.search_quests, False),
+            ("GET", r"/avatars/(?P<avatar_id>\d+)/tags", self.list_tags, False),
+            ("GET", r"/avatars/(?P<avatar_id>\d+)/history", self.get_history, False),
+            ("POST", r"/quests", self.add_quest, True),
+            ("POST", r"/quests/toggle", self.toggle_quests, True),
+            ("POST", r"/quests/complete", self.complete_quests, True),
+            ("POST", r"/quests/delete", self.remove_quests, True),
+            ("POST", r"/quests/restore", self.restore_quests, True),
+            ("POST", r"/quests/(?P<quest_id>\d+)/toggle", self.toggle_quest, True),
+            ("DELETE", r"/quests/(?P<quest_id>\d+)", self.remove_quest, True),
+        ]
+        self.routes = [(method, re.compile(pattern + "$"), handler, write)
+                       for method, pattern, handler, write in self.routes]
+
+    #run the handler of a request, returns (status, JSON-able value)
+    async def dispatch(self, request):
+        allowed = False
+        for method, pattern, handler, write in self.routes:
+            match = pattern.match(request.path)
+            if not match:
+                continue
+            if method != request.method:
+                allowed = True
+                continue
+            request.params = match.groupdict()
+            if write:
+                # Writes return futures of the WriteQueue, they don't block a reader thread
+                status, result = handler(request)
+                if isinstance(result, list):
+                    result = await asyncio.gather(*(asyncio.wrap_future(future) for future in result))
+                else:
+                    result = await asyncio.wrap_future(result)
+            else:
+                status, result = 200, await asyncio.get_running_loop().run_in_executor(self.readers, handler, request)
+            if result is None:
+                raise ApiError(400 if write else 404, "Not found or not applied, see the server log")
+            return status, result
+        if allowed:
+            raise ApiError(405, f"{request.method} not allowed on {request.path}")
+        raise ApiError(404, f"No route for {request.path}")
+
+    # Reads, run on the reader threads
+
+    def health(self, request):
+        return {"status": "ok"}
+
+    def list_categories(self, request):
+        return self.db.get_categories()
+
+    def list_avatars(self, request):
+        return self.db.list_avatars()
+
+    def current_avatar(self, request):
+        return self.db.get_avatar()
+
+    def get_avatar(self, request):
+        return self.db.get_avatar(request.int_param("avatar_id"))
+
+    def get_experience(self, request):
+        return self.db.get_avatar_progress_by_category(request.int_param("avatar_id"))
+
+    #one page of quests: ?limit=&sort=&descending=&completed=&due=overdue|today|upcoming&tags=a,b&after=<next_cursor>
+    def list_quests(self, request):
+        sort_key = request.arg("sort", default="id")
+        if sort_key not in QUEST_SORT_COLUMNS:
+            raise ApiError(400, f"Unknown sort '{sort_key}', expected one of {sorted(QUEST_SORT_COLUMNS)}")
+        after = request.arg("after", json.loads)
+        if after is not None:
+            if not isinstance(after, list) or len(after) != 2:
+                raise ApiError(400, "'after' must be the next_cursor of the previous page")
+            if sort_key == "due_date" and after[0] is not None:
+                try:
+                    after[0] = datetime.date.fromisoformat(after[0])
+                except (TypeError, ValueError):
+                    raise ApiError(400, f"Invalid due date in 'after': {after[0]!r}")
+        due = request.arg("due")
+        try:
+            due_range = self.db.agenda_range(due) if due else None
+        except ValueError as e:
+            raise ApiError(400, str(e))
+
+        quests, next_cursor = self.db.get_avatar_quests_page(
+            request.int_param("avatar_id"), after=after,
+            limit=request.limit(), sort_key=sort_key,
+            descending=request.arg("descending", parse_bool, False), due_range=due_range,
+            completed=request.arg("completed", parse_bool), tags=request.arg("tags", parse_tags)
+        )
+        return {"quests": quests, "next_cursor": next_cursor}
+
+    def get_agenda(self, request):
+        return self.db.get_agenda(request.int_param("avatar_id"), days=request.arg("days", int, 7))
+
+    def search_quests(self, request):
+        quest_ids = self.db.search_quest_ids(
+            request.int_param("avatar_id"), request.arg("q", default=""),
+            limit=request.limit(), tags=request.arg("tags", parse_tags)
+        )
+        return self.db.get_quests_by_ids(quest_ids)
+
+    def list_tags(self, request):
+        return self.db.get_tags(request.int_param("avatar_id"))
+
+    def get_history(self, request):
+        return self.db.get_xp_history(
+            request.int_param("avatar_id"), request.arg("period", default="day"),
+            request.arg("start", datetime.date.fromisoformat), request.arg("end", datetime.date.fromisoformat),
+            request.arg("category")
+        )
+
+    # Writes, queued on the writer thread: (status, future or list of futures)
+
+    # The body is checked here, nothing is queued for a quest the DataManager would store wrong
+    def add_quest(self, request):
+        quest = request.body if isinstance(request.body, dict) else {}
+        missing = [key for key in ("avatar_id", "title", "category_name", "exp_amount") if key not in quest]
+        if missing:
+            raise ApiError(400, f"Missing fields: {', '.join(missing)}")
+        for key, kind in (("avatar_id", int), ("exp_amount", int), ("title", str), ("category_name", str),
+                          ("due_date", str)):
+            # bool is an int too, it is refused like the ids of the batch requests; due_date can be null
+            if type(quest.get(key)) is not kind and not (key == "due_date" and quest.get(key) is None):
+                raise ApiError(400, f"'{key}' must be {'an integer' if kind is int else 'a string'}")
+        tags = quest.get("tags")
+        if tags is not None and (not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags)):
+            raise ApiError(400, "'tags' must be a list of strings")
+        if quest.get("due_date"):
+            try:
+                datetime.date.fromisoformat(quest["due_date"])
+            except ValueError:
+                raise ApiError(400, f"Invalid due date {quest['due_date']!r}, expected YYYY-MM-DD")
+        if self.db.get_avatar(quest["avatar_id"]) is None:
+            raise ApiError(404, f"Avatar {quest['avatar_id']} not found")
+        future = self.writer.add_quest(
+            quest["avatar_id"], quest["title"], quest["category_name"], quest["exp_amount"], quest.get("due_date"),
+            tags=quest.get("tags")
+        )
+        return 201, _chain(future, lambda quest_id: quest_id and {"id": quest_id})
+
+    def toggle_quest(self, request):
+        return 200, self.writer.toggle_quest(request.int_param("quest_id"))
+
+    # Every toggle waiting in the writer queue, from this request or concurrent ones, is one transaction
+    def toggle_quests(self, request):
+        return 200, self.writer.toggle_quests(request.ids())
+
+    def complete_quests(self, request):
+        return 200, self.writer.complete_quests(request.ids())
+
+    # {"removed": 0} when none of the quests could be deleted, an error (None) only when the write failed
+    def remove_quests(self, request):
+        return 200, _chain(self.writer.remove_quests(request.ids()),
+                           lambda count: None if count is None else {"removed": count})
+
+    def restore_quests(self, request):
+        return 200, _chain(self.writer.restore_quests(request.ids()),
+                           lambda count: None if count is None else {"restored": count})
+
+    def remove_quest(self, request):
+        return 200, _chain(self.writer.remove_quest(request.int_param("quest_id")),
+                           lambda removed: {"removed": 1} if removed else None)
+
+    def close(self):
+        self.writer.close()
+        self.readers.shutdown()
+
+
+# Future of `convert(result)` of a WriteQueue future
+def _chain(future, convert):
+    converted = Future()
+
+    def done(finished):
+        if finished.exception():
+            converted.set_exception(finished.exception())
+        else:
+            converted.set_result(convert(finished.result()))
+
+    future.add_done_callback(done)
+    return converted
+
+
+# True for the addresses only reachable from this machine
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+#read one request from a keep-alive connection, None when the client closed it
+async def read_request(reader):
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    try:
+        method, target, _ = request_line.decode("latin-1").split()
+    except ValueError:
+        raise ApiError(400, "Malformed request line")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise ApiError(400, "Invalid Content-Length header")
+    if length < 0:
+        raise ApiError(400, "Invalid Content-Length header")
+    if length > MAX_BODY_SIZE:
+        raise ApiError(413, f"Request body larger than {MAX_BODY_SIZE} bytes")
+    body = None
+    if length:
+        try:
+            body = json.loads(await reader.readexactly(length))
+        except ValueError:
+            raise ApiError(400, "The body is not valid JSON")
+
+    url = urlsplit(target)
+    request = Request(method.upper(), url.path.rstrip("/") or "/", dict(parse_qsl(url.query)), body)
+    keep_alive = headers.get("connection", "").lower() != "close"
+    return request, keep_alive
+
+
+def write_response(writer, status, value, keep_alive=True):
+    body = json.dumps(to_json(value)).encode()
+    writer.write(
+        f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+        f"Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + body
+    )
+
+
+async def handle_connection(api, reader, writer):
+    try:
+        while True:
+            keep_alive = True
+            try:
+                parsed = await read_request(reader)
+                if parsed is None:
+                    break
+                request, keep_alive = parsed
+                status, value = await api.dispatch(request)
+            except ApiError as e:
+                status, value = e.status, {"error": str(e)}
+                keep_alive = keep_alive and e.status < 500 and e.status != 413
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            except Exception as e:
+                logger.exception(f"❌ Error handling a request: {e}")
+                status, value, keep_alive = 500, {"error": "Internal error, see the server log"}, False
+            write_response(writer, status, value, keep_alive)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host, port, workers=None):
+    api = ApiServer(workers=workers)
+    server = await asyncio.start_server(lambda reader, writer: handle_connection(api, reader, writer), host, port)
+    print(f"Serving the quest API on http://{host}:{port}", file=sys.stderr, flush=True)
+
+    # Stop on Ctrl+C or SIGTERM after flushing the queued writes
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signal_number, stopping.set)
+        except NotImplementedError:
+            pass  # Windows: Ctrl+C raises KeyboardInterrupt instead
+    try:
+        async with server:
+            await stopping.wait()
+    finally:
+        api.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the quest database over a local HTTP/JSON API.")
+    parser.add_argument("--host", default="127.0.0.1", help="Loopback address to listen on")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, help="Reader threads, default: the connection pool size")
+    parser.add_argument("--allow-remote", action="store_true",
+                        help="Accept a non-loopback --host: anyone reaching it can read and change every quest")
+    args = parser.parse_args()
+
+    # The API has no authentication
+    if not is_loopback(args.host):
+        if not args.allow_remote:
+            parser.error(f"--host {args.host} is not a loopback address, the API has no authentication "
+                         f"(pass --allow-remote to listen on it anyway)")
+        print(f"⚠ WARNING: listening on {args.host} without authentication, anyone reaching it can read and "
+              f"change every quest", file=sys.stderr, flush=True)
+
+    db.setup_database()
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+import os
+import tempfile
+import pytest
+
+# The models bind the app engine at import time, keep it away from the app database
+os.environ.setdefault("TODO_APP_DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='todo-tests-'), 'app.db')}")
+
+from models.backends import SqlBackend  # noqa: E402
+from models.data_manager import DataManager  # noqa: E402
+
+
+# A DataManager on its own fresh database file, with the default avatar and categories
+@pytest.fixture
+def db(tmp_path):
+    backend = SqlBackend(f"sqlite:///{tmp_path / 'test.db'}")
+    backend.setup()
+    yield DataManager(backend=backend)
+    backend.dispose()
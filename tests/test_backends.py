@@ -0,0 +1,139 @@
+import datetime
+import pytest
+from sqlalchemy import event
+from models.backends import SqlBackend
+from models.data_manager import DataManager
+from models.memory_backend import MemoryBackend
+
+TODAY = datetime.date(2026, 3, 10)
+
+
+def make_backend(kind, tmp_path):
+    if kind == "memory":
+        backend = MemoryBackend()
+    elif kind == "write-through":
+        backend = MemoryBackend(backing=SqlBackend(f"sqlite:///{tmp_path / 'backing.db'}"))
+    else:
+        backend = SqlBackend(f"sqlite:///{tmp_path / 'test.db'}")
+    backend.setup()
+    return backend
+
+
+# The same writes on a fresh backend, returns what the reads give along the way
+def scenario(db):
+    avatar = db.get_avatar()
+    day = datetime.timedelta(days=1)
+    quest_ids = [
+        db.add_quest(avatar.id, "read a book", "wisdom", 10, (TODAY - day).isoformat(), tags=["Home"]),
+        db.add_quest(avatar.id, "call mom", "family", 5, TODAY.isoformat(), tags=["home", "phone"]),
+        db.add_quest(avatar.id, "run", "constitution", 20, (TODAY + 2 * day).isoformat()),
+        db.add_quest(avatar.id, "read the news", "wisdom", 3, tags=["phone"]),
+        db.add_quest(avatar.id, "journal", "reflexion", 8, (TODAY + 30 * day).isoformat()),
+    ]
+    recurring_id = db.add_recurring_quest(avatar.id, "stretch", "constitution", 2, TODAY, "daily", tags=["sport"])
+    reads = {"added": db.get_avatar_quests(avatar)}
+    db.bulk_add_quests([
+        {"avatar_id": avatar.id, "quest_name": "water plants", "category_name": "family", "exp_amount": 4,
+         "completed": True},
+        {"avatar_id": avatar.id, "quest_name": "lift weights", "category_name": "constitution", "exp_amount": 6},
+    ])
+    reads["bulk added"] = db.get_avatar_quests(avatar)
+
+    # Between two reads, the writes update the memory copy quest by quest
+    db.toggle_quest(quest_ids[0])
+    db.toggle_quests([quest_ids[1], recurring_id])
+    db.complete_quests([quest_ids[2], recurring_id])
+    db.uncomplete_occurrence(recurring_id, TODAY)
+    db.remove_quests([quest_ids[3]])
+    db.set_quest_tags(quest_ids[4], ["Errand", "home"])
+    db.add_tags(quest_ids[:3], ["daily"])
+    db.remove_tags([quest_ids[0]], ["home"])
+    reads["written"] = db.get_avatar_quests(avatar, sort_key="due_date"), db.get_tags()
+    # The category matches in id order, the recurring quest was stored again when its due date moved
+    reads["search categories"] = db.search_quest_ids(avatar.id, "con")
+    db.rename_tag("errand", "chore")
+    db.rename_category(db.get_category_id("reflexion"), "reflection")
+
+    reads["quests"] = db.get_avatar_quests(avatar, sort_key="due_date", descending=True)
+    for sort_key, descending, filters in [("id", False, {}), ("exp_amount", True, {}),
+                                          ("due_date", False, {"due_range": (TODAY, None)}),
+                                          ("quest_name", False, {"completed": False, "tags": ["home"]})]:
+        pages, cursor = [], None
+        while True:
+            page, cursor = db.get_avatar_quests_page(avatar.id, after=cursor, limit=2, sort_key=sort_key,
+                                                     descending=descending, **filters)
+            pages.append([quest["id"] for quest in page])
+            if cursor is None:
+                break
+        reads[f"pages {sort_key}"] = pages
+    reads["agenda"] = db.get_agenda(avatar.id, today=TODAY)
+    reads["search"] = db.search_quest_ids(avatar.id, "rea")
+    reads["search tags"] = db.search_quest_ids(avatar.id, "fam", tags=["daily"])
+    reads["by ids"] = db.get_quests_by_ids(quest_ids[::-1] + [recurring_id])
+    reads["tags"] = db.get_tags(avatar.id), db.get_tags(with_counts=False)
+    reads["quest tags"] = db.get_quest_tags(quest_ids + [recurring_id])
+    reads["occurrences"] = db.get_occurrences(avatar.id, TODAY, TODAY + 2 * day)
+    reads["history"] = [(row["category_name"], row["exp"], row["completions"]) for row in db.get_xp_history(avatar.id)]
+    reads["exp"] = db.get_avatar_experience_by_category(avatar.id)
+
+    reads["purged"] = db.purge_deleted(older_than=datetime.timedelta(0), vacuum=False)
+    reads["after purge"] = db.get_avatar_quests(avatar), db.get_tags()
+    reads["drift"] = db.check_experience()
+    return reads
+
+
+@pytest.mark.parametrize("kind", ["memory", "write-through"])
+def test_the_memory_backends_read_like_sql(tmp_path, kind):
+    results = {}
+    for backend_kind in ("sql", kind):
+        backend = make_backend(backend_kind, tmp_path)
+        results[backend_kind] = scenario(DataManager(backend=backend))
+        backend.dispose()
+
+    assert results[kind] == results["sql"]
+    assert results["sql"]["drift"] == []
+
+
+def test_memory_reads_run_no_sql(tmp_path):
+    backend = make_backend("memory", tmp_path)
+    db = DataManager(backend=backend)
+    avatar = db.get_avatar()
+    db.get_avatar_quests(avatar)  # Loads the memory copy, the writes then update it
+    quest_id = db.add_quest(avatar.id, "read", "wisdom", 10, TODAY.isoformat(), tags=["home"])
+    db.toggle_quest(quest_id)
+
+    statements = []
+    event.listen(backend.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    quests, _ = db.get_avatar_quests_page(avatar.id, tags=["home"])
+    assert [quest["completed"] for quest in quests] == [True]
+    assert db.search_quest_ids(avatar.id, "rea") == [quest_id]
+    assert db.get_agenda(avatar.id, today=TODAY)["today"] == []
+    assert db.get_quest_tags([quest_id]) == {quest_id: ["home"]}
+    assert statements == []
+
+
+def test_write_through_sees_other_writers_after_a_reload(tmp_path):
+    backend = make_backend("write-through", tmp_path)
+    db = DataManager(backend=backend)
+    other = DataManager(backend=backend.backing)
+    avatar = db.get_avatar()
+    db.get_avatar_quests(avatar)  # Loads the memory copy
+
+    quest_id = other.add_quest(avatar.id, "read", "wisdom", 10)
+    assert db.get_avatar_quests(avatar) == []
+    backend.reload()
+    assert [quest["id"] for quest in db.get_avatar_quests(avatar)] == [quest_id]
+    backend.backing.dispose()
+
+
+@pytest.mark.parametrize("kind", ["sql", "memory"])
+@pytest.mark.parametrize("limit", [0, -1])
+def test_a_page_limit_below_one_is_refused(tmp_path, kind, limit):
+    backend = make_backend(kind, tmp_path)
+    db = DataManager(backend=backend)
+    avatar = db.get_avatar()
+    db.add_quest(avatar.id, "read", "wisdom", 10)
+
+    with pytest.raises(ValueError):
+        db.get_avatar_quests_page(avatar.id, limit=limit)
+    backend.dispose()
@@ -0,0 +1,14 @@
+def test_bulk_import_applies_the_exp_of_completed_quests(db):
+    avatar = db.get_avatar()
+    inserted = db.bulk_add_quests([
+        {"avatar_id": avatar.id, "quest_name": "done", "category_name": "wisdom", "exp_amount": 30, "completed": True},
+        {"avatar_id": avatar.id, "quest_name": "done too", "category_name": "family", "exp_amount": 20,
+         "completed": True},
+        {"avatar_id": avatar.id, "quest_name": "open", "category_name": "wisdom", "exp_amount": 50},
+    ], batch_size=2)
+
+    assert inserted == 3
+    experience = db.get_avatar_experience_by_category(avatar.id)
+    assert (experience["wisdom"], experience["family"]) == (30, 20)
+    assert db.get_avatar(avatar.id).experience == 50
+    assert db.check_experience() == []
@@ -0,0 +1,44 @@
+import pytest
+from sqlalchemy import event
+
+
+# Number of SQL statements run by `call` on the engine of the DataManager
+def count_statements(db, call):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.backend.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        call()
+    finally:
+        event.remove(db.backend.engine, "before_cursor_execute", before_cursor_execute)
+    return len(statements)
+
+
+def add_quests(db, avatar_id, count):
+    db.bulk_add_quests(
+        {"avatar_id": avatar_id, "quest_name": f"quest {index}", "category_name": "wisdom", "exp_amount": 10}
+        for index in range(count)
+    )
+
+
+@pytest.mark.parametrize("quest_count", [5, 55])
+def test_quest_lists_use_one_statement(db, quest_count):
+    avatar = db.get_avatar()
+    add_quests(db, avatar.id, quest_count)
+    quest_ids = [quest["id"] for quest in db.get_avatar_quests(avatar)]
+    assert len(quest_ids) == quest_count
+
+    assert count_statements(db, lambda: db.get_avatar_quests(avatar)) == 1
+    assert count_statements(db, lambda: db.get_avatar_quests_page(avatar.id)) == 1
+    assert count_statements(db, lambda: db.get_quests_by_ids(quest_ids)) == 1
+
+
+def test_quest_rows_carry_their_category(db):
+    avatar = db.get_avatar()
+    add_quests(db, avatar.id, 3)
+    records = db.get_avatar_quests(avatar, as_records=True)
+    assert [record.category_name for record in records] == ["wisdom"] * 3
+    assert [record.quest_name for record in records] == ["quest 0", "quest 1", "quest 2"]
@@ -0,0 +1,91 @@
+import asyncio
+import pytest
+from server import ApiServer, ApiError, Request, read_request, is_loopback
+
+
+def read(raw):
+    async def parse():
+        reader = asyncio.StreamReader()
+        reader.feed_data(raw)
+        reader.feed_eof()
+        return await read_request(reader)
+    return asyncio.run(parse())
+
+
+def call(api, method, path, body=None):
+    return asyncio.run(api.dispatch(Request(method, path, {}, body)))
+
+
+@pytest.fixture
+def api(db):
+    server = ApiServer(data_manager=db, workers=1)
+    yield server
+    server.close()
+
+
+@pytest.mark.parametrize("length", [b"abc", b"-1"])
+def test_an_invalid_content_length_is_a_bad_request(length):
+    with pytest.raises(ApiError) as error:
+        read(b"POST /quests HTTP/1.1\r\nContent-Length: " + length + b"\r\n\r\n{}")
+    assert error.value.status == 400
+
+
+def test_batch_delete_and_restore_always_return_a_count(api, db):
+    quest_id = db.add_quest(db.get_avatar().id, "quest", "wisdom", 10)
+
+    assert call(api, "POST", "/quests/delete", {"ids": [quest_id]}) == (200, {"removed": 1})
+    assert call(api, "POST", "/quests/delete", {"ids": [quest_id]}) == (200, {"removed": 0})
+    assert call(api, "POST", "/quests/restore", {"ids": [quest_id]}) == (200, {"restored": 1})
+    assert call(api, "POST", "/quests/restore", {"ids": [quest_id]}) == (200, {"restored": 0})
+
+
+def test_a_deleted_quest_is_not_toggled(api, db):
+    quest_id = db.add_quest(db.get_avatar().id, "quest", "wisdom", 10)
+    call(api, "DELETE", f"/quests/{quest_id}")
+
+    with pytest.raises(ApiError) as error:
+        call(api, "POST", f"/quests/{quest_id}/toggle")
+    assert error.value.status == 400
+    assert db.get_avatar_experience_by_category(db.get_avatar().id)["wisdom"] == 0
+
+
+def test_only_loopback_hosts_are_local():
+    assert is_loopback("127.0.0.1") and is_loopback("::1") and is_loopback("localhost")
+    assert not is_loopback("0.0.0.0") and not is_loopback("192.168.1.10") and not is_loopback("example.org")
+
+
+@pytest.mark.parametrize("fields, status", [
+    ({"exp_amount": "abc"}, 400),
+    ({"exp_amount": True}, 400),
+    ({"avatar_id": "1"}, 400),
+    ({"title": 12}, 400),
+    ({"category_name": None}, 400),
+    ({"due_date": 20260301}, 400),
+    ({"due_date": "next monday"}, 400),
+    ({"tags": "home"}, 400),
+    ({"avatar_id": 999}, 404),
+])
+def test_an_invalid_quest_is_refused_before_any_write(api, db, fields, status):
+    avatar = db.get_avatar()
+    body = {"avatar_id": avatar.id, "title": "quest", "category_name": "wisdom", "exp_amount": 10, **fields}
+
+    with pytest.raises(ApiError) as error:
+        call(api, "POST", "/quests", body)
+    assert error.value.status == status
+    assert list(db.iter_quests()) == []
+
+
+def test_a_valid_quest_is_created(api, db):
+    avatar = db.get_avatar()
+    status, result = call(api, "POST", "/quests", {"avatar_id": avatar.id, "title": "quest", "category_name": "wisdom",
+                                                   "exp_amount": 10, "due_date": "2026-03-01", "tags": ["home"]})
+    assert status == 201
+    assert [quest["id"] for quest in db.get_avatar_quests(avatar)] == [result["id"]]
+
+
+@pytest.mark.parametrize("path", ["/avatars/1/quests", "/avatars/1/search"])
+@pytest.mark.parametrize("limit", ["0", "-5"])
+def test_a_page_limit_below_one_is_a_bad_request(api, path, limit):
+    with pytest.raises(ApiError) as error:
+        asyncio.run(api.dispatch(Request("GET", path, {"limit": limit, "q": "quest"}, None)))
+    assert error.value.status == 400
@@ -0,0 +1,49 @@
+import datetime
+from sqlalchemy import text
+from models.backends import SqlBackend
+from models.data_manager import DataManager
+from models.migrations import migrate
+
+
+def test_deleted_quests_cannot_be_toggled(db):
+    avatar = db.get_avatar()
+    quest_id = db.add_quest(avatar.id, "quest", "wisdom", 10)
+    other_id = db.add_quest(avatar.id, "other", "wisdom", 10)
+    db.remove_quest(quest_id)
+
+    assert db.toggle_quest(quest_id) is None
+    assert db.toggle_quests([other_id, quest_id]) is None
+    assert db.complete_quests([quest_id]) == []
+    assert db.get_avatar_experience_by_category(avatar.id)["wisdom"] == 0
+
+    db.restore_quests([quest_id])
+    assert db.toggle_quest(quest_id)["completed"] is True
+
+
+def test_purged_quests_keep_their_exp(db):
+    avatar = db.get_avatar()
+    quest_id = db.add_quest(avatar.id, "quest", "wisdom", 10)
+    db.toggle_quest(quest_id)
+    db.remove_quest(quest_id)
+
+    assert db.purge_deleted(older_than=datetime.timedelta(0), vacuum=False) == 1
+    assert db.get_avatar_experience_by_category(avatar.id)["wisdom"] == 10
+    assert db.check_experience() == []
+    assert db.check_experience(repair=True) == []
+    assert db.get_avatar(avatar.id).experience == 10
+
+
+def test_migration_counts_the_exp_already_purged(tmp_path):
+    backend = SqlBackend(f"sqlite:///{tmp_path / 'old.db'}")
+    migrate(target=12, bind=backend.engine)
+    with backend.begin() as connection:
+        connection.execute(text("INSERT INTO avatar (id, name, level, experience) VALUES (1, 'old', 1, 25)"))
+        connection.execute(text("INSERT INTO categories (id, category_name) VALUES (1, 'wisdom')"))
+        connection.execute(text("INSERT INTO avatar_category (avatar_id, category_id, exp_points) VALUES (1, 1, 25)"))
+        connection.execute(text(
+            "INSERT INTO quests (avatar_id, quest_name, category_id, completed, exp_amount) VALUES (1, 'kept', 1, 1, 5)"
+        ))
+
+    backend.setup()
+    assert DataManager(backend=backend).check_experience() == []
+    backend.dispose()
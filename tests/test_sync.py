@@ -0,0 +1,145 @@
+import datetime
+import pytest
+from models.backends import SqlBackend
+from models.data_manager import DataManager
+
+
+@pytest.fixture
+def devices(tmp_path):
+    backends = [SqlBackend(f"sqlite:///{tmp_path / name}.db") for name in ("a", "b")]
+    for backend in backends:
+        backend.setup()
+    yield [DataManager(backend=backend) for backend in backends]
+    for backend in backends:
+        backend.dispose()
+
+
+# Send the changes of `source` that `target` has not imported yet
+def sync(source, target):
+    device_id = source.get_sync_state()["device_id"]
+    header, changes = source.export_changes(since=target.get_sync_state()["peers"].get(device_id, 0))
+    return target.import_changes(header, list(changes))
+
+
+def exp(device, avatar_id, category_name="wisdom"):
+    return device.get_avatar_experience_by_category(avatar_id)[category_name]
+
+
+def test_default_avatars_are_one_avatar(devices):
+    device_a, device_b = devices
+    avatar_id = device_a.get_avatar().id
+    quest_id = device_a.add_quest(avatar_id, "read", "wisdom", 10)
+    device_a.toggle_quest(quest_id)
+
+    sync(device_a, device_b)
+    sync(device_b, device_a)
+
+    for device in devices:
+        assert len(device.list_avatars()) == 1
+        assert [quest["quest_name"] for quest in device.get_avatar_quests(device.get_avatar())] == ["read"]
+        assert exp(device, device.get_avatar().id) == 10
+        assert device.check_experience() == []
+
+
+def test_concurrent_toggles_converge(devices):
+    device_a, device_b = devices
+    quest_id = device_a.add_quest(device_a.get_avatar().id, "read", "wisdom", 10)
+    sync(device_a, device_b)
+    quest_b = device_b.get_avatar_quests(device_b.get_avatar())[0]["id"]
+
+    device_a.toggle_quest(quest_id)
+    device_b.toggle_quest(quest_b)
+    device_b.toggle_quest(quest_b)
+    sync(device_a, device_b)
+    sync(device_b, device_a)
+
+    states = [device.get_avatar_quests(device.get_avatar())[0]["completed"] for device in devices]
+    assert states[0] == states[1]
+    assert [exp(device, device.get_avatar().id) for device in devices] == [10 if states[0] else 0] * 2
+    for device in devices:
+        assert device.check_experience() == []
+
+
+def test_an_occurrence_completed_on_both_devices_is_counted_once(devices):
+    device_a, device_b = devices
+    start = datetime.date(2026, 1, 5)
+    template_a = device_a.add_recurring_quest(device_a.get_avatar().id, "run", "constitution", 5, start, "daily")
+    sync(device_a, device_b)
+    template_b = device_b.get_avatar_quests(device_b.get_avatar())[0]["id"]
+
+    device_a.complete_occurrences(template_a, [start])
+    device_b.complete_occurrences(template_b, [start])
+    sync(device_a, device_b)
+    sync(device_b, device_a)
+
+    for device in devices:
+        avatar_id = device.get_avatar().id
+        occurrences = device.get_occurrences(avatar_id, start, start)
+        assert [occurrence["completed"] for occurrence in occurrences] == [True]
+        assert exp(device, avatar_id, "constitution") == 5
+        assert device.check_experience() == []
+
+
+def test_an_import_keeps_the_exp_of_purged_quests(devices):
+    device_a, device_b = devices
+    avatar_id = device_a.get_avatar().id
+    quest_id = device_a.add_quest(avatar_id, "read", "wisdom", 10)
+    device_a.toggle_quest(quest_id)
+    device_a.remove_quest(quest_id)
+    device_a.purge_deleted(older_than=datetime.timedelta(0), vacuum=False)
+
+    device_b.add_quest(device_b.get_avatar().id, "write", "wisdom", 20)
+    sync(device_b, device_a)
+
+    assert exp(device_a, avatar_id) == 10
+    assert device_a.get_avatar(avatar_id).experience == 10
+    assert device_a.check_experience() == []
+
+
+def test_a_purge_on_the_other_device_keeps_the_exp(devices):
+    device_a, device_b = devices
+    quest_id = device_a.add_quest(device_a.get_avatar().id, "read", "wisdom", 10)
+    device_a.toggle_quest(quest_id)
+    sync(device_a, device_b)
+
+    device_a.remove_quest(quest_id)
+    device_a.purge_deleted(older_than=datetime.timedelta(0), vacuum=False)
+    sync(device_a, device_b)
+
+    avatar_id = device_b.get_avatar().id
+    assert device_b.get_avatar_quests(device_b.get_avatar()) == []
+    assert exp(device_b, avatar_id) == 10
+    assert device_b.check_experience() == []
+
+
+def test_an_occurrence_uncompleted_on_the_other_device_takes_its_exp_back(devices):
+    device_a, device_b = devices
+    start = datetime.date(2026, 1, 5)
+    template_a = device_a.add_recurring_quest(device_a.get_avatar().id, "run", "constitution", 5, start, "daily")
+    device_a.complete_occurrences(template_a, [start])
+    sync(device_a, device_b)
+    assert exp(device_b, device_b.get_avatar().id, "constitution") == 5
+
+    device_a.uncomplete_occurrence(template_a, start)
+    sync(device_a, device_b)
+
+    assert exp(device_b, device_b.get_avatar().id, "constitution") == 0
+    assert device_b.check_experience() == []
+
+
+def test_migration_shares_the_uid_of_an_existing_default_avatar(tmp_path):
+    from sqlalchemy import text
+    from models.database import DEFAULT_AVATAR_UID
+    from models.migrations import migrate
+
+    backend = SqlBackend(f"sqlite:///{tmp_path / 'old.db'}")
+    migrate(target=13, bind=backend.engine)
+    with backend.begin() as connection:
+        connection.execute(text("INSERT INTO avatar (name, level, experience) VALUES ('me', 1, 0)"))
+    backend.setup()
+
+    with backend.begin() as connection:
+        assert connection.execute(text("SELECT uid FROM avatar")).scalars().all() == [DEFAULT_AVATAR_UID]
+        assert connection.execute(text("SELECT uid FROM sync_journal WHERE table_name = 'avatar'")).scalar() \
+            == DEFAULT_AVATAR_UID
+    backend.dispose()
@@ -0,0 +1,28 @@
+import datetime
+
+
+def test_a_recurring_quest_is_tagged_in_the_same_write(db):
+    avatar = db.get_avatar()
+    version = db.get_sync_state()["version"]
+    quest_id = db.add_recurring_quest(avatar.id, "run", "constitution", 5, datetime.date(2026, 1, 5), "daily",
+                                      tags=["Sport", " morning "])
+
+    assert db.get_quest_tags([quest_id]) == {quest_id: ["morning", "sport"]}
+    quests, _ = db.get_avatar_quests_page(avatar.id, tags=["sport"])
+    assert [quest["id"] for quest in quests] == [quest_id]
+    # One transaction: the quest is journaled with its tags, once
+    header, changes = db.export_changes(since=version)
+    assert [(change["table"], change["tags"]) for change in changes if change["table"] == "quests"] == \
+        [("quests", ["morning", "sport"])]
+
+
+def test_tag_filters_keep_the_quests_carrying_every_tag(db):
+    avatar = db.get_avatar()
+    both = db.add_quest(avatar.id, "both", "wisdom", 1, tags=["a", "b"])
+    db.add_quest(avatar.id, "only a", "wisdom", 1, tags=["a"])
+    db.add_quest(avatar.id, "none", "wisdom", 1)
+
+    quests, _ = db.get_avatar_quests_page(avatar.id, tags=["a", "b"])
+    assert [quest["id"] for quest in quests] == [both]
+    assert db.get_avatar_quests_page(avatar.id, tags=["unknown"]) == ([], None)
+    assert [(tag.name, tag.quest_count) for tag in db.get_tags(avatar.id)] == [("a", 2), ("b", 1)]
@@ -0,0 +1,117 @@
+import queue
+import threading
+from models.data_manager import DataManager
+from models.write_queue import WriteQueue
+
+
+class BlockingDataManager(DataManager):
+    # Holds the writer thread until `event` is set, the writes queued meanwhile wait behind it
+    def wait_for(self, event):
+        event.wait(timeout=10)
+
+
+# Callbacks handed to a fake dispatcher, run by `pump` on the test thread like the Kivy Clock would
+class MainLoop:
+    def __init__(self):
+        self.delivered = queue.Queue()
+
+    def dispatch(self, deliver):
+        self.delivered.put(deliver)
+
+    def pump(self, expected):
+        for _ in range(expected):
+            self.delivered.get(timeout=10)()
+
+
+def make_writer(db):
+    loop = MainLoop()
+    writer = WriteQueue(BlockingDataManager(backend=db.backend), dispatch=loop.dispatch)
+    return writer, loop
+
+
+def test_writes_are_applied_in_order_and_delivered_on_the_main_thread(db):
+    writer, loop = make_writer(db)
+    avatar = db.get_avatar()
+    main_thread = threading.current_thread()
+    delivered = []
+
+    def on_added(quest_id):
+        assert threading.current_thread() is main_thread
+        delivered.append(quest_id)
+
+    for index in range(5):
+        writer.add_quest(avatar.id, f"quest {index}", "wisdom", 10, callback=on_added)
+    loop.pump(5)
+    writer.close()
+
+    assert delivered == sorted(delivered)
+    assert [quest["quest_name"] for quest in db.get_quests_by_ids(delivered)] == [f"quest {index}" for index in range(5)]
+
+
+def test_waiting_toggles_of_a_quest_are_folded(db):
+    writer, _ = make_writer(db)
+    avatar = db.get_avatar()
+    quest_id = db.add_quest(avatar.id, "quest", "wisdom", 10)
+
+    release = threading.Event()
+    writer.submit("wait_for", release)
+    futures = [writer.toggle_quest(quest_id) for _ in range(3)]
+    release.set()
+
+    assert [future.result(timeout=10)["completed"] for future in futures] == [True] * 3
+    writer.close()
+    assert db.get_avatar_experience_by_category(avatar.id)["wisdom"] == 10
+    # A single toggle was written
+    assert len(db.get_completion_events(avatar.id)) == 1
+
+
+def test_an_even_number_of_toggles_writes_nothing(db):
+    writer, _ = make_writer(db)
+    avatar = db.get_avatar()
+    quest_id = db.add_quest(avatar.id, "quest", "wisdom", 10)
+
+    release = threading.Event()
+    writer.submit("wait_for", release)
+    futures = [writer.toggle_quest(quest_id) for _ in range(2)]
+    release.set()
+
+    assert [future.result(timeout=10) for future in futures] == [{"id": quest_id, "completed": False, "exp_delta": 0}] * 2
+    writer.close()
+    assert db.get_completion_events(avatar.id) == []
+
+
+def test_toggles_of_several_quests_are_batched(db):
+    writer, _ = make_writer(db)
+    avatar = db.get_avatar()
+    quest_ids = [db.add_quest(avatar.id, f"quest {index}", "wisdom", 10) for index in range(3)]
+
+    release = threading.Event()
+    writer.submit("wait_for", release)
+    futures = writer.toggle_quests(quest_ids)
+    release.set()
+
+    results = [future.result(timeout=10) for future in futures]
+    writer.close()
+    assert [result["id"] for result in results] == quest_ids
+    assert all(result["completed"] for result in results)
+    # toggle_quests reports the category totals after the whole batch
+    assert {result["exp_points"] for result in results} == {30}
+
+
+def test_a_toggle_queued_after_another_write_is_not_folded_into_the_earlier_ones(db):
+    writer, _ = make_writer(db)
+    avatar = db.get_avatar()
+    quest_id = db.add_quest(avatar.id, "quest", "wisdom", 10)
+
+    release = threading.Event()
+    writer.submit("wait_for", release)
+    first = writer.toggle_quest(quest_id)
+    renamed = writer.update_avatar_name(avatar.id, "renamed")
+    second = writer.toggle_quest(quest_id)
+    release.set()
+
+    assert first.result(timeout=10)["completed"] is True
+    assert renamed.result(timeout=10) is True
+    assert second.result(timeout=10)["completed"] is False
+    writer.close()
+    assert [event["exp_delta"] for event in db.get_completion_events(avatar.id)] == [-10, 10]